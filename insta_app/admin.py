@@ -31,12 +31,15 @@ class CommentLikeInline(admin.TabularInline):
 
 class UserProfileAdmin(admin.ModelAdmin):
     inlines = [FollowingInline, FollowerInline]
+    readonly_fields = ['followers_count', 'following_count', 'posts_count']
 
 class PostAdmin(admin.ModelAdmin):
     inlines = [PostContentInline, PostLikeInline]
+    readonly_fields = ['likes_count', 'comments_count']
 
 class CommentAdmin(admin.ModelAdmin):
     inlines = [CommentLikeInline]
+    readonly_fields = ['likes_count']
 
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Post, PostAdmin)
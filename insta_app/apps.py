@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class InstaAppConfig(AppConfig):
     name = 'insta_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,146 @@
+import asyncio
+from functools import partial, wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+from .models import UserProfile, Post, PostContent
+from .serializers import PostDetailSerializer, UserProfileDetailSerializer, sparse_variant, wants_field
+from .comment_tree import load_post_comments, parse_tree_options
+from .viewer import liked_post_ids, liked_comment_ids, following_ids
+from .response_cache import acached_representation, aget_stamps
+from .db_router import read_from_replica, read_from_primary
+from .views import (PostListAPIView, FeedAPIView, walk_comment_data, comment_viewer_keys,
+                    set_comment_viewer_fields, post_cache_dependencies)
+
+
+# Асинхронные версии горячих GET-эндпоинтов для ASGI. Ответы совпадают с синхронными
+# представлениями (те же сериализаторы, пагинация и кэш), но независимые запросы
+# выполняются одновременно, а ожидание БД не занимает поток воркера.
+def _isolated(func):
+    # Отдельный поток - отдельное соединение; закрываем его по правилам CONN_MAX_AGE
+    def run():
+        close_old_connections()
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def run_queries(*funcs):
+    # ASYNC_PARALLEL_QUERIES = False - по очереди в общем потоке ORM (например, для SQLite)
+    if getattr(settings, 'ASYNC_PARALLEL_QUERIES', True):
+        return await asyncio.gather(*(sync_to_async(_isolated(func), thread_sensitive=False)()
+                                      for func in funcs))
+    return [await sync_to_async(func)() for func in funcs]
+
+
+def render(data, status=200):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+
+def async_api_view(view):
+    # Обёртка DRF Request без синхронного dispatch: пользователь - теми же классами
+    # аутентификации, что и в синхронных представлениях (JWT, сессия, Basic),
+    # ошибки DRF и Http404 превращаются в ответы обычным exception_handler
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        drf_request = Request(request, authenticators=authenticators)
+        try:
+            await sync_to_async(lambda: drf_request.user)()
+            # Контекст копируется в потоки sync_to_async вместе с флагом реплики
+            with read_from_replica():
+                return render(await view(drf_request, *args, **kwargs))
+        except (APIException, Http404) as exc:
+            response = exception_handler(exc, {'request': drf_request})
+            return render(response.data, response.status_code)
+    return require_safe(wrapper)
+
+
+async def post_page(request, view_class):
+    view = view_class(request=request, args=(), kwargs={}, format_kwarg=None)
+    view.check_permissions(request)
+
+    def load_page():
+        return view.paginate_queryset(view.filter_queryset(view.get_queryset()))
+
+    page = await sync_to_async(load_page)()
+    context = view.get_serializer_context()
+    serializer = view.get_serializer_class()(page, many=True, context=context)
+    # Состояние зрителя - только для полей, оставшихся после ?fields=
+    fields = serializer.child.fields
+    liked, following = await run_queries(
+        partial(liked_post_ids, request.user, {post.id for post in page} if 'is_liked' in fields else ()),
+        partial(following_ids, request.user,
+                {post.user_id for post in page if post.user_id} if 'is_following' in fields else ()),
+    )
+    context.update({'liked_post_ids': liked, 'following_ids': following})
+    data = serializer.data
+    return view.paginator.get_paginated_response(data).data
+
+
+@async_api_view
+async def post_list(request):
+    return await post_page(request, PostListAPIView)
+
+
+@async_api_view
+async def feed(request):
+    return await post_page(request, FeedAPIView)
+
+
+@async_api_view
+async def post_detail(request, pk):
+    options = parse_tree_options(request.query_params)
+
+    async def build():
+        with read_from_primary():
+            post, contents, comments = await run_queries(
+                lambda: Post.objects.select_related('user').filter(pk=pk).first(),
+                lambda: list(PostContent.objects.filter(post_id=pk)) if wants_field(request, 'contents') else [],
+                lambda: load_post_comments(Post(pk=pk), **options) if wants_field(request, 'comments') else [],
+            )
+        if post is None:
+            raise Http404('Пост не найден')
+        post.loaded_contents = contents
+        post.loaded_comments = comments
+        dep_stamps = await aget_stamps(post_cache_dependencies(post))
+        context = {'request': request, 'format': None, 'view': None, 'comment_tree': options}
+        return PostDetailSerializer(post, context=context).data, dep_stamps
+
+    variant = f"{request.build_absolute_uri('/')}|{sorted(options.items())}{sparse_variant(request)}"
+    data = dict(await acached_representation('post', pk, variant, build))
+
+    comments = list(walk_comment_data(data.get('comments', [])))
+    comment_ids, author_ids = comment_viewer_keys(comments)
+    liked_posts, liked_comments, following = await run_queries(
+        partial(liked_post_ids, request.user, [pk] if 'is_liked' in data else []),
+        partial(liked_comment_ids, request.user, comment_ids),
+        partial(following_ids, request.user, author_ids),
+    )
+    if 'is_liked' in data:
+        data['is_liked'] = pk in liked_posts
+    set_comment_viewer_fields(comments, liked_comments, following)
+    return data
+
+
+@async_api_view
+async def user_detail(request, pk):
+    async def build():
+        with read_from_primary():
+            user = await UserProfile.objects.filter(pk=pk).afirst()
+        if user is None:
+            raise Http404('Пользователь не найден')
+        context = {'request': request, 'format': None, 'view': None}
+        return UserProfileDetailSerializer(user, context=context).data, {}
+
+    return await acached_representation('user', pk, request.build_absolute_uri('/') + sparse_variant(request),
+                                        build)
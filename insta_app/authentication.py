@@ -0,0 +1,201 @@
+import copy
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+# JWT без обращения к базе на каждый запрос: пользователь берётся из кэша процесса
+# по (id, версия токена), отзыв проверяется фильтром Блума в памяти, а в таблицу
+# BlacklistedToken идём только при срабатывании фильтра (он может ошибаться только в «да»).
+# Версия токена - хэш пароля (SIMPLE_JWT CHECK_REVOKE_TOKEN): после смены пароля
+# старые токены не попадают в кэш и отклоняются при проверке. Токены, выданные до
+# включения версии и sid, принимаются без этих проверок до истечения срока (не дольше
+# ACCESS_TOKEN_LIFETIME, а новые access из старого refresh - REFRESH_TOKEN_LIFETIME),
+# чтобы выкладка не разлогинила всех клиентов разом.
+SESSION_CLAIM = 'sid'
+
+
+class SessionRefreshToken(RefreshToken):
+    # jti refresh-токена переходит в access-токены как sid: выход из сеанса
+    # отзывает и уже выданные access-токены, а не только refresh
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[SESSION_CLAIM] = token[api_settings.JTI_CLAIM]
+        return token
+
+
+# ========== ФИЛЬТР БЛУМА ==========
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1000)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Двойное хэширование: k позиций из двух половин одного blake2b
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TokenBlacklist:
+    # Полная пересборка из BlacklistedToken (без истёкших) раз в JWT_BLACKLIST_REBUILD секунд,
+    # между ними - догрузка новых строк по id раз в JWT_BLACKLIST_REFRESH секунд
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.refreshed_at = 0.0
+        self.rebuilt_at = 0.0
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+
+    def _rows(self, queryset):
+        return queryset.order_by('id').values_list('id', 'token__jti')
+
+    def _rebuild(self, now):
+        rows = list(self._rows(BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())))
+        bloom = BloomFilter(len(rows) * 2)
+        for _, jti in rows:
+            bloom.add(jti)
+        self.filter = bloom
+        self.last_id = max((row_id for row_id, _ in rows), default=self.last_id)
+        self.refreshed_at = self.rebuilt_at = now
+
+    def _refresh(self, now):
+        for row_id, jti in self._rows(BlacklistedToken.objects.filter(id__gt=self.last_id)):
+            self.filter.add(jti)
+            self.last_id = row_id
+        self.refreshed_at = now
+
+    def current(self):
+        now = time.monotonic()
+        if (self.filter is not None and now - self.refreshed_at < getattr(settings, 'JWT_BLACKLIST_REFRESH', 30)):
+            return self.filter
+        with self.lock:
+            if (self.filter is None or self.filter.count > self.filter.capacity
+                    or now - self.rebuilt_at >= getattr(settings, 'JWT_BLACKLIST_REBUILD', 3600)):
+                self._rebuild(now)
+            elif now - self.refreshed_at >= getattr(settings, 'JWT_BLACKLIST_REFRESH', 30):
+                self._refresh(now)
+            return self.filter
+
+    def add(self, jti):
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+    def contains(self, jti):
+        if jti not in self.current():
+            return False
+        # Возможное ложное срабатывание фильтра - проверяем точно
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+blacklist = TokenBlacklist()
+
+
+def revoke(refresh_token):
+    # Выход: refresh-токен в BlacklistedToken, sid сразу в фильтр этого процесса
+    token = SessionRefreshToken(refresh_token)
+    token.blacklist()
+    blacklist.add(token[api_settings.JTI_CLAIM])
+
+
+# ========== КЭШ ПОЛЬЗОВАТЕЛЕЙ ==========
+class UserCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        with self.lock:
+            self.entries[key] = (user, time.monotonic() + getattr(settings, 'JWT_USER_CACHE_TTL', 30))
+            self.entries.move_to_end(key)
+            while len(self.entries) > getattr(settings, 'JWT_USER_CACHE_SIZE', 10000):
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            # В токене id - строка
+            for key in [key for key in self.entries if key[0] == str(user_id)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache()
+
+
+# ========== АУТЕНТИФИКАЦИЯ ==========
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        session = token.get(SESSION_CLAIM)
+        if session is not None and blacklist.contains(session):
+            raise InvalidToken('Токен отозван')
+        return token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        key = (str(user_id), validated_token.get(api_settings.REVOKE_TOKEN_CLAIM))
+        user = user_cache.get(key) if user_id is not None else None
+        if user is None:
+            # Полная проверка (активность, версия) - только при промахе кэша
+            if key[1] is None:
+                user = self.get_unversioned_user(validated_token)
+            else:
+                user = super().get_user(validated_token)
+            user_cache.set(key, user)
+        # Каждому запросу своя копия: представления могут менять request.user
+        return copy.copy(user)
+
+    def get_unversioned_user(self, validated_token):
+        # Токен старого формата без версии пароля: те же проверки, кроме версии
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('В токене нет идентификатора пользователя')
+        user = self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            raise AuthenticationFailed('Пользователь не найден', code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен', code='user_inactive')
+        return user
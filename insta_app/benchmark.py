@@ -0,0 +1,239 @@
+import json
+import math
+import random
+import time
+from contextlib import ExitStack
+from django.db import connections
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import translation
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .models import UserProfile, Post, Hashtag
+from .authentication import SessionRefreshToken, CachedJWTAuthentication, user_cache, blacklist
+
+
+# Прогон смеси запросов к API внутри процесса (без сети и сервера): по каждому
+# эндпоинту - перцентили времени ответа и число SQL-запросов на запрос.
+# Сравнение с сохранённым прогоном (--baseline) показывает эффект изменения.
+class Endpoint:
+    def __init__(self, name, weight, url, method='get', auth=False):
+        self.name = name
+        self.weight = weight
+        self.url = url
+        self.method = method
+        self.auth = auth
+
+
+def _post_url(name):
+    return lambda sample: reverse(name, args=[sample.post_id()])
+
+
+def _user_url(name):
+    return lambda sample: reverse(name, args=[sample.user_id()])
+
+
+COMPACT_POST_FIELDS = 'id,likes_count,comments_count'
+
+ENDPOINTS = [
+    Endpoint('post_list', 25, lambda sample: reverse('post_list')),
+    Endpoint('post_detail', 20, _post_url('post_detail')),
+    # Мобильный клиент: только id и счётчики (?fields=)
+    Endpoint('post_list_compact', 5, lambda sample: f"{reverse('post_list')}?fields={COMPACT_POST_FIELDS}"),
+    Endpoint('post_detail_compact', 5,
+             lambda sample: f"{reverse('post_detail', args=[sample.post_id()])}?fields={COMPACT_POST_FIELDS}"),
+    Endpoint('feed', 20, lambda sample: reverse('feed'), auth=True),
+    Endpoint('user_detail', 10, _user_url('user_detail')),
+    Endpoint('user_list', 5, lambda sample: reverse('user_list')),
+    Endpoint('user_search', 3, lambda sample: f"{reverse('user_list')}?search={sample.word()}"),
+    Endpoint('hashtag_posts', 5, lambda sample: reverse('hashtag_posts', args=[sample.hashtag()])),
+    Endpoint('trending', 3, lambda sample: reverse('trending')),
+    Endpoint('post_like', 3, _post_url('post_like'), method='post', auth=True),
+    Endpoint('post_unlike', 2, _post_url('post_like'), method='delete', auth=True),
+    Endpoint('notifications', 3, lambda sample: reverse('notification-list'), auth=True),
+    Endpoint('unread_count', 5, lambda sample: reverse('notification-unread-count'), auth=True),
+    Endpoint('async_post_list', 2, lambda sample: reverse('async_post_list')),
+    Endpoint('async_post_detail', 2, _post_url('async_post_detail')),
+]
+
+
+class Sample:
+    # Случайная выборка объектов для подстановки в URL; порядок обращений задаёт seed
+    def __init__(self, rng, size=1000):
+        self.rng = rng
+        self.post_ids = list(Post.objects.order_by('?').values_list('pk', flat=True)[:size])
+        self.user_ids = list(UserProfile.objects.order_by('?').values_list('pk', flat=True)[:size])
+        self.hashtags = list(Hashtag.objects.order_by('?').values_list('name', flat=True)[:size]) or ['none']
+        self.post_ids.sort()
+        self.user_ids.sort()
+        self.hashtags.sort()
+        if not self.post_ids or not self.user_ids:
+            raise ValueError('Нет данных для прогона: сначала выполните seed_synthetic')
+
+    def post_id(self):
+        return self.rng.choice(self.post_ids)
+
+    def user_id(self):
+        return self.rng.choice(self.user_ids)
+
+    def hashtag(self):
+        return self.rng.choice(self.hashtags)
+
+    def word(self):
+        return self.rng.choice(('sun', 'city', 'synth', 'photo'))
+
+
+def percentile(values, fraction):
+    # Ближайший ранг: p99 из 100 значений - 99-е по порядку
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class Benchmark:
+    def __init__(self, requests=1000, warmup=50, seed=0, only=None, auth='force', viewers=50):
+        self.requests = requests
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.endpoints = [endpoint for endpoint in ENDPOINTS if not only or endpoint.name in only]
+        if not self.endpoints:
+            raise ValueError('Не выбрано ни одного эндпоинта')
+        self.auth = auth
+        self.viewers = viewers
+
+    def prepare(self):
+        self.sample = Sample(self.rng)
+        viewers = list(UserProfile.objects.filter(pk__in=self.rng.sample(
+            self.sample.user_ids, min(self.viewers, len(self.sample.user_ids)))))
+        # Клиент на каждого зрителя: с --auth jwt заголовок проходит полную аутентификацию
+        self.clients = [self.make_client(viewer) for viewer in viewers]
+        self.anonymous = APIClient()
+
+    def make_client(self, user):
+        client = APIClient()
+        if self.auth == 'jwt':
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {SessionRefreshToken.for_user(user).access_token}')
+        else:
+            client.force_authenticate(user=user)
+        return client
+
+    def call(self, endpoint):
+        # Соединения потоковые: запросы async-эндпоинтов из пула потоков
+        # (ASYNC_PARALLEL_QUERIES) сюда не попадают
+        client = self.rng.choice(self.clients) if endpoint.auth else self.anonymous
+        url = endpoint.url(self.sample)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in connections]
+            start = time.perf_counter()
+            response = getattr(client, endpoint.method)(url)
+            elapsed = time.perf_counter() - start
+        return elapsed, sum(len(queries) for queries in captured), response.status_code
+
+    def run(self):
+        with translation.override('en'):
+            self.prepare()
+            weights = [endpoint.weight for endpoint in self.endpoints]
+            plan = self.rng.choices(self.endpoints, weights=weights, k=self.warmup + self.requests)
+            results = {endpoint.name: {'times': [], 'queries': [], 'errors': 0} for endpoint in self.endpoints}
+            for number, endpoint in enumerate(plan):
+                elapsed, queries, status = self.call(endpoint)
+                if number < self.warmup:
+                    continue
+                result = results[endpoint.name]
+                result['times'].append(elapsed)
+                result['queries'].append(queries)
+                if status >= 400:
+                    result['errors'] += 1
+        return summarize(results)
+
+
+def authentication_overhead(calls=2000, users=50, seed=0):
+    # Стоимость одной аутентификации по JWT: стандартный класс simplejwt против
+    # CachedJWTAuthentication (пользователь из кэша, отзыв - фильтр Блума)
+    rng = random.Random(seed)
+    users = list(UserProfile.objects.order_by('pk')[:users])
+    if not users:
+        raise ValueError('Нет данных для прогона: сначала выполните seed_synthetic')
+    factory = RequestFactory()
+    requests = [Request(factory.get('/', HTTP_AUTHORIZATION=f'Bearer {SessionRefreshToken.for_user(user).access_token}'))
+                for user in users]
+    plan = [rng.choice(requests) for _ in range(calls)]
+    user_cache.clear()
+    blacklist.reset()
+    report = {}
+    for name, authentication in (('jwt', JWTAuthentication()), ('cached_jwt', CachedJWTAuthentication())):
+        times, queries = [], []
+        for request in plan:
+            with CaptureQueriesContext(connections['default']) as captured:
+                start = time.perf_counter()
+                authentication.authenticate(request)
+                times.append(time.perf_counter() - start)
+            queries.append(len(captured))
+        report[name] = {
+            'calls': calls,
+            'mean_us': sum(times) / calls * 1e6,
+            'p50_us': percentile(times, 0.50) * 1e6,
+            'p99_us': percentile(times, 0.99) * 1e6,
+            'queries': sum(queries) / calls,
+        }
+    return report
+
+
+def format_authentication_report(report):
+    header = f"{'класс':<14}{'n':>7}{'среднее мкс':>14}{'p50 мкс':>10}{'p99 мкс':>10}{'запросы':>10}"
+    lines = [header, '-' * len(header)]
+    for name, row in report.items():
+        lines.append(f"{name:<14}{row['calls']:>7}{row['mean_us']:>14.1f}{row['p50_us']:>10.1f}"
+                     f"{row['p99_us']:>10.1f}{row['queries']:>10.2f}")
+    return '\n'.join(lines)
+
+
+def summarize(results):
+    report = {}
+    for name, result in results.items():
+        times = result['times']
+        if not times:
+            continue
+        report[name] = {
+            'requests': len(times),
+            'p50_ms': percentile(times, 0.50) * 1000,
+            'p95_ms': percentile(times, 0.95) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+            'queries': sum(result['queries']) / len(times),
+            'max_queries': max(result['queries']),
+            'errors': result['errors'],
+        }
+    return report
+
+
+def format_report(report, baseline=None):
+    header = f"{'эндпоинт':<20}{'n':>6}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'запросы':>10}{'ошибки':>8}"
+    lines = [header, '-' * len(header)]
+    for name, row in report.items():
+        line = (f"{name:<20}{row['requests']:>6}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                f"{row['p99_ms']:>10.2f}{row['queries']:>10.1f}{row['errors']:>8}")
+        before = (baseline or {}).get(name)
+        if before:
+            line += (f"   p50 {_delta(before['p50_ms'], row['p50_ms'])}"
+                     f", p95 {_delta(before['p95_ms'], row['p95_ms'])}"
+                     f", запросы {before['queries']:.1f} -> {row['queries']:.1f}")
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _delta(before, after):
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before * 100:+.0f}%'
+
+
+def load_report(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def save_report(report, path):
+    with open(path, 'w') as target:
+        json.dump(report, target, indent=2, ensure_ascii=False)
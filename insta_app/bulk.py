@@ -0,0 +1,245 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from .models import UserProfile, Post, Comment, Follow, PostLike, CommentLike
+from .counters import change_counters
+from .feed import remove_from_timeline
+from .response_cache import invalidate_many
+from .tasks import enqueue_many, backfill_dedupe_key
+from .notifications import notify, post_like_events, comment_like_events, follow_events
+from .follow_graph import on_follow
+
+
+# Пакетная запись лайков и подписок: проверка всей пачки за один проход,
+# запись одним upsert/delete в транзакции, счётчики (приращением) и кэш - один раз на пачку
+CREATE, TOGGLE, DELETE = 'create', 'toggle', 'delete'
+MAX_ITEMS = 500
+# Пар ключей в одном запросе состояния: по два параметра на пару, с запасом до лимита SQLite
+STATE_CHUNK = 400
+
+_bulk_write = ContextVar('bulk_write', default=False)
+
+
+@contextmanager
+def bulk_write():
+    # Сигналы удаления пропускают счётчики и кэш: их обновит BulkWriter.after_write
+    token = _bulk_write.set(True)
+    try:
+        yield
+    finally:
+        _bulk_write.reset(token)
+
+
+def in_bulk_write():
+    return _bulk_write.get()
+
+
+class BulkWriter:
+    model = None
+    keys = ()
+    # Поле-флаг (like); без него наличие строки и есть связь (подписка)
+    flag = None
+    # Поле ключа с автором действия: писать можно только от имени текущего пользователя
+    actor = None
+
+    def __init__(self, action, actor_id):
+        self.action = action
+        self.actor_id = actor_id
+
+    def parse(self, items):
+        if not isinstance(items, list):
+            raise ValidationError('Ожидается список объектов')
+        if len(items) > MAX_ITEMS:
+            raise ValidationError(f'Не больше {MAX_ITEMS} объектов за раз')
+
+        parsed, errors = [], {}
+        for index, item in enumerate(items):
+            item_errors = {}
+            if not isinstance(item, dict):
+                errors[index] = {'non_field_errors': 'Ожидается объект'}
+                parsed.append(None)
+                continue
+            key = []
+            for name in self.keys:
+                value = item.get(name)
+                if value is None and name == self.actor:
+                    value = self.actor_id
+                if value is None:
+                    item_errors[name] = 'Обязательное поле'
+                elif isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+                    item_errors[name] = 'Ожидается целое число'
+                elif name == self.actor and int(value) != self.actor_id:
+                    item_errors[name] = 'Можно действовать только от своего имени'
+                else:
+                    key.append(int(value))
+            value = True
+            if self.flag and self.action == CREATE and self.flag in item:
+                value = item[self.flag]
+                if not isinstance(value, bool):
+                    item_errors[self.flag] = 'Ожидается true или false'
+            if item_errors:
+                errors[index] = item_errors
+                parsed.append(None)
+            else:
+                parsed.append((tuple(key), value))
+
+        # Существование связанных объектов - один запрос на поле для всей пачки
+        for position, name in enumerate(self.keys):
+            if name == self.actor:
+                continue
+            ids = {entry[0][position] for entry in parsed if entry is not None}
+            related = self.model._meta.get_field(name).related_model
+            found = set(related.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            for index, entry in enumerate(parsed):
+                if entry is not None and entry[0][position] not in found:
+                    errors.setdefault(index, {})[name] = 'Объект не найден'
+                    parsed[index] = None
+        return parsed, errors
+
+    def load_state(self, keys):
+        # {ключ: (id, значение флага)} для уже существующих строк
+        # Только точные пары ключей, а не декартово произведение id по каждому полю
+        fields = ['id', *(f'{name}_id' for name in self.keys)] + ([self.flag] if self.flag else [])
+        keys = list(keys)
+        state = {}
+        for start in range(0, len(keys), STATE_CHUNK):
+            condition = Q()
+            for key in keys[start:start + STATE_CHUNK]:
+                condition |= Q(**{f'{name}_id': key[i] for i, name in enumerate(self.keys)})
+            for row in self.model.objects.filter(condition).values_list(*fields):
+                state[tuple(row[1:len(self.keys) + 1])] = (row[0], row[-1] if self.flag else True)
+        return state
+
+    def step(self, current, value):
+        # Новое состояние строки (None - строки нет) и статус для ответа
+        if self.action == DELETE:
+            return None, 'deleted' if current is not None else 'not_found'
+        if self.action == TOGGLE:
+            if current is None:
+                return True, 'created'
+            if not self.flag:
+                return None, 'deleted'
+            return not current, 'updated'
+        if current is None:
+            return value, 'created'
+        return value, 'updated' if current != value else 'unchanged'
+
+    def apply(self, items):
+        parsed, errors = self.parse(items)
+        keys = {entry[0] for entry in parsed if entry is not None}
+
+        with transaction.atomic(), bulk_write():
+            initial = self.load_state(keys)
+            state = {key: value for key, (_, value) in initial.items()}
+            results = []
+            for index, entry in enumerate(parsed):
+                if entry is None:
+                    results.append({'index': index, 'status': 'invalid', 'errors': errors[index]})
+                    continue
+                key, value = entry
+                state[key], status = self.step(state.get(key), value)
+                result = {'index': index, 'status': status, **dict(zip(self.keys, key))}
+                if self.flag and state[key] is not None:
+                    result[self.flag] = state[key]
+                results.append(result)
+
+            changed = {key for key in keys
+                       if state.get(key) != (initial[key][1] if key in initial else None)}
+            upserts = [key for key in changed if state.get(key) is not None]
+            deletes = [initial[key][0] for key in changed if state.get(key) is None]
+            if upserts:
+                self.write(upserts, state)
+            if deletes:
+                self.model.objects.filter(id__in=deletes).delete()
+            if changed:
+                # Вклад строки в счётчик: 1, если связь есть и включена (like=True)
+                deltas = {key: (state.get(key) is True) - (key in initial and initial[key][1] is True)
+                          for key in changed}
+                self.after_write(
+                    created=[key for key in upserts if key not in initial],
+                    deleted=[key for key in changed if state.get(key) is None],
+                    changed=changed,
+                    deltas=deltas,
+                )
+                # Включённые лайки и новые подписки - одна запись на группу уведомлений
+                self.notify([key for key in upserts if state[key] is True])
+        return results
+
+    def write(self, keys, state):
+        objects = [self.model(**{f'{name}_id': key[i] for i, name in enumerate(self.keys)},
+                              **({self.flag: state[key]} if self.flag else {}))
+                   for key in keys]
+        if self.flag:
+            self.model.objects.bulk_create(objects, update_conflicts=True,
+                                           unique_fields=list(self.keys), update_fields=[self.flag])
+        else:
+            self.model.objects.bulk_create(objects, ignore_conflicts=True)
+
+    def after_write(self, created, deleted, changed, deltas):
+        pass
+
+    def notify(self, activated):
+        pass
+
+
+def sum_deltas(deltas, position):
+    # {ключ: delta} -> {id объекта на позиции position в ключе: суммарное delta}
+    totals = Counter()
+    for key, delta in deltas.items():
+        totals[key[position]] += delta
+    return totals
+
+
+class PostLikeBulkWriter(BulkWriter):
+    model = PostLike
+    keys = ('post', 'user')
+    flag = 'like'
+    actor = 'user'
+
+    def after_write(self, created, deleted, changed, deltas):
+        change_counters(Post, 'likes_count', sum_deltas(deltas, 0))
+        invalidate_many('post', {post_id for post_id, _ in changed})
+
+    def notify(self, activated):
+        notify(post_like_events(activated))
+
+
+class CommentLikeBulkWriter(BulkWriter):
+    model = CommentLike
+    keys = ('comment', 'user')
+    flag = 'like'
+    actor = 'user'
+
+    def after_write(self, created, deleted, changed, deltas):
+        change_counters(Comment, 'likes_count', sum_deltas(deltas, 0))
+        post_ids = Comment.objects.filter(pk__in={comment_id for comment_id, _ in changed}).values_list('post_id')
+        invalidate_many('post', {post_id for post_id, in post_ids})
+
+    def notify(self, activated):
+        notify(comment_like_events(activated))
+
+
+class FollowBulkWriter(BulkWriter):
+    model = Follow
+    keys = ('follower', 'following')
+    actor = 'follower'
+
+    def after_write(self, created, deleted, changed, deltas):
+        user_ids = {user_id for key in changed for user_id in key}
+        enqueue_many('feed.backfill', [{'follower_id': follower_id, 'following_id': following_id}
+                                       for follower_id, following_id in created],
+                     dedupe_key=lambda kwargs: backfill_dedupe_key(**kwargs))
+        for follower_id, following_id in deleted:
+            remove_from_timeline(Follow(follower_id=follower_id, following_id=following_id))
+        for follower_id, following_id in created:
+            on_follow(follower_id, following_id)
+        # Те же поля, что у сигналов follow_counters_*
+        change_counters(UserProfile, 'followers_count', sum_deltas(deltas, 0))
+        change_counters(UserProfile, 'following_count', sum_deltas(deltas, 1))
+        invalidate_many('user', user_ids)
+
+    def notify(self, activated):
+        notify(follow_events(activated))
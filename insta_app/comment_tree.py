@@ -0,0 +1,78 @@
+from collections import defaultdict
+from rest_framework.exceptions import ValidationError
+from .models import Comment
+
+
+def _load_children(post_ids):
+    # Все комментарии постов вместе с авторами одним запросом
+    children = defaultdict(list)
+    nodes = {}
+    comments = (Comment.objects.filter(post_id__in=post_ids)
+                .select_related('user')
+                .order_by('id'))
+    for comment in comments:
+        nodes[comment.id] = comment
+        if comment.parent_id is not None:
+            children[comment.parent_id].append(comment)
+    return nodes, children
+
+
+def _attach(roots, children, max_depth=None, replies_limit=None):
+    # Собираем дерево в памяти, без рекурсии по запросам
+    stack = [(root, 0) for root in roots]
+    while stack:
+        node, depth = stack.pop()
+        if max_depth is not None and depth >= max_depth:
+            node.tree_subcomments = []
+            continue
+        replies = children.get(node.id, [])
+        if replies_limit is not None:
+            replies = replies[:replies_limit]
+        node.tree_subcomments = replies
+        stack.extend((reply, depth + 1) for reply in replies)
+
+
+def attach_comment_tree(comments, max_depth=None, replies_limit=None):
+    comments = list(comments)
+    if not comments:
+        return comments
+    _, children = _load_children({comment.post_id for comment in comments})
+    _attach(comments, children, max_depth, replies_limit)
+    return comments
+
+
+def load_post_comments(post, max_depth=None, replies_limit=None):
+    # Главные комментарии поста (без родителя) с уже собранными ответами
+    nodes, children = _load_children([post.pk])
+    roots = [node for node in nodes.values() if node.parent_id is None]
+    roots.sort(key=lambda comment: (comment.created_date, comment.id), reverse=True)
+    _attach(roots, children, max_depth, replies_limit)
+    return roots
+
+
+def tree_user_ids(roots):
+    # Авторы всех комментариев собранного дерева
+    user_ids = set()
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        user_ids.add(node.user_id)
+        stack.extend(getattr(node, 'tree_subcomments', []))
+    return user_ids
+
+
+def parse_tree_options(query_params):
+    # ?max_depth= и ?replies_limit= (лимит ответов на каждом уровне)
+    options = {}
+    for name in ('max_depth', 'replies_limit'):
+        value = query_params.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise ValidationError({name: 'Ожидается неотрицательное целое число'})
+        options[name] = value
+    return options
@@ -0,0 +1,84 @@
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from .models import UserProfile, Post, Follow, PostLike, Comment, CommentLike
+
+
+def change_counter(model, pk, field, delta):
+    # Атомарное изменение счётчика через F(), без чтения строки
+    if pk is None or delta == 0:
+        return
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def change_counters(model, field, deltas):
+    # Пачка изменений {pk: delta} одним UPDATE: field = field + CASE pk ... END. Как и
+    # change_counter, прибавляет к текущему значению (параллельные F()-изменения не теряются)
+    # и не опускает счётчик ниже нуля
+    deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and delta}
+    if not deltas:
+        return
+    shift = Case(*[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                 default=Value(0), output_field=IntegerField())
+    model.objects.filter(pk__in=deltas).update(
+        **{field: Greatest(F(field) + shift, Value(0), output_field=IntegerField())})
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.values(field).annotate(total=Count('pk')).values('total')), Value(0))
+
+
+# Эталонные значения счётчиков, по которым recount_counters чинит расхождения.
+# followers_count/following_count повторяют related_name модели Follow.
+def user_counters():
+    return {
+        'followers_count': _count(Follow.objects.filter(follower=OuterRef('pk')), 'follower'),
+        'following_count': _count(Follow.objects.filter(following=OuterRef('pk')), 'following'),
+        'posts_count': _count(Post.objects.filter(user=OuterRef('pk')), 'user'),
+    }
+
+
+def post_counters():
+    return {
+        'likes_count': _count(PostLike.objects.filter(post=OuterRef('pk'), like=True), 'post'),
+        'comments_count': _count(Comment.objects.filter(post=OuterRef('pk')), 'post'),
+    }
+
+
+def comment_counters():
+    return {
+        'likes_count': _count(CommentLike.objects.filter(comment=OuterRef('pk'), like=True), 'comment'),
+    }
+
+
+def recount(queryset, counters):
+    # Пересчитывает счётчики для переданных строк, возвращает число исправленных
+    fields = list(counters)
+    annotations = {f'actual_{name}': expression for name, expression in counters.items()}
+    changed = []
+    for obj in queryset.only('pk', *fields).annotate(**annotations):
+        dirty = False
+        for name in fields:
+            actual = getattr(obj, f'actual_{name}')
+            if getattr(obj, name) != actual:
+                setattr(obj, name, actual)
+                dirty = True
+        if dirty:
+            changed.append(obj)
+    if changed:
+        queryset.model.objects.bulk_update(changed, fields)
+    return len(changed)
+
+
+def recount_users(queryset=None):
+    return recount(queryset if queryset is not None else UserProfile.objects.all(), user_counters())
+
+
+def recount_posts(queryset=None):
+    return recount(queryset if queryset is not None else Post.objects.all(), post_counters())
+
+
+def recount_comments(queryset=None):
+    return recount(queryset if queryset is not None else Comment.objects.all(), comment_counters())
@@ -0,0 +1,46 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+
+# Чтение с реплик только там, где это явно разрешено (GET списков и карточек),
+# всё остальное - запись, транзакции, миграции - идёт в default
+_replica_read = ContextVar('replica_read', default=False)
+
+
+@contextmanager
+def _replica_reads(enabled):
+    token = _replica_read.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_read.reset(token)
+
+
+def read_from_replica():
+    return _replica_reads(True)
+
+
+def read_from_primary():
+    # Для того, что попадает в общий кэш: отставшая реплика не должна
+    # закэшировать старые данные под новой версией
+    return _replica_reads(False)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if replicas and _replica_read.get():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, связи между объектами с разных алиасов допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,91 @@
+from django.db import connections
+from .models import Post, Follow, TimelineEntry
+from .pagination import index_range
+
+
+FAN_OUT_BATCH_SIZE = 1000
+FOLLOW_BACKFILL_LIMIT = 50
+# Веток UNION ALL в одном запросе постов официальных аккаунтов (в SQLite не больше 500)
+OFFICIAL_BRANCHES = 200
+
+
+def fan_out_post(post):
+    # Fan-out-on-write: раскладываем новый пост по лентам подписчиков.
+    # Официальные аккаунты не раскладываются, их посты подмешиваются при чтении.
+    if post.user_id is None:
+        return
+    TimelineEntry.objects.get_or_create(owner_id=post.user_id, post=post,
+                                        defaults={'created_date': post.created_date})
+    if post.user.is_official:
+        return
+
+    follower_ids = (Follow.objects.filter(following_id=post.user_id)
+                    .values_list('follower_id', flat=True))
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.append(TimelineEntry(owner_id=follower_id, post=post, created_date=post.created_date))
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill_timeline(follow):
+    # После подписки добавляем в ленту последние посты автора
+    if follow.following.is_official:
+        return
+    posts = (Post.objects.filter(user_id=follow.following_id)
+             .order_by('-created_date', '-id')
+             .values_list('id', 'created_date')[:FOLLOW_BACKFILL_LIMIT])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=follow.follower_id, post_id=post_id, created_date=created_date)
+         for post_id, created_date in posts],
+        ignore_conflicts=True,
+    )
+
+
+def remove_from_timeline(follow):
+    TimelineEntry.objects.filter(owner_id=follow.follower_id,
+                                 post__user_id=follow.following_id).delete()
+
+
+def feed_queryset(user):
+    # Посты страницы загружаются отсюда по id, какие именно - решает feed_page
+    return Post.objects.with_list_data()
+
+
+def feed_page(user, ordering, position, limit):
+    # Ключи (дата, id поста) страницы ленты в порядке ordering. Материализованная лента -
+    # один диапазон индекса (owner, created_date, post); посты официальных аккаунтов
+    # (fan-out-on-read) - один запрос, см. official_range.
+    # Каждый источник ограничен размером страницы, поэтому глубина ленты на цену не влияет
+    keys = set(index_range(TimelineEntry.objects.filter(owner=user), ordering, position, limit))
+    official = list(Follow.objects.filter(follower=user, following__is_official=True)
+                    .values_list('following_id', flat=True))
+    keys.update(official_range(official, ordering, position, limit))
+    # Пост может прийти из обоих источников, если автор стал официальным после раскладки
+    return sorted(keys, reverse=ordering[0].startswith('-'))[:limit]
+
+
+def official_range(author_ids, ordering, position, limit):
+    # Посты всех официальных аккаунтов страницы - одним запросом UNION ALL: в каждой ветке
+    # диапазон индекса (user, created_date, id) одного аккаунта со своим LIMIT. Общий
+    # user_id IN (...) сортировал бы во временном B-дереве все их посты старше курсора
+    if not author_ids:
+        return []
+    branch = index_range(Post.objects.filter(user_id=author_ids[0]), ordering, position, limit, 'id')
+    using = branch.db
+    branch_sql, branch_params = branch.query.get_compiler(using).as_sql()
+    # Ветки отличаются только id автора - первым параметром (фильтр user_id раньше курсора)
+    rest = list(branch_params[1:])
+    to_date = Post._meta.get_field('created_date').to_python
+    keys = []
+    for start in range(0, len(author_ids), OFFICIAL_BRANCHES):
+        chunk = author_ids[start:start + OFFICIAL_BRANCHES]
+        sql = ' UNION ALL '.join(f'SELECT * FROM ({branch_sql}) AS branch_{number}' for number in range(len(chunk)))
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [param for author_id in chunk for param in (author_id, *rest)])
+            # Сырой курсор SQLite отдаёт дату строкой
+            keys.extend((to_date(created_date), post_id) for created_date, post_id in cursor.fetchall())
+    return keys
@@ -0,0 +1,298 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from .models import UserProfile, Follow
+
+
+# Граф подписок в памяти процесса: два CSR-массива (на кого подписан / кто подписан),
+# индекс строки - id пользователя, цели в строке отсортированы (64-битные, как id
+# пользователей). 10 млн рёбер - около 160 МБ на оба направления. Изменения этого процесса (сигналы, BulkWriter) ложатся
+# в небольшие наборы добавленных/удалённых рёбер поверх CSR; новые подписки других
+# процессов догружаются по id раз в FOLLOW_GRAPH_REFRESH секунд, а их отписки видны
+# после полной пересборки (раз в FOLLOW_GRAPH_REBUILD секунд или когда наборы разрослись).
+# Пересборка идёт в фоне, запросы тем временем отвечают по старому графу. Первая загрузка
+# тоже в фоне: на десятках миллионов рёбер она занимает около минуты, и до её конца
+# запросы отвечают ограниченными запросами к базе (FALLBACK_*).
+MAX_FAN_OUT = 500
+MAX_ROW = 2000
+FALLBACK_FAN_OUT = 100
+
+
+def get_refresh():
+    return getattr(settings, 'FOLLOW_GRAPH_REFRESH', 30)
+
+
+def get_rebuild():
+    return getattr(settings, 'FOLLOW_GRAPH_REBUILD', 3600)
+
+
+def get_max_delta():
+    return getattr(settings, 'FOLLOW_GRAPH_MAX_DELTA', 100000)
+
+
+class Adjacency:
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+        self.added = {}
+        self.removed = {}
+        self.delta = 0
+
+    @classmethod
+    def build(cls, rows, size):
+        # rows - (строка, цель), отсортированные по строке и цели
+        counts = array('q', bytes(8 * size))
+        targets = array('q')
+        for row, target in rows:
+            if row >= size:
+                continue
+            targets.append(target)
+            counts[row] += 1
+        offsets = array('q', [0])
+        total = 0
+        for count in counts:
+            total += count
+            offsets.append(total)
+        return cls(offsets, targets)
+
+    def _bounds(self, node):
+        if 0 <= node < len(self.offsets) - 1:
+            return self.offsets[node], self.offsets[node + 1]
+        return 0, 0
+
+    def _in_base(self, node, target):
+        start, end = self._bounds(node)
+        position = bisect_left(self.targets, target, start, end)
+        return position < end and self.targets[position] == target
+
+    def has(self, node, target):
+        if target in self.added.get(node, ()):
+            return True
+        return target not in self.removed.get(node, ()) and self._in_base(node, target)
+
+    def add(self, node, target):
+        removed = self.removed.get(node)
+        if removed and target in removed:
+            removed.discard(target)
+        elif not self._in_base(node, target):
+            self.added.setdefault(node, set()).add(target)
+        self.delta += 1
+
+    def remove(self, node, target):
+        added = self.added.get(node)
+        if added and target in added:
+            added.discard(target)
+        elif self._in_base(node, target):
+            self.removed.setdefault(node, set()).add(target)
+        self.delta += 1
+
+    def row(self, node):
+        # Отсортированный список соседей с учётом изменений поверх CSR
+        start, end = self._bounds(node)
+        base = self.targets[start:end]
+        removed, added = self.removed.get(node), self.added.get(node)
+        if not removed and not added:
+            return base
+        result = [target for target in base if target not in removed] if removed else list(base)
+        if added:
+            result = sorted(set(result) | added)
+        return result
+
+    def degree(self, node):
+        start, end = self._bounds(node)
+        return end - start + len(self.added.get(node, ())) - len(self.removed.get(node, ()))
+
+
+class FollowGraph:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.following = None
+        self.followers = None
+        self.last_id = 0
+        self.refreshed_at = 0.0
+        self.built_at = 0.0
+        self.rebuilding = False
+        # Изменения, пришедшие во время фоновой пересборки: повторяются на новом графе
+        self.pending = []
+
+    @property
+    def loaded(self):
+        return self.following is not None
+
+    def reset(self):
+        with self.lock:
+            self.following = self.followers = None
+            self.rebuilding = False
+            self.pending = []
+
+    # ========== ЗАГРУЗКА ==========
+    def _snapshot(self):
+        last_id = Follow.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        size = last_user_id() + 1
+        pairs = Follow.objects.values_list('follower_id', 'following_id')
+        following = Adjacency.build(pairs.order_by('follower_id', 'following_id').iterator(chunk_size=10000), size)
+        followers = Adjacency.build(
+            ((target, source) for source, target in
+             pairs.order_by('following_id', 'follower_id').iterator(chunk_size=10000)), size)
+        return following, followers, last_id
+
+    def _install(self, snapshot):
+        self.following, self.followers, self.last_id = snapshot
+        self.refreshed_at = self.built_at = time.monotonic()
+        for apply, follower_id, following_id in self.pending:
+            apply(follower_id, following_id)
+        self.pending = []
+
+    def load(self):
+        # Синхронная загрузка - для прогрева процесса и тестов
+        with self.lock:
+            self._install(self._snapshot())
+
+    def _start_rebuild(self):
+        if not self.rebuilding:
+            self.rebuilding = True
+            self.pending = []
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            snapshot = self._snapshot()
+            with self.lock:
+                self._install(snapshot)
+        finally:
+            with self.lock:
+                self.rebuilding = False
+            connections.close_all()
+
+    def _catch_up(self):
+        rows = list(Follow.objects.filter(id__gt=self.last_id).order_by('id')
+                    .values_list('id', 'follower_id', 'following_id'))
+        for row_id, follower_id, following_id in rows:
+            self._add(follower_id, following_id)
+            self.last_id = row_id
+        self.refreshed_at = time.monotonic()
+
+    def ensure(self):
+        # False - графа ещё нет (идёт первая загрузка), отвечать нужно из базы
+        now = time.monotonic()
+        with self.lock:
+            if not self.loaded:
+                self._start_rebuild()
+                return False
+            if (now - self.built_at >= get_rebuild()
+                    or self.following.delta + self.followers.delta > get_max_delta()):
+                self._start_rebuild()
+            if now - self.refreshed_at >= get_refresh():
+                self._catch_up()
+            return True
+
+    # ========== ИЗМЕНЕНИЯ ==========
+    def _add(self, follower_id, following_id):
+        if not self.following.has(follower_id, following_id):
+            self.following.add(follower_id, following_id)
+            self.followers.add(following_id, follower_id)
+
+    def _remove(self, follower_id, following_id):
+        if self.following.has(follower_id, following_id):
+            self.following.remove(follower_id, following_id)
+            self.followers.remove(following_id, follower_id)
+
+    def add(self, follower_id, following_id):
+        # Пока граф не загружен и не загружается, запоминать нечего
+        with self.lock:
+            if self.loaded:
+                self._add(follower_id, following_id)
+            if self.rebuilding:
+                self.pending.append((self._add, follower_id, following_id))
+
+    def remove(self, follower_id, following_id):
+        with self.lock:
+            if self.loaded:
+                self._remove(follower_id, following_id)
+            if self.rebuilding:
+                self.pending.append((self._remove, follower_id, following_id))
+
+    # ========== ЗАПРОСЫ ==========
+    def mutuals(self, viewer_id, user_id):
+        # На кого подписан viewer из тех, кто подписан на user; популярные первыми
+        if not self.ensure():
+            return mutuals_from_db(viewer_id, user_id)
+        with self.lock:
+            ids = _intersect(self.following.row(viewer_id), self.followers.row(user_id))
+            ids.sort(key=lambda pk: (-self.followers.degree(pk), pk))
+        return ids
+
+    def suggestions(self, user_id, limit=20):
+        # Друзья друзей: кандидат тем выше, чем больше подписок пользователя на него подписаны.
+        # У очень активных учитываются первые MAX_FAN_OUT подписок и MAX_ROW рёбер каждой
+        if not self.ensure():
+            return suggestions_from_db(user_id, limit)
+        with self.lock:
+            following = self.following.row(user_id)
+            counts = Counter()
+            for friend in following[:MAX_FAN_OUT]:
+                counts.update(self.following.row(friend)[:MAX_ROW])
+            counts.pop(user_id, None)
+            for pk in following:
+                counts.pop(pk, None)
+            best = heapq.nsmallest(limit, counts.items(),
+                                   key=lambda item: (-item[1], -self.followers.degree(item[0]), item[0]))
+        return best
+
+
+def on_follow(follower_id, following_id):
+    # Из сигналов и BulkWriter: в граф - только после фиксации транзакции
+    transaction.on_commit(lambda: graph.add(follower_id, following_id))
+
+
+def on_unfollow(follower_id, following_id):
+    transaction.on_commit(lambda: graph.remove(follower_id, following_id))
+
+
+# ========== ОТВЕТ ИЗ БАЗЫ ==========
+# Пока граф загружается: те же ответы по индексам Follow, но не больше MAX_ROW подписок
+# viewer и FALLBACK_FAN_OUT друзей. Число подписчиков пользователя - following_count
+# (так его ведут сигналы follow_counters_*)
+def mutuals_from_db(viewer_id, user_id):
+    followers = Follow.objects.filter(following_id=user_id).values('follower_id')
+    return list(Follow.objects.filter(follower_id=viewer_id, following_id__in=followers)
+                .order_by('-following__following_count', 'following_id')
+                .values_list('following_id', flat=True)[:MAX_ROW])
+
+
+def suggestions_from_db(user_id, limit=20):
+    following = Follow.objects.filter(follower_id=user_id)
+    friends = following.order_by('following_id').values_list('following_id', flat=True)[:FALLBACK_FAN_OUT]
+    ranked = (Follow.objects.filter(follower_id__in=list(friends))
+              .exclude(following_id=user_id)
+              .exclude(following_id__in=following.values('following_id'))
+              .values('following_id')
+              .annotate(mutual=Count('id'))
+              .order_by('-mutual', '-following__following_count', 'following_id')
+              .values_list('following_id', 'mutual')[:limit])
+    return list(ranked)
+
+
+def _intersect(first, second):
+    # Оба списка отсортированы: проходим меньший, ищем в большем
+    if len(first) > len(second):
+        first, second = second, first
+    result = []
+    for value in first:
+        position = bisect_left(second, value)
+        if position < len(second) and second[position] == value:
+            result.append(value)
+    return result
+
+
+def last_user_id():
+    return UserProfile.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+graph = FollowGraph()
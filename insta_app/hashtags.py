@@ -0,0 +1,69 @@
+import re
+from datetime import timedelta
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import Hashtag, HashtagTrend, PostTag
+from .pagination import index_range
+
+
+HASHTAG_RE = re.compile(r'#(\w+)')
+WORD_RE = re.compile(r'\w+')
+TRENDING_WINDOW_HOURS = 24
+TRENDING_LIMIT = 10
+
+
+def parse_hashtags(description, hashtag):
+    # Теги из описания (#tag) и из поля hashtag, где '#' может не быть
+    names = HASHTAG_RE.findall(description or '') + WORD_RE.findall(hashtag or '')
+    result = []
+    for name in names:
+        name = name.lower()[:100]
+        if name not in result:
+            result.append(name)
+    return result
+
+
+def current_bucket():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def record_usage(hashtags):
+    # Инкрементальное обновление скользящего окна вместо агрегации по постам
+    bucket = current_bucket()
+    for hashtag in hashtags:
+        trend, created = HashtagTrend.objects.get_or_create(hashtag=hashtag, bucket=bucket,
+                                                            defaults={'count': 1})
+        if not created:
+            HashtagTrend.objects.filter(pk=trend.pk).update(count=F('count') + 1)
+
+
+def sync_post_hashtags(post):
+    names = parse_hashtags(post.description, post.hashtag)
+    current = {tag.name: tag for tag in post.tags.all()}
+    if set(names) == set(current):
+        return
+
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in names if name not in current],
+                                ignore_conflicts=True)
+    tags = list(Hashtag.objects.filter(name__in=names))
+    post.tags.set(tags, through_defaults={'created_date': post.created_date})
+    record_usage([tag for tag in tags if tag.name not in current])
+
+
+def hashtag_page(name, ordering, position, limit):
+    # Ключи (дата, id поста) страницы тега - один диапазон индекса (hashtag, created_date, post):
+    # глубокая страница популярного тега стоит столько же, сколько первая
+    return list(index_range(PostTag.objects.filter(hashtag__name=name), ordering, position, limit))
+
+
+def trending(hours=TRENDING_WINDOW_HOURS, limit=TRENDING_LIMIT):
+    since = current_bucket() - timedelta(hours=hours - 1)
+    return (HashtagTrend.objects.filter(bucket__gte=since)
+            .values('hashtag__name')
+            .annotate(posts_count=Sum('count'))
+            .order_by('-posts_count', 'hashtag__name')[:limit])
+
+
+def prune_trends(hours=TRENDING_WINDOW_HOURS * 7):
+    # Старые корзины окну уже не нужны
+    HashtagTrend.objects.filter(bucket__lt=current_bucket() - timedelta(hours=hours)).delete()
@@ -0,0 +1,108 @@
+from django.db import connection, transaction
+from rest_framework.exceptions import NotFound
+from .models import Post, Comment, PostLike, CommentLike, Notification
+from .response_cache import invalidate
+from .notifications import Event, notify
+
+
+# Лайк/снятие лайка одним upsert по уникальному (объект, пользователь):
+# строка меняется только при смене состояния, счётчик правится тем же UPDATE,
+# что возвращает новое значение (RETURNING). Сигналы здесь не участвуют.
+class LikeTarget:
+    def __init__(self, like_model, field, model):
+        self.like_model = like_model
+        self.field = field
+        self.model = model
+
+    def like_event(self, pk, user_id, row):
+        # Уведомление владельцу: он уже в строке, которую вернул UPDATE счётчика
+        if self.model is Comment:
+            return Event(row[1], Notification.KIND_COMMENT_LIKE, user_id, post_id=row[2], comment_id=pk)
+        return Event(row[1], Notification.KIND_POST_LIKE, user_id, post_id=pk)
+
+
+POST_LIKES = LikeTarget(PostLike, 'post', Post)
+COMMENT_LIKES = LikeTarget(CommentLike, 'comment', Comment)
+
+
+def _supports_upsert():
+    features = connection.features
+    return features.can_return_columns_from_insert and features.supports_update_conflicts_with_target
+
+
+def _sql_names(target):
+    qn = connection.ops.quote_name
+    return (qn(target.like_model._meta.db_table), qn(f'{target.field}_id'), qn('user_id'), qn('like'))
+
+
+def _change_counter(cursor, target, pk, delta):
+    # -> (likes_count, user_id[, post_id]) или None, если строки нет (или счётчик уже 0)
+    qn = connection.ops.quote_name
+    table, counter = qn(target.model._meta.db_table), qn('likes_count')
+    guard = f' AND {counter} >= 1' if delta < 0 else ''
+    returning = f"{counter}, {qn('user_id')}" + (f", {qn('post_id')}" if target.model is Comment else '')
+    cursor.execute(f'UPDATE {table} SET {counter} = {counter} + %s '
+                   f"WHERE {qn('id')} = %s{guard} RETURNING {returning}", [delta, pk])
+    return cursor.fetchone()
+
+
+def _read_counter(target, pk):
+    fields = ['likes_count', 'user_id'] + (['post_id'] if target.model is Comment else [])
+    row = target.model.objects.filter(pk=pk).values_list(*fields).first()
+    if row is None:
+        raise NotFound('Объект не найден')
+    return row
+
+
+def _set_like_upsert(target, pk, user_id, value):
+    table, object_column, user_column, like_column = _sql_names(target)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if value:
+            cursor.execute(
+                f'INSERT INTO {table} ({object_column}, {user_column}, {like_column}) VALUES (%s, %s, %s) '
+                f'ON CONFLICT ({object_column}, {user_column}) DO UPDATE SET {like_column} = excluded.{like_column} '
+                f'WHERE {table}.{like_column} <> excluded.{like_column} RETURNING 1',
+                [pk, user_id, True],
+            )
+            changed = cursor.fetchone() is not None
+        else:
+            cursor.execute(f'DELETE FROM {table} WHERE {object_column} = %s AND {user_column} = %s '
+                           f'RETURNING {like_column}', [pk, user_id])
+            row = cursor.fetchone()
+            changed = row is not None and bool(row[0])
+        row = _change_counter(cursor, target, pk, 1 if value else -1) if changed else None
+        if row is None:
+            # Ничего не поменялось (повторное нажатие) или объекта нет - тогда NotFound откатит вставку
+            row = _read_counter(target, pk)
+        if changed and value:
+            notify([target.like_event(pk, user_id, row)])
+    return changed, row
+
+
+def _set_like_orm(target, pk, user_id, value):
+    # Запасной путь для СУБД без ON CONFLICT ... RETURNING: счётчики ведут сигналы
+    with transaction.atomic():
+        _read_counter(target, pk)
+        lookup = {f'{target.field}_id': pk, 'user_id': user_id}
+        like = target.like_model.objects.select_for_update().filter(**lookup).first()
+        changed = False
+        if value and (like is None or not like.like):
+            like = like or target.like_model(**lookup)
+            like.like = True
+            like.save()
+            changed = True
+        elif not value and like is not None:
+            changed = like.like
+            like.delete()
+        return changed, _read_counter(target, pk)
+
+
+def set_like(target, pk, user, value):
+    if _supports_upsert():
+        changed, row = _set_like_upsert(target, pk, user.pk, value)
+        if changed:
+            # Лайки поста и комментариев входят в кэшированный пост
+            invalidate('post', row[2] if target.model is Comment else pk)
+    else:
+        changed, row = _set_like_orm(target, pk, user.pk, value)
+    return {'liked': value, 'likes_count': row[0]}
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from insta_app.benchmark import (ENDPOINTS, Benchmark, format_report, load_report, save_report,
+                                 authentication_overhead, format_authentication_report)
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет смесь запросов к API внутри процесса и выводит p50/p95/p99 и число SQL-запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='+', choices=[endpoint.name for endpoint in ENDPOINTS])
+        parser.add_argument('--auth', choices=['force', 'jwt'], default='force',
+                            help='jwt - настоящий токен в заголовке вместо force_authenticate')
+        parser.add_argument('--viewers', type=int, default=50)
+        parser.add_argument('--save', help='Сохранить результат в JSON')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--authentication', action='store_true',
+                            help='Только стоимость аутентификации по JWT: стандартная против кэшируемой')
+
+    def handle(self, *args, **options):
+        if options['authentication']:
+            try:
+                report = authentication_overhead(calls=options['requests'], users=options['viewers'],
+                                                 seed=options['seed'])
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(format_authentication_report(report))
+            return
+        benchmark = Benchmark(requests=options['requests'], warmup=options['warmup'], seed=options['seed'],
+                              only=options['only'], auth=options['auth'], viewers=options['viewers'])
+        baseline = load_report(options['baseline']) if options['baseline'] else None
+        try:
+            report = benchmark.run()
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(format_report(report, baseline))
+        if options['save']:
+            save_report(report, options['save'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from insta_app.models import UserProfile, PostContent
+from insta_app.media import needs_renditions, process_post_content, process_user_image
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие уменьшенные копии для уже загруженных картинок'
+
+    def handle(self, *args, **options):
+        sources = (
+            (PostContent, 'content', 'renditions', process_post_content),
+            (UserProfile, 'user_image', 'user_image_renditions', process_user_image),
+        )
+        for model, field_name, renditions_field, process in sources:
+            built = 0
+            for obj in model.objects.only('pk', field_name, renditions_field).iterator():
+                if needs_renditions(getattr(obj, field_name), getattr(obj, renditions_field)):
+                    process(obj.pk)
+                    built += 1
+            self.stdout.write(f'{model.__name__}: обработано {built}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from insta_app.storage import prune_orphans
+
+
+class Command(BaseCommand):
+    help = 'Удаляет блобы без ссылок (загрузки, которые так и не попали в базу)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        removed = prune_orphans(options['hours'])
+        self.stdout.write(f'Удалено блобов: {removed}')
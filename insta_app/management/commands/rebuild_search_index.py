@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from insta_app.search import INDEXES, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт полнотекстовый индекс постов и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        if backend is None:
+            raise CommandError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
+
+        batch_size = options['batch_size']
+        for index in INDEXES:
+            queryset = index.model.objects.order_by('pk')
+            if index.model_label == 'insta_app.Post':
+                queryset = queryset.select_related('user')
+            with transaction.atomic(), connection.cursor() as cursor:
+                backend.drop(cursor, index)
+                backend.create(cursor, index)
+                total = 0
+                last_pk = 0
+                while True:
+                    batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                    if not batch:
+                        break
+                    backend.upsert(cursor, index, [(obj.pk, index.document(obj)) for obj in batch])
+                    total += len(batch)
+                    last_pk = batch[-1].pk
+            self.stdout.write(f'{index.table}: {total}')
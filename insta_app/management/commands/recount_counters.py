@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from insta_app.models import UserProfile, Post, Comment
+from insta_app.counters import recount_users, recount_posts, recount_comments
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики пользователей, постов и комментариев пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, recount in ((UserProfile, recount_users), (Post, recount_posts),
+                               (Comment, recount_comments)):
+            fixed = 0
+            last_pk = 0
+            while True:
+                pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                fixed += recount(model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]))
+                last_pk = pks[-1]
+            self.stdout.write(f'{model.__name__}: исправлено {fixed}')
@@ -0,0 +1,77 @@
+import logging
+import multiprocessing
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from django.db import connections
+from insta_app.tasks import default_worker_id, drain, requeue_stale, schedule_periodic, work
+
+SUPERVISOR_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(number, stop, poll_interval, batch_size):
+    work(f'{default_worker_id()}:{number}', stop, poll_interval, batch_size)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры очереди задач (потоки или процессы)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread',
+                            help='process - для тяжёлой работы на CPU (картинки), thread - для ожидания БД')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Выполнить то, что уже в очереди, и выйти')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f'Выполнено задач: {drain()}')
+            return
+
+        if options['mode'] == 'process':
+            # Соединения не должны достаться дочерним процессам по наследству
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            stop = context.Event()
+            spawn = context.Process
+        else:
+            stop = threading.Event()
+            spawn = threading.Thread
+
+        # Обработчик сигнала трогает только локальное событие: примитивы multiprocessing
+        # из обработчика могут зависнуть, воркерам stop передаётся уже из основного цикла
+        stopping = threading.Event()
+
+        def shutdown(signum, frame):
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        workers = [spawn(target=_worker_main, args=(number, stop, options['poll_interval'], options['batch_size']),
+                         daemon=True)
+                   for number in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Запущено воркеров: {len(workers)} ({options['mode']})")
+
+        # Надзор: зависшие задачи упавших воркеров и периодическое обслуживание
+        while not stopping.is_set():
+            # Сбой обслуживания (например, база недоступна) не должен останавливать воркеры
+            try:
+                requeued = requeue_stale()
+                if requeued:
+                    self.stdout.write(f'Возвращено в очередь: {requeued}')
+                schedule_periodic()
+            except Exception:
+                logger.exception('Надзор: ошибка обслуживания очереди')
+            connections.close_all()
+            stopping.wait(SUPERVISOR_INTERVAL)
+
+        stop.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write('Воркеры остановлены')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from insta_app.synthetic import SyntheticGraph
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическим социальным графом со степенным распределением для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=float, default=30, help='Среднее число подписок на пользователя')
+        parser.add_argument('--posts', type=float, default=5, help='Среднее число постов на пользователя')
+        parser.add_argument('--contents', type=float, default=2, help='Среднее число файлов в посте')
+        parser.add_argument('--likes', type=float, default=10, help='Среднее число лайков на пост')
+        parser.add_argument('--comments', type=float, default=3, help='Среднее число комментариев верхнего уровня')
+        parser.add_argument('--comment-likes', type=float, default=1)
+        parser.add_argument('--hashtags', type=int, default=200)
+        parser.add_argument('--exponent', type=float, default=1.1, help='Показатель Ципфа для популярности')
+        parser.add_argument('--days', type=int, default=30, help='За сколько последних дней разбросаны посты')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synth', help='Префикс имён пользователей')
+        parser.add_argument('--password', default='synthetic')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        graph = SyntheticGraph(
+            users=options['users'], follows=options['follows'], posts=options['posts'],
+            contents=options['contents'], likes=options['likes'], comments=options['comments'],
+            comment_likes=options['comment_likes'], hashtags=options['hashtags'],
+            exponent=options['exponent'], days=options['days'], seed=options['seed'], prefix=options['prefix'],
+            password=options['password'], batch_size=options['batch_size'],
+            log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+        )
+        created = graph.generate()
+        for model, count in created.items():
+            self.stdout.write(f'{model}: {count}')
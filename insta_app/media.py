@@ -0,0 +1,213 @@
+import math
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .models import UserProfile, PostContent
+from .response_cache import invalidate
+from .storage import is_content_addressed, retain, release
+
+
+# Производные версии загруженных картинок: размер по длинной стороне и форматы
+RENDITIONS = {
+    'thumb': 320,
+    'medium': 1080,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+RENDITIONS_DIR = 'renditions'
+
+
+# ========== BLURHASH ==========
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(value):
+    value /= 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    small = image.convert('RGB')
+    small.thumbnail((32, 32))
+    width, height = small.size
+    pixels = [tuple(_to_linear(channel) for channel in pixel) for pixel in small.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            norm = 1 if i == j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[i][x] * cos_y[j][y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(max(abs(c) for factor in ac for c in factor) * 166 - 0.5)))
+        maximum = (quantised + 1) / 166
+    else:
+        quantised, maximum = 0, 1
+    result += _base83(quantised, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+
+    def quantise(value):
+        scaled = math.copysign(abs(value / maximum) ** 0.5, value)
+        return max(0, min(18, math.floor(scaled * 9 + 9.5)))
+
+    for r, g, b in ac:
+        result += _base83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+# ========== ПРОИЗВОДНЫЕ ==========
+def _encode(image, options):
+    options = dict(options)
+    image_format = options.pop('format')
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def build_renditions(field_file):
+    # {'source', 'width', 'height', 'blurhash', 'sizes': {вид: {'width', 'height', формат: путь}}}
+    storage = field_file.storage
+    try:
+        with storage.open(field_file.name, 'rb') as source:
+            image = Image.open(source)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (UnidentifiedImageError, OSError):
+        return {'source': field_file.name}
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    stem = os.path.splitext(os.path.basename(field_file.name))[0]
+    sizes = {}
+    for kind, max_size in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail((max_size, max_size), Image.LANCZOS)
+        sizes[kind] = {'width': resized.width, 'height': resized.height}
+        for extension, options in FORMATS.items():
+            name = f'{RENDITIONS_DIR}/{stem}_{kind}.{extension}'
+            sizes[kind][extension] = saved = storage.save(name, _encode(resized, options))
+            retain(storage, saved)
+    return {
+        'source': field_file.name,
+        'width': image.width,
+        'height': image.height,
+        'blurhash': blurhash(image),
+        'sizes': sizes,
+    }
+
+
+def _rendition_names(renditions):
+    for size in (renditions or {}).get('sizes', {}).values():
+        for extension in FORMATS:
+            if size.get(extension):
+                yield size[extension]
+
+
+def delete_renditions(storage, renditions):
+    # Копии в хранилище блобов могут делить несколько строк - освобождаем ссылки
+    for name in _rendition_names(renditions):
+        if is_content_addressed(storage):
+            release(storage, name)
+        else:
+            storage.delete(name)
+
+
+def shared_renditions(model, field_name, renditions_field, name):
+    # Тот же файл (одинаковое содержимое) уже обработан для другой строки
+    storage = model._meta.get_field(field_name).storage
+    if not is_content_addressed(storage):
+        return None
+    renditions = (model.objects.filter(**{field_name: name, f'{renditions_field}__source': name})
+                  .values_list(renditions_field, flat=True).first())
+    if renditions is None:
+        return None
+    for rendition in _rendition_names(renditions):
+        retain(storage, rendition)
+    return renditions
+
+
+def needs_renditions(field_file, renditions):
+    # Копии построены не для текущего файла (или файл убрали, а копии остались)
+    return (renditions or {}).get('source') != (field_file.name or None)
+
+
+def process_instance(model, pk, field_name, renditions_field):
+    # Выполняется в пуле: перечитываем строку и сохраняем результат через update(),
+    # только если файл за это время не заменили
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return None
+    field_file = getattr(obj, field_name)
+    if not needs_renditions(field_file, getattr(obj, renditions_field)):
+        return None
+    queryset = model.objects.filter(pk=pk)
+    if field_file:
+        renditions = (shared_renditions(model, field_name, renditions_field, field_file.name)
+                      or build_renditions(field_file))
+        queryset = queryset.filter(**{field_name: field_file.name})
+    else:
+        renditions = {}
+    updated = queryset.update(**{renditions_field: renditions})
+    if not updated:
+        delete_renditions(field_file.storage, renditions)
+        return None
+    delete_renditions(field_file.storage, getattr(obj, renditions_field))
+    return obj
+
+
+def renditions_srcset(storage, renditions, request=None):
+    # Карта для srcset: {вид: {'width', 'height', 'webp': url, 'jpeg': url}}
+    result = {}
+    for kind, size in (renditions or {}).get('sizes', {}).items():
+        item = {'width': size['width'], 'height': size['height']}
+        for extension in FORMATS:
+            url = storage.url(size[extension])
+            item[extension] = request.build_absolute_uri(url) if request else url
+        result[kind] = item
+    return result
+
+
+def process_post_content(pk):
+    content = process_instance(PostContent, pk, 'content', 'renditions')
+    if content is not None:
+        invalidate('post', content.post_id)
+
+
+def process_user_image(pk):
+    user = process_instance(UserProfile, pk, 'user_image', 'user_image_renditions')
+    if user is not None:
+        invalidate('user', pk)
+        invalidate('author', pk)
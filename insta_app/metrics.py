@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+
+# Замеры на запрос: общее время, число SQL-запросов и их время, повторы одного и того же
+# SQL (признак N+1) и время сериализации. Итог - заголовок Server-Timing и гистограммы
+# по маршрутам в формате Prometheus (/metrics). Не попавшие в выборку запросы
+# (METRICS_SAMPLE_RATE) проходят без замеров: обёртка БД видит пустой контекст и сразу
+# выполняет запрос. Гистограммы живут в памяти процесса - каждый воркер отдаёт свои.
+_current = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def get_sample_rate():
+    return getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = {}
+        self.serializer_time = 0.0
+        self.serializing = False
+        # Запросы async-представлений приходят из нескольких потоков
+        self.lock = threading.Lock()
+
+    def record_query(self, sql, elapsed):
+        with self.lock:
+            self.queries += 1
+            self.sql_time += elapsed
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    @property
+    def duplicates(self):
+        # Один и тот же SQL с разными параметрами: каждый повтор сверх первого
+        return sum(count - 1 for count in self.statements.values())
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'app;dur={total * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries, {self.duplicates} repeated"',
+            f'serializer;dur={self.serializer_time * 1000:.1f}',
+        ])
+
+
+def current_stats():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    # execute_wrapper каждого соединения (см. signals.py); без замера - прямой вызов
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    # Время to_representation верхнего уровня: вложенные сериализаторы и элементы
+    # many=True не считаются дважды, запросы из SerializerMethodField входят в него
+    def to_representation(self, instance):
+        stats = _current.get()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+        stats.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - start
+            stats.serializing = False
+
+
+# ========== ГИСТОГРАММЫ ==========
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series.items()):
+            label_text = _format_labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total:.6g}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.histograms = [
+                Histogram('http_request_duration_seconds', 'Время обработки запроса', DURATION_BUCKETS),
+                Histogram('http_request_sql_duration_seconds', 'Суммарное время SQL за запрос', DURATION_BUCKETS),
+                Histogram('http_request_serializer_duration_seconds', 'Время сериализации за запрос',
+                          DURATION_BUCKETS),
+                Histogram('http_request_queries', 'Число SQL-запросов за запрос', COUNT_BUCKETS),
+                Histogram('http_request_duplicate_queries', 'Повторы одинакового SQL за запрос (N+1)',
+                          COUNT_BUCKETS),
+            ]
+
+    def observe(self, route, method, status, stats, total):
+        labels = (('route', route), ('method', method))
+        values = (total, stats.sql_time, stats.serializer_time, stats.queries, stats.duplicates)
+        with self.lock:
+            key = labels + (('status', status),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for histogram, value in zip(self.histograms, values):
+                histogram.observe(labels, value)
+
+    def render(self):
+        with self.lock:
+            lines = ['# HELP http_requests_total Обработанные запросы (в выборке)',
+                     '# TYPE http_requests_total counter']
+            lines += [f'http_requests_total{{{_format_labels(labels)}}} {count}'
+                      for labels, count in sorted(self.requests.items())]
+            for histogram in self.histograms:
+                lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# ========== MIDDLEWARE ==========
+def route_name(request):
+    # Имя маршрута, а не путь: число рядов в Prometheus не растёт с числом объектов
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        rate = get_sample_rate()
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        total = time.perf_counter() - stats.start
+        route = route_name(request)
+        if route != 'metrics':
+            registry.observe(route, request.method, response.status_code, stats, total)
+        if getattr(settings, 'METRICS_SERVER_TIMING', settings.DEBUG):
+            response['Server-Timing'] = stats.server_timing(total)
+        return response
+
+
+def metrics_view(request):
+    # С METRICS_TOKEN нужен заголовок Authorization: Bearer <токен>
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        header = request.headers.get('Authorization', '')
+        if not constant_time_compare(header, f'Bearer {token}'):
+            return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-18 13:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    Post = apps.get_model('insta_app', 'Post')
+    Follow = apps.get_model('insta_app', 'Follow')
+    TimelineEntry = apps.get_model('insta_app', 'TimelineEntry')
+
+    followers = {}
+    for follower_id, following_id in Follow.objects.values_list('follower_id', 'following_id'):
+        followers.setdefault(following_id, []).append(follower_id)
+
+    entries = []
+    posts = Post.objects.filter(user__isnull=False).values_list('id', 'user_id', 'user__is_official')
+    for post_id, user_id, is_official in posts.iterator():
+        owners = [user_id] if is_official else [user_id, *followers.get(user_id, [])]
+        entries.extend(TimelineEntry(owner_id=owner_id, post_id=post_id) for owner_id in owners)
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='insta_app.post')),
+            ],
+            options={
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-18 13:28
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.values(field).annotate(total=Count('pk')).values('total')), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    UserProfile = apps.get_model('insta_app', 'UserProfile')
+    Follow = apps.get_model('insta_app', 'Follow')
+    Post = apps.get_model('insta_app', 'Post')
+    PostLike = apps.get_model('insta_app', 'PostLike')
+    Comment = apps.get_model('insta_app', 'Comment')
+
+    UserProfile.objects.update(
+        followers_count=_count(Follow.objects.filter(follower=OuterRef('pk')), 'follower'),
+        following_count=_count(Follow.objects.filter(following=OuterRef('pk')), 'following'),
+        posts_count=_count(Post.objects.filter(user=OuterRef('pk')), 'user'),
+    )
+    Post.objects.update(
+        likes_count=_count(PostLike.objects.filter(post=OuterRef('pk'), like=True), 'post'),
+        comments_count=_count(Comment.objects.filter(post=OuterRef('pk')), 'post'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0002_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
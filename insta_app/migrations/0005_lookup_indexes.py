@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-18 13:31
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def collapse_duplicate_likes(apps, schema_editor):
+    # Перед уникальным ограничением оставляем по одной (последней) записи на (post, user)
+    Post = apps.get_model('insta_app', 'Post')
+    PostLike = apps.get_model('insta_app', 'PostLike')
+
+    duplicates = (PostLike.objects.values('post_id', 'user_id')
+                  .annotate(rows=Count('id'), keep=Max('id'))
+                  .filter(rows__gt=1))
+    post_ids = set()
+    for row in duplicates.iterator():
+        (PostLike.objects.filter(post_id=row['post_id'], user_id=row['user_id'])
+         .exclude(id=row['keep']).delete())
+        post_ids.add(row['post_id'])
+
+    likes = (PostLike.objects.filter(post=OuterRef('pk'), like=True)
+             .values('post').annotate(total=Count('pk')).values('total'))
+    Post.objects.filter(id__in=post_ids).update(likes_count=Coalesce(Subquery(likes), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='postlike',
+            unique_together={('post', 'user')},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_date', 'id'], name='comment_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'created_date', 'id'], name='comment_post_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_date', 'id'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['hashtag', 'created_date', 'id'], name='post_hashtag_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postlike',
+            index=models.Index(fields=['post', 'like'], name='postlike_post_like_idx'),
+        ),
+    ]
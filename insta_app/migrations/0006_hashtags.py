@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-18 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from insta_app.hashtags import parse_hashtags
+
+
+def fill_hashtags(apps, schema_editor):
+    Post = apps.get_model('insta_app', 'Post')
+    Hashtag = apps.get_model('insta_app', 'Hashtag')
+    PostTags = Post.tags.through
+
+    post_names = {}
+    for post_id, description, hashtag in Post.objects.values_list('id', 'description', 'hashtag').iterator():
+        names = parse_hashtags(description, hashtag)
+        if names:
+            post_names[post_id] = names
+    all_names = {name for names in post_names.values() for name in names}
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in all_names], ignore_conflicts=True)
+    ids = dict(Hashtag.objects.filter(name__in=all_names).values_list('name', 'id'))
+    PostTags.objects.bulk_create(
+        [PostTags(post_id=post_id, hashtag_id=ids[name])
+         for post_id, names in post_names.items() for name in names],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0005_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='posts', to='insta_app.hashtag'),
+        ),
+        migrations.CreateModel(
+            name='HashtagTrend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trends', to='insta_app.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='hashtagtrend_bucket_idx')],
+                'unique_together': {('hashtag', 'bucket')},
+            },
+        ),
+        migrations.RunPython(fill_hashtags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-18 13:40
+
+from django.db import migrations
+
+
+# DDL и начальное заполнение записаны здесь, а не берутся из insta_app.search:
+# правки кода поиска не должны менять то, что делает уже применённая миграция
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS insta_app_post_fts "
+        "USING fts5(description, hashtag, username, tokenize='unicode61 remove_diacritics 2')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS insta_app_userprofile_fts "
+        "USING fts5(username, bio, tokenize='unicode61 remove_diacritics 2')",
+        "INSERT INTO insta_app_post_fts (rowid, description, hashtag, username) "
+        "SELECT post.id, COALESCE(post.description, ''), COALESCE(post.hashtag, ''), COALESCE(author.username, '') "
+        "FROM insta_app_post post LEFT JOIN insta_app_userprofile author ON author.id = post.user_id",
+        "INSERT INTO insta_app_userprofile_fts (rowid, username, bio) "
+        "SELECT id, COALESCE(username, ''), COALESCE(bio, '') FROM insta_app_userprofile",
+    ],
+    'postgresql': [
+        'CREATE TABLE IF NOT EXISTS insta_app_post_fts (object_id bigint PRIMARY KEY, document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS insta_app_post_fts_document_idx ON insta_app_post_fts USING GIN (document)',
+        'CREATE TABLE IF NOT EXISTS insta_app_userprofile_fts '
+        '(object_id bigint PRIMARY KEY, document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS insta_app_userprofile_fts_document_idx '
+        'ON insta_app_userprofile_fts USING GIN (document)',
+        "INSERT INTO insta_app_post_fts (object_id, document) "
+        "SELECT post.id, to_tsvector('simple', concat_ws(' ', COALESCE(post.description, ''), "
+        "COALESCE(post.hashtag, ''), COALESCE(author.username, ''))) "
+        "FROM insta_app_post post LEFT JOIN insta_app_userprofile author ON author.id = post.user_id",
+        "INSERT INTO insta_app_userprofile_fts (object_id, document) "
+        "SELECT id, to_tsvector('simple', concat_ws(' ', COALESCE(username, ''), COALESCE(bio, ''))) "
+        "FROM insta_app_userprofile",
+    ],
+}
+
+DROP_SQL = {
+    'sqlite': [
+        'DROP TABLE IF EXISTS insta_app_post_fts',
+        'DROP TABLE IF EXISTS insta_app_userprofile_fts',
+    ],
+    'postgresql': [
+        'DROP TABLE IF EXISTS insta_app_post_fts',
+        'DROP TABLE IF EXISTS insta_app_userprofile_fts',
+    ],
+}
+
+
+def run_vendor_sql(statements):
+    # На прочих СУБД индекса нет, поиск идёт обычным SearchFilter
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0006_hashtags'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_vendor_sql(CREATE_SQL), run_vendor_sql(DROP_SQL)),
+    ]
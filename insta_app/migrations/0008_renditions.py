@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postcontent',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='user_image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
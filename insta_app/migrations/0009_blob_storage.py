@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 13:43
+
+import insta_app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0008_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='postcontent',
+            name='content',
+            field=models.FileField(storage=insta_app.storage.content_storage, upload_to='posts/'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='user_image',
+            field=models.ImageField(blank=True, null=True, storage=insta_app.storage.content_storage, upload_to=''),
+        ),
+    ]
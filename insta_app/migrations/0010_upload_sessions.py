@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 13:45
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0009_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('active', 'Загружается'), ('complete', 'Завершена')], default='active', max_length=16)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('content', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='insta_app.postcontent')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='insta_app.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
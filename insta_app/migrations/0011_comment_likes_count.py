@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 13:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_likes(apps, schema_editor):
+    # Дубликатов (comment, user) быть не может: unique_together стоит с 0001,
+    # у PostLike они схлопнуты в 0005 - остаётся только заполнить счётчик
+    Comment = apps.get_model('insta_app', 'Comment')
+    CommentLike = apps.get_model('insta_app', 'CommentLike')
+
+    likes = (CommentLike.objects.filter(comment=OuterRef('pk'), like=True)
+             .values('comment').annotate(total=Count('pk')).values('total'))
+    Comment.objects.update(likes_count=Coalesce(Subquery(likes), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0010_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_comment_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0012_task_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post_like', 'Лайк поста'), ('comment', 'Комментарий к посту'), ('reply', 'Ответ на комментарий'), ('comment_like', 'Лайк комментария'), ('follow', 'Подписка')], max_length=20)),
+                ('group_key', models.CharField(max_length=100)),
+                ('actors', models.JSONField(blank=True, default=list)),
+                ('actors_count', models.PositiveIntegerField(default=0)),
+                ('is_read', models.BooleanField(default=False)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_date', models.DateTimeField()),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='insta_app.comment')),
+                ('last_actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='insta_app.post')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', 'updated_date', 'id'], name='notification_inbox_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_read', False)), fields=('recipient', 'group_key'), name='notification_unread_group')],
+            },
+        ),
+    ]
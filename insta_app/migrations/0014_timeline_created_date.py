@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 15:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_created_date(apps, schema_editor):
+    TimelineEntry = apps.get_model('insta_app', 'TimelineEntry')
+    Post = apps.get_model('insta_app', 'Post')
+
+    TimelineEntry.objects.update(
+        created_date=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_date')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0013_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='created_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(fill_created_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='created_date',
+            field=models.DateField(),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', 'created_date', 'post'], name='timeline_page_idx'),
+        ),
+    ]
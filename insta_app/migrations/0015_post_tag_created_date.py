@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_created_date(apps, schema_editor):
+    PostTag = apps.get_model('insta_app', 'PostTag')
+    Post = apps.get_model('insta_app', 'Post')
+
+    PostTag.objects.update(
+        created_date=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_date')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insta_app', '0014_timeline_created_date'),
+    ]
+
+    operations = [
+        # Таблица связи остаётся прежней (insta_app_post_tags), меняется только описание модели
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PostTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='insta_app.post')),
+                        ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='insta_app.hashtag')),
+                    ],
+                    options={
+                        'db_table': 'insta_app_post_tags',
+                        'unique_together': {('post', 'hashtag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='tags',
+                    field=models.ManyToManyField(blank=True, related_name='posts', through='insta_app.PostTag', to='insta_app.hashtag'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='posttag',
+            name='created_date',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(fill_created_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='posttag',
+            name='created_date',
+            field=models.DateField(),
+        ),
+        migrations.AddIndex(
+            model_name='posttag',
+            index=models.Index(fields=['hashtag', 'created_date', 'post'], name='posttag_page_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    # Режим WAL хранится в файле базы: достаточно переключить один раз.
+    # Для базы в памяти SQLite оставляет режим memory
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+
+class Migration(migrations.Migration):
+    # PRAGMA journal_mode=WAL не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('insta_app', '0015_post_tag_created_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, migrations.RunPython.noop),
+    ]
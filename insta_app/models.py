@@ -1,17 +1,31 @@
+import uuid
 from django.db import models
+from django.db.models.functions import RowNumber
 from django.contrib.auth.models import AbstractUser
+from .storage import content_storage
 
 
 class UserProfile(AbstractUser):
     bio = models.TextField(null=True,blank=True)
-    user_image = models.ImageField(null=True,blank=True)
+    user_image = models.ImageField(null=True,blank=True,storage=content_storage)
+    # Уменьшенные копии, размеры и blurhash аватара (см. media.py)
+    user_image_renditions = models.JSONField(default=dict, blank=True)
     is_official = models.BooleanField(default=False)
     user_link = models.URLField(null=True,blank=True)
     date_registered = models.DateField(auto_now_add=True)
+    # Денормализованные счётчики (см. counters.py и recount_counters)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'@{self.username}'
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['date_registered', 'id'], name='user_registered_idx'),
+        ]
+
 class Follow(models.Model):
     following = models.ForeignKey(UserProfile,related_name='followings', on_delete=models.CASCADE)
     follower = models.ForeignKey(UserProfile, related_name='followers', on_delete=models.CASCADE)
@@ -22,6 +36,45 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            models.Index(fields=['create_date', 'id'], name='follow_created_idx'),
+            models.Index(fields=['follower', 'create_date', 'id'], name='follow_follower_created_idx'),
+            models.Index(fields=['following', 'create_date', 'id'], name='follow_following_created_idx'),
+        ]
+
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class HashtagTrend(models.Model):
+    # Почасовые счётчики использования тегов для скользящего окна трендов
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='trends')
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'#{self.hashtag.name} {self.bucket:%Y-%m-%d %H}:00 - {self.count}'
+
+    class Meta:
+        unique_together = ('hashtag', 'bucket')
+        indexes = [
+            models.Index(fields=['bucket'], name='hashtagtrend_bucket_idx'),
+        ]
+
+
+class PostQuerySet(models.QuerySet):
+    def with_list_data(self):
+        # Всё, что нужно PostListSerializer, за фиксированное число запросов
+        first_contents = (PostContent.objects
+                          .annotate(position=models.Window(RowNumber(), partition_by='post_id', order_by='id'))
+                          .filter(position=1))
+        return (self.select_related('user')
+                .prefetch_related(models.Prefetch('postcontent_set', queryset=first_contents,
+                                                  to_attr='first_contents')))
 
 
 class Post(models.Model):
@@ -29,14 +82,45 @@ class Post(models.Model):
     hashtag = models.CharField(max_length=100,null=True,blank=True)
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE,null=True,blank=True)
     created_date = models.DateField(auto_now_add=True)
+    tags = models.ManyToManyField(Hashtag, through='PostTag', related_name='posts', blank=True)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.description[:10]} ({self.created_date})'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='post_created_idx'),
+            models.Index(fields=['user', 'created_date', 'id'], name='post_user_created_idx'),
+            models.Index(fields=['hashtag', 'created_date', 'id'], name='post_hashtag_created_idx'),
+        ]
+
+
+class PostTag(models.Model):
+    # Связь Post.tags с копией даты поста: страница тега - один диапазон индекса, без сортировки
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
+    created_date = models.DateField()
+
+    def __str__(self):
+        return f'Post {self.post_id} #{self.hashtag_id}'
+
+    class Meta:
+        db_table = 'insta_app_post_tags'
+        unique_together = ('post', 'hashtag')
+        indexes = [
+            models.Index(fields=['hashtag', 'created_date', 'post'], name='posttag_page_idx'),
+        ]
+
 
 class PostContent(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE,)
-    content = models.FileField(upload_to='posts/')
+    content = models.FileField(upload_to='posts/', storage=content_storage)
+    # Уменьшенные копии, размеры и blurhash (см. media.py)
+    renditions = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f'Content for Post {self.post.id}'
@@ -50,6 +134,12 @@ class PostLike(models.Model):
     def __str__(self):
         return f'Post {self.post.id} - {self.like}'
 
+    class Meta:
+        unique_together = ('post', 'user')
+        indexes = [
+            models.Index(fields=['post', 'like'], name='postlike_post_like_idx'),
+        ]
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post,on_delete=models.CASCADE,related_name='comments')
@@ -57,10 +147,18 @@ class Comment(models.Model):
     text = models.TextField(null=True,blank=True)
     parent = models.ForeignKey('self',on_delete=models.CASCADE,null=True,blank=True,related_name='subcomments')
     created_date = models.DateField(auto_now_add=True)
+    likes_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'{self.post.id}: {self.user.username} - {self.text[:30]}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='comment_created_idx'),
+            models.Index(fields=['post', 'created_date', 'id'], name='comment_post_created_idx'),
+            models.Index(fields=['post', 'parent', 'created_date', 'id'], name='comment_post_parent_idx'),
+        ]
+
 
 class CommentLike(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
@@ -74,3 +172,135 @@ class CommentLike(models.Model):
         unique_together = ('comment', 'user')
 
 
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Копия post.created_date: страница ленты - один диапазон индекса, без обращения к постам
+    created_date = models.DateField()
+
+    def __str__(self):
+        return f'{self.owner.username} <- Post {self.post_id}'
+
+    class Meta:
+        unique_together = ('owner', 'post')
+        indexes = [
+            models.Index(fields=['owner', 'created_date', 'post'], name='timeline_page_idx'),
+        ]
+
+
+class Blob(models.Model):
+    # Файл в хранилище по хэшу содержимого (storage.py) и число ссылок на него
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class UploadSession(models.Model):
+    # Загрузка файла частями (uploads.py); байты лежат в CHUNKED_UPLOAD_DIR/<id>.part
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Загружается'),
+        (STATUS_COMPLETE, 'Завершена'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='upload_sessions')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    content = models.ForeignKey(PostContent, on_delete=models.SET_NULL, null=True, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Upload {self.filename} ({self.status})'
+
+
+class Task(models.Model):
+    # Отложенная работа для run_workers (tasks.py). Выполненные задачи удаляются,
+    # исчерпавшие попытки остаются со статусом failed и текстом ошибки
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_at', 'id'], name='task_claim_idx'),
+        ]
+        constraints = [
+            # Пока задача с ключом ждёт в очереди, такая же не ставится второй раз
+            models.UniqueConstraint(fields=['dedupe_key'], condition=models.Q(status='queued'),
+                                    name='task_queued_dedupe_key'),
+        ]
+
+
+class Notification(models.Model):
+    # Уведомление-группа (notifications.py): однотипные события об одном объекте
+    # сливаются в одну непрочитанную строку - «alice и ещё 41 поставили лайк»
+    KIND_POST_LIKE = 'post_like'
+    KIND_COMMENT = 'comment'
+    KIND_REPLY = 'reply'
+    KIND_COMMENT_LIKE = 'comment_like'
+    KIND_FOLLOW = 'follow'
+    KIND_CHOICES = [
+        (KIND_POST_LIKE, 'Лайк поста'),
+        (KIND_COMMENT, 'Комментарий к посту'),
+        (KIND_REPLY, 'Ответ на комментарий'),
+        (KIND_COMMENT_LIKE, 'Лайк комментария'),
+        (KIND_FOLLOW, 'Подписка'),
+    ]
+
+    recipient = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    group_key = models.CharField(max_length=100)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    last_actor = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+')
+    # Последние участники (id, новые первыми) - повтор того же человека не увеличивает actors_count
+    actors = models.JSONField(default=list, blank=True)
+    actors_count = models.PositiveIntegerField(default=0)
+    is_read = models.BooleanField(default=False)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.recipient_id}: {self.kind} x{self.actors_count}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'updated_date', 'id'], name='notification_inbox_idx'),
+        ]
+        constraints = [
+            # Одна непрочитанная группа на ключ; она же - индекс для счётчика непрочитанных
+            models.UniqueConstraint(fields=['recipient', 'group_key'], condition=models.Q(is_read=False),
+                                    name='notification_unread_group'),
+        ]
@@ -0,0 +1,183 @@
+from datetime import timedelta
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from .models import Notification, Post, Comment
+
+
+# Входящие уведомления: события (лайк, комментарий, подписка) сливаются при записи
+# в одну непрочитанную группу на (получатель, объект), поэтому чтение ящика - одна
+# выборка по индексу (recipient, updated_date, id), а счётчик непрочитанных - COUNT
+# по уникальному частичному индексу. После прочтения новая активность открывает новую группу.
+# Снятие лайка и отписка уведомление не отзывают.
+RECENT_ACTORS = 10
+RETENTION_DAYS = 90
+
+
+class Event:
+    def __init__(self, recipient_id, kind, actor_id, post_id=None, comment_id=None):
+        self.recipient_id = recipient_id
+        self.kind = kind
+        self.actor_id = actor_id
+        self.post_id = post_id
+        self.comment_id = comment_id
+
+    @property
+    def group_key(self):
+        # Комментарии к посту - одна группа на пост, ответы и лайки комментария - на комментарий
+        if self.kind == Notification.KIND_FOLLOW:
+            return self.kind
+        if self.kind in (Notification.KIND_POST_LIKE, Notification.KIND_COMMENT):
+            return f'{self.kind}:{self.post_id}'
+        return f'{self.kind}:{self.comment_id}'
+
+
+def notify(events):
+    # Вся пачка - фиксированное число запросов: выборка открытых групп и одна запись
+    groups = {}
+    for event in events:
+        if event.recipient_id is None or event.recipient_id == event.actor_id:
+            continue
+        groups.setdefault((event.recipient_id, event.group_key), []).append(event)
+    if not groups:
+        return
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _write_groups(groups)
+            return
+        except IntegrityError:
+            # Без upsert: ту же группу одновременно создал другой запрос - со второй попытки она найдётся
+            if attempt:
+                raise
+
+
+def _write_groups(groups):
+    existing = {(notification.recipient_id, notification.group_key): notification
+                for notification in Notification.objects.select_for_update().filter(
+                    recipient_id__in={recipient_id for recipient_id, _ in groups},
+                    group_key__in={key for _, key in groups}, is_read=False)}
+    created, updated = [], []
+    for (recipient_id, key), events in groups.items():
+        notification = existing.get((recipient_id, key))
+        if notification is None:
+            first = events[0]
+            notification = Notification(recipient_id=recipient_id, kind=first.kind, group_key=key,
+                                        post_id=first.post_id)
+            created.append(notification)
+        else:
+            updated.append(notification)
+        _merge(notification, events)
+    if _supports_upsert():
+        _upsert(created + updated)
+        return
+    if updated:
+        Notification.objects.bulk_update(updated, MERGED_FIELDS)
+    if created:
+        Notification.objects.bulk_create(created)
+
+
+MERGED_FIELDS = ['actors', 'actors_count', 'last_actor', 'comment', 'updated_date']
+INSERTED_FIELDS = ['recipient', 'kind', 'group_key', 'post', 'is_read', 'created_date'] + MERGED_FIELDS
+
+
+def _supports_upsert():
+    # ON CONFLICT с условием частичного индекса: PostgreSQL и SQLite
+    return connection.vendor in ('postgresql', 'sqlite')
+
+
+def _upsert(notifications):
+    # Новые и уже открытые группы - одним INSERT ... ON CONFLICT по частичному уникальному индексу.
+    # Открытые группы заблокированы выборкой; группу, созданную параллельно, перезапишет
+    # наше слияние - в худшем случае в ней не хватит одного участника
+    qn = connection.ops.quote_name
+    now = timezone.now()
+    fields = [Notification._meta.get_field(name) for name in INSERTED_FIELDS]
+    rows, params = [], []
+    for notification in notifications:
+        if notification.created_date is None:
+            notification.created_date = now
+        rows.append('(' + ', '.join(['%s'] * len(fields)) + ')')
+        params += [field.get_db_prep_save(getattr(notification, field.attname), connection) for field in fields]
+    columns = ', '.join(qn(field.column) for field in fields)
+    updates = ', '.join(f'{qn(column)} = excluded.{qn(column)}'
+                        for column in (Notification._meta.get_field(name).column for name in MERGED_FIELDS))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(Notification._meta.db_table)} ({columns}) VALUES {", ".join(rows)} '
+            # Условие - дословно как у индекса notification_unread_group
+            f"ON CONFLICT ({qn('recipient_id')}, {qn('group_key')}) WHERE NOT {qn('is_read')} "
+            f'DO UPDATE SET {updates}',
+            params,
+        )
+
+
+def _merge(notification, events):
+    actors = list(notification.actors)
+    for event in events:
+        if event.actor_id in actors:
+            actors.remove(event.actor_id)
+        else:
+            notification.actors_count += 1
+        actors.insert(0, event.actor_id)
+    notification.actors = actors[:RECENT_ACTORS]
+    notification.last_actor_id = actors[0]
+    # Для комментариев к посту - последний комментарий
+    notification.comment_id = events[-1].comment_id
+    notification.updated_date = timezone.now()
+
+
+# ========== СОБЫТИЯ ==========
+def post_like_events(pairs):
+    # pairs - (post_id, user_id); владельцы постов - одним запросом
+    owners = dict(Post.objects.filter(pk__in={post_id for post_id, _ in pairs}).values_list('pk', 'user_id'))
+    return [Event(owners.get(post_id), Notification.KIND_POST_LIKE, user_id, post_id=post_id)
+            for post_id, user_id in pairs]
+
+
+def comment_like_events(pairs):
+    # pairs - (comment_id, user_id)
+    comments = {pk: (user_id, post_id) for pk, user_id, post_id in Comment.objects.filter(
+        pk__in={comment_id for comment_id, _ in pairs}).values_list('pk', 'user_id', 'post_id')}
+    events = []
+    for comment_id, user_id in pairs:
+        if comment_id in comments:
+            owner_id, post_id = comments[comment_id]
+            events.append(Event(owner_id, Notification.KIND_COMMENT_LIKE, user_id,
+                                post_id=post_id, comment_id=comment_id))
+    return events
+
+
+def follow_events(pairs):
+    # pairs - (follower_id, following_id): уведомление тому, на кого подписались
+    return [Event(following_id, Notification.KIND_FOLLOW, follower_id) for follower_id, following_id in pairs]
+
+
+def comment_events(comment):
+    post_owner = Post.objects.filter(pk=comment.post_id).values_list('user_id', flat=True).first()
+    events = [Event(post_owner, Notification.KIND_COMMENT, comment.user_id,
+                    post_id=comment.post_id, comment_id=comment.pk)]
+    if comment.parent_id is not None:
+        parent_owner = Comment.objects.filter(pk=comment.parent_id).values_list('user_id', flat=True).first()
+        # Автору поста, который сам написал родительский комментарий, хватит одного уведомления
+        if parent_owner != post_owner:
+            events.append(Event(parent_owner, Notification.KIND_REPLY, comment.user_id,
+                                post_id=comment.post_id, comment_id=comment.parent_id))
+    return events
+
+
+# ========== ЧТЕНИЕ ==========
+def unread_count(user):
+    return Notification.objects.filter(recipient=user, is_read=False).count()
+
+
+def mark_read(user, ids=None):
+    queryset = Notification.objects.filter(recipient=user, is_read=False)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return queryset.update(is_read=True)
+
+
+def prune_notifications(days=RETENTION_DAYS):
+    border = timezone.now() - timedelta(days=days)
+    deleted, _ = Notification.objects.filter(is_read=True, updated_date__lt=border).delete()
+    return deleted
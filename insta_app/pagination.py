@@ -1,7 +1,192 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from datetime import date, datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class PostPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
-    max_page_size = 25
\ No newline at end of file
+    max_page_size = 25
+
+
+class KeysetPagination(BasePagination):
+    # Пагинация по ключу (created_date, id): страница N стоит столько же, сколько первая
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+        results = self.fetch(queryset, ordering, position, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def fetch(self, queryset, ordering, position, limit):
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek(ordering, position))
+        return list(queryset[:limit])
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        # Фильтры могут задать свой ключ (например, ранжированный поиск)
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_keyset_ordering'):
+                ordering = backend().get_keyset_ordering(request, queryset, view)
+            elif issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+            if ordering:
+                break
+        if not ordering:
+            ordering = getattr(view, 'ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(field for field in ordering if '__' not in field)
+        # id в конце ключа делает порядок строгим даже при одинаковых датах
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            descending = ordering[0].startswith('-') if ordering else True
+            ordering += ('-id' if descending else 'id',)
+        return ordering
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def seek(ordering, position):
+        # (a, b) > (x, y)  =>  a >= x AND (a > x OR (a = x AND b > y));
+        # первое условие даёт диапазон по индексу, остальные отсекают границу
+        names = [field.lstrip('-') for field in ordering]
+        lookups = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+        condition = Q()
+        for i in range(len(ordering)):
+            equal = {names[j]: position[j] for j in range(i)}
+            condition |= Q(**equal, **{f'{names[i]}__{lookups[i]}': position[i]})
+        bound = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{names[0]}__{bound}': position[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = data['p'], bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, item, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(item, field.lstrip('-'))
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            position.append(value)
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        encoded = b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'schema': {'type': 'integer'}},
+        ]
+
+
+class PostIndexPagination(KeysetPagination):
+    # Посты по отдельному индексу (лента, тег): ключи страницы (дата, id поста) отдаёт
+    # view.get_page_keys(ordering, position, limit), посты загружаются одним запросом по id.
+    # Порядок фиксирован - по нему построены индексы
+    def get_ordering(self, request, queryset, view):
+        return ('-created_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.view = view
+        return super().paginate_queryset(queryset, request, view)
+
+    def fetch(self, queryset, ordering, position, limit):
+        keys = self.view.get_page_keys(ordering, position, limit)
+        posts = queryset.in_bulk([post_id for _, post_id in keys])
+        return [posts[post_id] for _, post_id in keys if post_id in posts]
+
+
+def index_range(queryset, ordering, position, limit, post_field='post_id'):
+    # Ключи одной страницы из таблицы-индекса со ссылкой на пост: id в ordering - это post_field
+    ordering = [field.replace('id', post_field) if field.lstrip('-') == 'id' else field for field in ordering]
+    queryset = queryset.order_by(*ordering)
+    if position is not None:
+        queryset = queryset.filter(KeysetPagination.seek(ordering, position))
+    return queryset.values_list('created_date', post_field)[:limit]
@@ -0,0 +1,101 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Кэш сериализованных объектов с версиями: ключ = (вид, id, версия, вариант).
+# Инвалидация только меняет версию, старые записи просто перестают читаться.
+KEY_PREFIX = 'insta'
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def _stamp_key(kind, pk):
+    return f'{KEY_PREFIX}:stamp:{kind}:{pk}'
+
+
+def _new_stamp():
+    return time.time_ns()
+
+
+def _resolve_stamps(keys, found):
+    # Отсутствующие версии заводятся заново: -> ({(вид, id): версия}, {ключ: новая версия})
+    stamps, missing = {}, {}
+    for dep, key in keys.items():
+        if key in found:
+            stamps[dep] = found[key]
+        else:
+            stamps[dep] = missing[key] = _new_stamp()
+    return stamps, missing
+
+
+def get_stamps(deps):
+    # deps: [(вид, id), ...] -> {(вид, id): версия}
+    cache = get_cache()
+    keys = {dep: _stamp_key(*dep) for dep in deps}
+    stamps, missing = _resolve_stamps(keys, cache.get_many(list(keys.values())))
+    if missing:
+        cache.set_many(missing, None)
+    return stamps
+
+
+async def aget_stamps(deps):
+    cache = get_cache()
+    keys = {dep: _stamp_key(*dep) for dep in deps}
+    stamps, missing = _resolve_stamps(keys, await cache.aget_many(list(keys.values())))
+    if missing:
+        await cache.aset_many(missing, None)
+    return stamps
+
+
+def invalidate(kind, pk):
+    if pk is not None:
+        get_cache().set(_stamp_key(kind, pk), _new_stamp(), None)
+
+
+def invalidate_many(kind, pks):
+    stamp = _new_stamp()
+    get_cache().set_many({_stamp_key(kind, pk): stamp for pk in pks if pk is not None}, None)
+
+
+def cached_representation(kind, pk, variant, build):
+    # build() -> (данные, {(вид, id): версия}) для зависимостей, прочитанных до сериализации
+    cache = get_cache()
+    stamp = get_stamps([(kind, pk)])[(kind, pk)]
+    variant = hashlib.md5(variant.encode('utf-8')).hexdigest()
+    key = f'{KEY_PREFIX}:repr:{kind}:{pk}:{stamp}:{variant}'
+
+    entry = cache.get(key)
+    if entry is not None:
+        data, dep_stamps = entry
+        if not dep_stamps or get_stamps(list(dep_stamps)) == dep_stamps:
+            return data
+
+    data, dep_stamps = build()
+    cache.set(key, (data, dep_stamps), get_timeout())
+    return data
+
+
+async def acached_representation(kind, pk, variant, build):
+    # То же для асинхронных представлений: build - корутина
+    cache = get_cache()
+    stamp = (await aget_stamps([(kind, pk)]))[(kind, pk)]
+    variant = hashlib.md5(variant.encode('utf-8')).hexdigest()
+    key = f'{KEY_PREFIX}:repr:{kind}:{pk}:{stamp}:{variant}'
+
+    entry = await cache.aget(key)
+    if entry is not None:
+        data, dep_stamps = entry
+        if not dep_stamps or await aget_stamps(list(dep_stamps)) == dep_stamps:
+            return data
+
+    data, dep_stamps = await build()
+    await cache.aset(key, (data, dep_stamps), get_timeout())
+    return data
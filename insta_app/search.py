@@ -0,0 +1,172 @@
+import re
+from django.apps import apps
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+class SearchIndex:
+    # Инвертированный индекс для одной модели: rowid = pk, колонки = текстовые поля
+    def __init__(self, table, model_label, columns):
+        self.table = table
+        self.model_label = model_label
+        self.columns = columns
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @property
+    def model_table(self):
+        return self.model._meta.db_table
+
+    def document(self, obj):
+        return [getter(obj) or '' for getter in self.columns.values()]
+
+
+POST_INDEX = SearchIndex('insta_app_post_fts', 'insta_app.Post', {
+    'description': lambda post: post.description,
+    'hashtag': lambda post: post.hashtag,
+    'username': lambda post: post.user.username if post.user_id else '',
+})
+
+USER_INDEX = SearchIndex('insta_app_userprofile_fts', 'insta_app.UserProfile', {
+    'username': lambda user: user.username,
+    'bio': lambda user: user.bio,
+})
+
+INDEXES = [POST_INDEX, USER_INDEX]
+
+
+def tokenize(term):
+    return TOKEN_RE.findall(term.lower())
+
+
+class SqliteBackend:
+    # SQLite FTS5, ранжирование bm25 (меньше - лучше)
+    ordering = ('search_rank', 'id')
+
+    def create(self, cursor, index):
+        columns = ', '.join(index.columns)
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.table} "
+                       f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')")
+
+    def drop(self, cursor, index):
+        cursor.execute(f'DROP TABLE IF EXISTS {index.table}')
+
+    def upsert(self, cursor, index, rows):
+        # rows: [(pk, [значения колонок]), ...]
+        self.delete(cursor, index, [pk for pk, _ in rows])
+        placeholders = ', '.join(['%s'] * (len(index.columns) + 1))
+        cursor.executemany(
+            f"INSERT INTO {index.table} (rowid, {', '.join(index.columns)}) VALUES ({placeholders})",
+            [[pk, *values] for pk, values in rows],
+        )
+
+    def delete(self, cursor, index, pks):
+        cursor.executemany(f'DELETE FROM {index.table} WHERE rowid = %s', [[pk] for pk in pks])
+
+    def query(self, tokens):
+        # Каждое слово - префиксный поиск, синтаксис FTS5 из ввода не пропускаем
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, queryset, index, tokens):
+        match = self.query(tokens)
+        matches = RawSQL(f'SELECT rowid FROM {index.table} WHERE {index.table} MATCH %s', [match])
+        rank = RawSQL(f'SELECT bm25({index.table}) FROM {index.table} '
+                      f'WHERE {index.table} MATCH %s AND rowid = "{index.model_table}"."id"', [match])
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+class PostgresBackend:
+    # Таблица tsvector с GIN-индексом, ранжирование ts_rank (больше - лучше)
+    ordering = ('-search_rank', 'id')
+    config = 'simple'
+
+    def create(self, cursor, index):
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {index.table} '
+                       f'(object_id bigint PRIMARY KEY, document tsvector NOT NULL)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {index.table}_document_idx '
+                       f'ON {index.table} USING GIN (document)')
+
+    def drop(self, cursor, index):
+        cursor.execute(f'DROP TABLE IF EXISTS {index.table}')
+
+    def upsert(self, cursor, index, rows):
+        cursor.executemany(
+            f"INSERT INTO {index.table} (object_id, document) VALUES (%s, to_tsvector('{self.config}', %s)) "
+            f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document",
+            [[pk, ' '.join(values)] for pk, values in rows],
+        )
+
+    def delete(self, cursor, index, pks):
+        cursor.execute(f'DELETE FROM {index.table} WHERE object_id = ANY(%s)', [list(pks)])
+
+    def query(self, tokens):
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def search(self, queryset, index, tokens):
+        tsquery = f"to_tsquery('{self.config}', %s)"
+        match = self.query(tokens)
+        matches = RawSQL(f'SELECT object_id FROM {index.table} WHERE document @@ {tsquery}', [match])
+        rank = RawSQL(f'SELECT ts_rank(document, {tsquery}) FROM {index.table} '
+                      f'WHERE object_id = "{index.model_table}"."id"', [match])
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+
+def get_backend(conn=None):
+    return BACKENDS.get((conn or connection).vendor)
+
+
+def get_index(model):
+    for index in INDEXES:
+        if index.model._meta.concrete_model is model._meta.concrete_model:
+            return index
+    return None
+
+
+def update_index(index, objects):
+    backend = get_backend()
+    if backend is None or not objects:
+        return
+    with connection.cursor() as cursor:
+        backend.upsert(cursor, index, [(obj.pk, index.document(obj)) for obj in objects])
+
+
+def remove_from_index(index, pks):
+    backend = get_backend()
+    if backend is None or not pks:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, index, pks)
+
+
+class FullTextSearchFilter(SearchFilter):
+    # Поиск по инвертированному индексу; на прочих СУБД - обычный SearchFilter
+    def get_search_index(self, request, queryset):
+        if not self.get_search_terms(request) or get_backend() is None:
+            return None
+        return get_index(queryset.model)
+
+    def filter_queryset(self, request, queryset, view):
+        index = self.get_search_index(request, queryset)
+        if index is None:
+            return super().filter_queryset(request, queryset, view)
+        tokens = tokenize(' '.join(self.get_search_terms(request)))
+        if not tokens:
+            return queryset.none()
+        return get_backend().search(queryset, index, tokens)
+
+    def get_keyset_ordering(self, request, queryset, view):
+        if self.get_search_index(request, queryset) is None:
+            return None
+        return get_backend().ordering
@@ -1,12 +1,137 @@
+import re
 from rest_framework import serializers
 from .models import (UserProfile, Post, Comment, Follow, PostContent,
-                     PostLike, CommentLike)
+                     PostLike, CommentLike, UploadSession, Notification)
 from django.contrib.auth import get_user_model, authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from .comment_tree import attach_comment_tree, load_post_comments
+from .media import renditions_srcset
+from .uploads import uploaded_size, get_max_size
+from .metrics import TimedSerializerMixin
+from .authentication import SessionRefreshToken
 
 User = get_user_model()
 
 
+def viewer_flag(context, name, value):
+    # None - состояние пользователя не посчитано (например, общий кэшируемый ответ)
+    ids = context.get(name)
+    if ids is None:
+        return None
+    return value in ids
+
+
+def parse_field_tree(value):
+    # 'id,user.username,user.id' -> {'id': None, 'user': {'username': None, 'id': None}};
+    # None - поле целиком
+    tree = {}
+    for path in value.split(','):
+        names = [name for name in path.strip().split('.') if name]
+        node = tree
+        for depth, name in enumerate(names):
+            if depth == len(names) - 1:
+                node[name] = None
+            elif name in node and node[name] is None:
+                break
+            else:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def sparse_params(request):
+    # -> (дерево полей или None, набор expand); только для чтения - запись видит все поля
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None, frozenset()
+    params = getattr(request, 'query_params', request.GET)
+    fields = params.get('fields')
+    expand = frozenset(name.strip() for name in params.get('expand', '').split(',') if name.strip())
+    return (parse_field_tree(fields) if fields else None), expand
+
+
+def wants_field(request, name):
+    fields, _ = sparse_params(request)
+    return fields is None or name in fields
+
+
+def sparse_variant(request):
+    # Добавка к ключу кэша ответа: у каждой выборки полей своя запись
+    fields, expand = sparse_params(request)
+    if fields is None and not expand:
+        return ''
+    return f'|fields={fields}|expand={sorted(expand)}'
+
+
+class SparseFieldsMixin:
+    # ?fields=id,likes_count,user.username - в ответе только эти поля (через точку - во вложенном
+    # сериализаторе), ?expand=user - вместо id связанного объекта сам объект (Meta.expandable_fields).
+    # Невыбранные поля даже не создаются: их SerializerMethodField и запросы не выполняются.
+    # Сериализатор, созданный вручную внутри SerializerMethodField, получает свою часть
+    # выбора через sparse_options=self.nested_sparse_options(name)
+    def __init__(self, *args, sparse_options=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if sparse_options is not None:
+            self.sparse_options = sparse_options
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_sparse_options()
+        meta = getattr(self, 'Meta', None)
+        expandable = getattr(meta, 'expandable_fields', {})
+        for name in expand:
+            if name in expandable and name in fields:
+                fields[name] = expandable[name](read_only=True)
+        if only is None:
+            return fields
+        # Meta.sparse_requires: поля, без которых выбранное поле не досчитать (флаги зрителя в кэше)
+        keep = set(only)
+        for name in only:
+            keep.update(getattr(meta, 'sparse_requires', {}).get(name, ()))
+        for name in list(fields):
+            if name not in keep:
+                del fields[name]
+                continue
+            nested = fields[name]
+            nested = getattr(nested, 'child', nested)
+            if only.get(name) is not None and isinstance(nested, SparseFieldsMixin):
+                nested.sparse_options = (only[name], frozenset())
+        return fields
+
+    def nested_sparse_options(self, name):
+        # Поле выбрано целиком (или выбора нет) - вложенный сериализатор отдаёт все поля
+        only, _ = self.get_sparse_options()
+        return (only.get(name) if only is not None else None), frozenset()
+
+    def get_sparse_options(self):
+        # Вложенному сериализатору выбор передаёт родитель, корневой читает запрос
+        if hasattr(self, 'sparse_options'):
+            return self.sparse_options
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None, frozenset()
+        return sparse_params(self.context.get('request'))
+
+
+class RenditionsField(serializers.Field):
+    # Размеры, blurhash и карта уменьшенных копий для srcset; пока копии не готовы - пустая
+    def __init__(self, file_field, renditions_field, **kwargs):
+        self.file_field = file_field
+        self.renditions_field = renditions_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        renditions = getattr(obj, self.renditions_field) or {}
+        storage = obj._meta.get_field(self.file_field).storage
+        return {
+            'width': renditions.get('width'),
+            'height': renditions.get('height'),
+            'blurhash': renditions.get('blurhash'),
+            'srcset': renditions_srcset(storage, renditions, self.context.get('request')),
+        }
+
+
 # ========== АУТЕНТИФИКАЦИЯ ==========
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -42,7 +167,7 @@ class LoginSerializer(serializers.Serializer):
         if user is None:
             raise serializers.ValidationError("Неверные учетные данные")
 
-        refresh = RefreshToken.for_user(user)
+        refresh = SessionRefreshToken.for_user(user)
 
         return {
             'user': user,
@@ -53,35 +178,38 @@ class LoginSerializer(serializers.Serializer):
 
 
 # ========== ПОЛЬЗОВАТЕЛИ ==========
-class UserProfileListSerializer(serializers.ModelSerializer):
+class UserProfileListSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    user_image_renditions = RenditionsField('user_image', 'user_image_renditions')
+
     class Meta:
         model = UserProfile
-        fields = ['id', 'username', 'user_image', 'is_official', 'bio']
+        fields = ['id', 'username', 'user_image', 'user_image_renditions', 'is_official', 'bio']
 
 
-class UserProfileDetailSerializer(serializers.ModelSerializer):
-    followers_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
-    posts_count = serializers.SerializerMethodField()
+class UserProfileDetailSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    user_image_renditions = RenditionsField('user_image', 'user_image_renditions')
 
     class Meta:
         model = UserProfile
-        fields = ['id', 'username', 'bio', 'user_image', 'is_official',
+        fields = ['id', 'username', 'bio', 'user_image', 'user_image_renditions', 'is_official',
                   'user_link', 'date_registered', 'followers_count',
                   'following_count', 'posts_count']
+        read_only_fields = ['followers_count', 'following_count', 'posts_count']
+
 
-    def get_followers_count(self, obj):
-        return obj.followers.count()
+class UserProfileListViewerSerializer(UserProfileListSerializer):
+    # is_following приходит из контекста (viewer.py), одним запросом на страницу
+    is_following = serializers.SerializerMethodField()
 
-    def get_following_count(self, obj):
-        return obj.followings.count()
+    class Meta(UserProfileListSerializer.Meta):
+        fields = UserProfileListSerializer.Meta.fields + ['is_following']
 
-    def get_posts_count(self, obj):
-        return Post.objects.filter(user=obj).count()
+    def get_is_following(self, obj):
+        return viewer_flag(self.context, 'following_ids', obj.id)
 
 
 # ========== ПОДПИСКИ ==========
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     follower_username = serializers.CharField(source='follower.username', read_only=True)
     following_username = serializers.CharField(source='following.username', read_only=True)
 
@@ -90,104 +218,172 @@ class FollowSerializer(serializers.ModelSerializer):
         fields = ['id', 'follower', 'following', 'follower_username',
                   'following_username', 'create_date']
         read_only_fields = ['create_date']
+        expandable_fields = {'follower': UserProfileListSerializer, 'following': UserProfileListSerializer}
 
 
 # ========== КОНТЕНТ ПОСТОВ ==========
-class PostContentSerializer(serializers.ModelSerializer):
+class PostContentSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    renditions = RenditionsField('content', 'renditions')
+
     class Meta:
         model = PostContent
-        fields = ['id', 'post', 'content']
+        fields = ['id', 'post', 'content', 'renditions']
+
+
+class UploadSessionSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    # offset - сколько байт уже на диске, с этого места продолжается загрузка
+    offset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'post', 'filename', 'size', 'checksum', 'offset',
+                  'status', 'content', 'created_date']
+        read_only_fields = ['status', 'content', 'created_date']
+
+    def get_offset(self, obj):
+        return uploaded_size(obj)
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Размер файла должен быть больше нуля')
+        if value > get_max_size():
+            raise serializers.ValidationError('Файл слишком большой')
+        return value
+
+    def validate_checksum(self, value):
+        value = value.lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError('Ожидается sha256 в шестнадцатеричном виде')
+        return value
 
 
 # ========== КОММЕНТАРИИ ==========
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
     user_image = serializers.ImageField(source='user.user_image', read_only=True)
     subcomments = serializers.SerializerMethodField()
+    is_liked = serializers.SerializerMethodField()
+    is_following = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
         fields = ['id', 'post', 'user', 'user_username', 'user_image',
-                  'text', 'parent', 'created_date', 'subcomments']
-        read_only_fields = ['created_date']
+                  'text', 'parent', 'created_date', 'likes_count', 'subcomments',
+                  'is_liked', 'is_following']
+        read_only_fields = ['created_date', 'likes_count']
+        expandable_fields = {'user': UserProfileListSerializer}
+        # is_liked / is_following кэшируемого поста досчитываются по id и автору комментария
+        sparse_requires = {'is_liked': ['id'], 'is_following': ['user']}
 
     def get_subcomments(self, obj):
-        # Рекурсивно получаем подкомментарии
-        if obj.subcomments.exists():
-            return CommentSerializer(obj.subcomments.all(), many=True).data
-        return []
+        # Дерево ответов собирается заранее (comment_tree), здесь только сериализация
+        if not hasattr(obj, 'tree_subcomments'):
+            attach_comment_tree([obj], **self.context.get('comment_tree', {}))
+        return CommentSerializer(obj.tree_subcomments, many=True, context=self.context,
+                                 sparse_options=self.nested_sparse_options('subcomments')).data
+
+    def get_is_liked(self, obj):
+        return viewer_flag(self.context, 'liked_comment_ids', obj.id)
+
+    def get_is_following(self, obj):
+        return viewer_flag(self.context, 'following_ids', obj.user_id)
 
 
 # ========== ПОСТЫ ==========
-class PostListSerializer(serializers.ModelSerializer):
+class PostListSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    # Автор и первый контент приходят из Post.objects.with_list_data()
     user = UserProfileListSerializer(read_only=True)
-    likes_count = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
     first_content = serializers.SerializerMethodField()
+    is_liked = serializers.SerializerMethodField()
+    is_following = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = ['id', 'user', 'description', 'hashtag', 'created_date',
-                  'likes_count', 'comments_count', 'first_content']
-
-    def get_likes_count(self, obj):
-        return PostLike.objects.filter(post=obj, like=True).count()
-
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+                  'likes_count', 'comments_count', 'first_content',
+                  'is_liked', 'is_following']
+        read_only_fields = ['likes_count', 'comments_count']
 
     def get_first_content(self, obj):
-        # Получаем первый контент поста (картинку/видео)
-        first = PostContent.objects.filter(post=obj).first()
-        if first:
-            return PostContentSerializer(first).data
+        # Первый контент поста (картинка/видео), заранее выбранный prefetch'ем
+        if obj.first_contents:
+            return PostContentSerializer(obj.first_contents[0]).data
         return None
 
+    def get_is_liked(self, obj):
+        return viewer_flag(self.context, 'liked_post_ids', obj.id)
+
+    def get_is_following(self, obj):
+        return viewer_flag(self.context, 'following_ids', obj.user_id)
+
 
-class PostDetailSerializer(serializers.ModelSerializer):
+class PostDetailSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user = UserProfileListSerializer(read_only=True)
     contents = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
-    likes_count = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = ['id', 'user', 'description', 'hashtag', 'created_date',
                   'contents', 'comments', 'likes_count', 'is_liked']
+        read_only_fields = ['likes_count']
 
     def get_contents(self, obj):
-        contents = PostContent.objects.filter(post=obj)
+        # loaded_contents/loaded_comments заранее загружает асинхронное представление
+        contents = getattr(obj, 'loaded_contents', None)
+        if contents is None:
+            contents = PostContent.objects.filter(post=obj)
         return PostContentSerializer(contents, many=True).data
 
     def get_comments(self, obj):
-        # Возвращаем только главные комментарии (без родителя)
-        comments = obj.comments.filter(parent__isnull=True).order_by('-created_date')
-        return CommentSerializer(comments, many=True).data
-
-    def get_likes_count(self, obj):
-        return PostLike.objects.filter(post=obj, like=True).count()
+        # Возвращаем только главные комментарии (без родителя), всё дерево одним запросом
+        comments = getattr(obj, 'loaded_comments', None)
+        if comments is None:
+            comments = load_post_comments(obj, **self.context.get('comment_tree', {}))
+        return CommentSerializer(comments, many=True, context=self.context,
+                                 sparse_options=self.nested_sparse_options('comments')).data
 
     def get_is_liked(self, obj):
-        # Проверяем, лайкнул ли текущий пользователь этот пост
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostLike.objects.filter(post=obj, user=request.user, like=True).exists()
-        return False
+        # Лайкнул ли текущий пользователь пост; в кэшируемом ответе досчитывается представлением
+        return viewer_flag(self.context, 'liked_post_ids', obj.id)
+
+
+# ========== ХЕШТЕГИ ==========
+class TrendingHashtagSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.Serializer):
+    name = serializers.CharField(source='hashtag__name')
+    posts_count = serializers.IntegerField()
 
 
 # ========== ЛАЙКИ ==========
-class PostLikeSerializer(serializers.ModelSerializer):
+class PostLikeSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
 
     class Meta:
         model = PostLike
         fields = ['id', 'post', 'user', 'user_username', 'like']
+        expandable_fields = {'user': UserProfileListSerializer}
 
 
-class CommentLikeSerializer(serializers.ModelSerializer):
+class CommentLikeSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
 
     class Meta:
         model = CommentLike
-        fields = ['id', 'comment', 'user', 'user_username', 'like']
\ No newline at end of file
+        fields = ['id', 'comment', 'user', 'user_username', 'like']
+        expandable_fields = {'user': UserProfileListSerializer}
+
+
+# ========== УВЕДОМЛЕНИЯ ==========
+class NotificationSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    # actor - последний участник, others_count - «и ещё N»
+    actor = UserProfileListSerializer(source='last_actor', read_only=True)
+    others_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'actor', 'actors_count', 'others_count', 'post', 'comment',
+                  'is_read', 'updated_date']
+
+    def get_others_count(self, obj):
+        return max(obj.actors_count - 1, 0)
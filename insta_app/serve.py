@@ -0,0 +1,151 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_http_methods
+from .storage import BLOBS_DIR
+
+
+# Раздача MEDIA_ROOT: Range/206, сильный ETag, Last-Modified, вечный кэш для блобов
+# и режимы выгрузки на веб-сервер (X-Accel-Redirect для nginx, X-Sendfile для Apache)
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    # Кусок файла для FileResponse. fileno() оставляем, чтобы wsgi.file_wrapper
+    # (например, gunicorn) отдал кусок через sendfile с текущей позиции
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    @property
+    def name(self):
+        return self.file.name
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    # Поддерживаем один диапазон; несколько диапазонов или мусор - отдаём файл целиком
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        suffix = int(end)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def is_immutable(path):
+    return path.startswith(f'{BLOBS_DIR}/')
+
+
+def media_etag(path, file_stat):
+    # Имя блоба - sha256 содержимого; для остальных файлов - размер и время изменения
+    if is_immutable(path):
+        return quote_etag(os.path.splitext(os.path.basename(path))[0])
+    return quote_etag(f'{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}')
+
+
+def _set_cache_headers(response, path, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if is_immutable(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE
+    else:
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+    return response
+
+
+def _offload_response(path, full_path, content_type):
+    mode = getattr(settings, 'MEDIA_SERVE_MODE', 'sendfile')
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + quote(path)
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+    return None
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    try:
+        file_stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Файл не найден')
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404('Файл не найден')
+
+    etag = media_etag(path, file_stat)
+    last_modified = int(file_stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return _set_cache_headers(response, path, etag, last_modified)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    # Диапазоны при выгрузке обрабатывает сам веб-сервер
+    response = _offload_response(path, full_path, content_type)
+    if response is not None:
+        return _set_cache_headers(response, path, etag, last_modified)
+
+    size = file_stat.st_size
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (if_range is None or if_range in (etag, http_date(last_modified))):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _set_cache_headers(response, path, etag, last_modified)
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return _set_cache_headers(response, path, etag, last_modified)
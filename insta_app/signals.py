@@ -0,0 +1,352 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import UserProfile, Post, PostContent, Follow, PostLike, Comment, CommentLike
+from .feed import remove_from_timeline
+from .counters import change_counter
+from .hashtags import sync_post_hashtags
+from .search import POST_INDEX, USER_INDEX, update_index, remove_from_index
+from .response_cache import invalidate
+from . import media
+from .bulk import in_bulk_write
+from .storage import is_content_addressed, retain, release
+from .metrics import install_query_recorder
+from .tasks import enqueue, backfill_dedupe_key
+from .authentication import user_cache
+from .follow_graph import on_follow, on_unfollow
+from .notifications import notify, post_like_events, comment_like_events, follow_events, comment_events
+
+
+# ========== ЛЕНТА ==========
+# Раскладка по лентам - задачи очереди (tasks.py); отписка убирает посты сразу
+@receiver(post_save, sender=Post)
+def post_fan_out(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue('feed.fan_out', dedupe_key=f'fan_out:{instance.pk}', post_id=instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def follow_backfill(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue('feed.backfill', dedupe_key=backfill_dedupe_key(instance.follower_id, instance.following_id),
+                follower_id=instance.follower_id, following_id=instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_cleanup(sender, instance, **kwargs):
+    if not in_bulk_write():
+        remove_from_timeline(instance)
+
+
+# ========== СЧЁТЧИКИ ==========
+@receiver(post_save, sender=Follow)
+def follow_counters_add(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(UserProfile, instance.follower_id, 'followers_count', 1)
+        change_counter(UserProfile, instance.following_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_counters_remove(sender, instance, **kwargs):
+    if in_bulk_write():
+        return
+    change_counter(UserProfile, instance.follower_id, 'followers_count', -1)
+    change_counter(UserProfile, instance.following_id, 'following_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def post_counters_add(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(UserProfile, instance.user_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_counters_remove(sender, instance, **kwargs):
+    change_counter(UserProfile, instance.user_id, 'posts_count', -1)
+
+
+@receiver(pre_save, sender=PostLike)
+def post_like_remember_state(sender, instance, raw=False, **kwargs):
+    # Запоминаем прежнее состояние лайка, чтобы учесть переключение like
+    instance._previous_like = None
+    if instance.pk is not None and not raw:
+        instance._previous_like = (PostLike.objects.filter(pk=instance.pk)
+                                   .values_list('post_id', 'like').first())
+
+
+@receiver(post_save, sender=PostLike)
+def post_like_counters(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_like', None)
+    if previous is not None and previous[1]:
+        change_counter(Post, previous[0], 'likes_count', -1)
+    if instance.like:
+        change_counter(Post, instance.post_id, 'likes_count', 1)
+
+
+@receiver(post_delete, sender=PostLike)
+def post_like_counters_remove(sender, instance, **kwargs):
+    if instance.like and not in_bulk_write():
+        change_counter(Post, instance.post_id, 'likes_count', -1)
+
+
+@receiver(pre_save, sender=CommentLike)
+def comment_like_remember_state(sender, instance, raw=False, **kwargs):
+    instance._previous_like = None
+    if instance.pk is not None and not raw:
+        instance._previous_like = (CommentLike.objects.filter(pk=instance.pk)
+                                   .values_list('comment_id', 'like').first())
+
+
+@receiver(post_save, sender=CommentLike)
+def comment_like_counters(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_like', None)
+    if previous is not None and previous[1]:
+        change_counter(Comment, previous[0], 'likes_count', -1)
+    if instance.like:
+        change_counter(Comment, instance.comment_id, 'likes_count', 1)
+
+
+@receiver(post_delete, sender=CommentLike)
+def comment_like_counters_remove(sender, instance, **kwargs):
+    if instance.like and not in_bulk_write():
+        change_counter(Comment, instance.comment_id, 'likes_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_counters_add(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Post, instance.post_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_counters_remove(sender, instance, **kwargs):
+    change_counter(Post, instance.post_id, 'comments_count', -1)
+
+
+# ========== ХЕШТЕГИ ==========
+@receiver(post_save, sender=Post)
+def post_hashtags(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_post_hashtags(instance)
+
+
+# ========== ПОИСК ==========
+def _indexed_fields_changed(update_fields, index):
+    return update_fields is None or bool(set(update_fields) & set(index.columns))
+
+
+@receiver(pre_save, sender=UserProfile)
+def user_remember_username(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_username = None
+    if instance.pk is not None and not raw and _indexed_fields_changed(update_fields, USER_INDEX):
+        instance._previous_username = (UserProfile.objects.filter(pk=instance.pk)
+                                       .values_list('username', flat=True).first())
+
+
+@receiver(post_save, sender=UserProfile)
+def user_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _indexed_fields_changed(update_fields, USER_INDEX):
+        return
+    update_index(USER_INDEX, [instance])
+    previous = getattr(instance, '_previous_username', None)
+    if previous is not None and previous != instance.username:
+        update_index(POST_INDEX, list(Post.objects.filter(user=instance).select_related('user')))
+
+
+@receiver(post_delete, sender=UserProfile)
+def user_search_remove(sender, instance, **kwargs):
+    remove_from_index(USER_INDEX, [instance.pk])
+
+
+@receiver(post_save, sender=Post)
+def post_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_index(POST_INDEX, [instance])
+
+
+@receiver(post_delete, sender=Post)
+def post_search_remove(sender, instance, **kwargs):
+    remove_from_index(POST_INDEX, [instance.pk])
+
+
+# ========== МЕДИА ==========
+# Уменьшенные копии строят воркеры очереди
+@receiver(post_save, sender=PostContent)
+def post_content_renditions(sender, instance, raw=False, **kwargs):
+    if not raw and media.needs_renditions(instance.content, instance.renditions):
+        enqueue('media.post_content', dedupe_key=f'media:post_content:{instance.pk}', pk=instance.pk)
+
+
+@receiver(post_delete, sender=PostContent)
+def post_content_renditions_remove(sender, instance, **kwargs):
+    media.delete_renditions(instance.content.storage, instance.renditions)
+
+
+@receiver(post_save, sender=UserProfile)
+def user_image_renditions(sender, instance, raw=False, **kwargs):
+    if not raw and media.needs_renditions(instance.user_image, instance.user_image_renditions):
+        enqueue('media.user_image', dedupe_key=f'media:user_image:{instance.pk}', pk=instance.pk)
+
+
+@receiver(post_delete, sender=UserProfile)
+def user_image_renditions_remove(sender, instance, **kwargs):
+    media.delete_renditions(instance.user_image.storage, instance.user_image_renditions)
+
+
+# ========== ХРАНИЛИЩЕ ==========
+# Счётчики ссылок на файлы в хранилище блобов: +1 новому файлу, -1 заменённому или удалённому
+FILE_FIELDS = {PostContent: 'content', UserProfile: 'user_image'}
+
+
+def _file_field_saved(sender, update_fields):
+    return update_fields is None or FILE_FIELDS[sender] in update_fields
+
+
+@receiver(pre_save, sender=PostContent)
+@receiver(pre_save, sender=UserProfile)
+def file_remember_previous(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_file = None
+    if instance.pk is not None and not raw and _file_field_saved(sender, update_fields):
+        instance._previous_file = (sender.objects.filter(pk=instance.pk)
+                                   .values_list(FILE_FIELDS[sender], flat=True).first())
+
+
+@receiver(post_save, sender=PostContent)
+@receiver(post_save, sender=UserProfile)
+def file_references(sender, instance, raw=False, update_fields=None, **kwargs):
+    field = FILE_FIELDS[sender]
+    storage = instance._meta.get_field(field).storage
+    if raw or not _file_field_saved(sender, update_fields) or not is_content_addressed(storage):
+        return
+    current = getattr(instance, field).name or None
+    previous = getattr(instance, '_previous_file', None) or None
+    if current != previous:
+        retain(storage, current)
+        release(storage, previous)
+
+
+@receiver(post_delete, sender=PostContent)
+@receiver(post_delete, sender=UserProfile)
+def file_release(sender, instance, **kwargs):
+    field = FILE_FIELDS[sender]
+    release(instance._meta.get_field(field).storage, getattr(instance, field).name)
+
+
+# ========== КЭШ ОТВЕТОВ ==========
+# 'user' - профиль со счётчиками, 'author' - поля автора внутри постов, 'post' - пост целиком
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_cache_invalidate(sender, instance, **kwargs):
+    invalidate('user', instance.pk)
+    invalidate('author', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_cache_invalidate(sender, instance, **kwargs):
+    invalidate('post', instance.pk)
+    invalidate('user', instance.user_id)
+
+
+@receiver(post_save, sender=PostContent)
+@receiver(post_delete, sender=PostContent)
+@receiver(post_save, sender=PostLike)
+@receiver(post_delete, sender=PostLike)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def post_related_cache_invalidate(sender, instance, **kwargs):
+    if not in_bulk_write():
+        invalidate('post', instance.post_id)
+
+
+@receiver(post_save, sender=CommentLike)
+@receiver(post_delete, sender=CommentLike)
+def comment_like_cache_invalidate(sender, instance, **kwargs):
+    # Счётчик лайков комментария входит в кэшированный пост
+    if not in_bulk_write():
+        invalidate('post', Comment.objects.filter(pk=instance.comment_id)
+                   .values_list('post_id', flat=True).first())
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_cache_invalidate(sender, instance, **kwargs):
+    if in_bulk_write():
+        return
+    invalidate('user', instance.follower_id)
+    invalidate('user', instance.following_id)
+
+
+# ========== УВЕДОМЛЕНИЯ ==========
+# Запись через модели; likes.py и BulkWriter сигналы обходят и уведомляют сами
+def _like_turned_on(instance):
+    previous = getattr(instance, '_previous_like', None)
+    return instance.like and not (previous is not None and previous[1])
+
+
+@receiver(post_save, sender=PostLike)
+def post_like_notify(sender, instance, raw=False, **kwargs):
+    if not raw and _like_turned_on(instance):
+        notify(post_like_events([(instance.post_id, instance.user_id)]))
+
+
+@receiver(post_save, sender=CommentLike)
+def comment_like_notify(sender, instance, raw=False, **kwargs):
+    if not raw and _like_turned_on(instance):
+        notify(comment_like_events([(instance.comment_id, instance.user_id)]))
+
+
+@receiver(post_save, sender=Comment)
+def comment_notify(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notify(comment_events(instance))
+
+
+@receiver(post_save, sender=Follow)
+def follow_notify(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notify(follow_events([(instance.follower_id, instance.following_id)]))
+
+
+# ========== ГРАФ ПОДПИСОК ==========
+# Удаление приходит и из BulkWriter (сигналы удаления там срабатывают), создание - нет
+@receiver(post_save, sender=Follow)
+def follow_graph_add(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        on_follow(instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_graph_remove(sender, instance, **kwargs):
+    on_unfollow(instance.follower_id, instance.following_id)
+
+
+# ========== МЕТРИКИ ==========
+# Счётчик SQL для RequestMetricsMiddleware ставится на каждое новое соединение,
+# в том числе в потоках async-представлений
+@receiver(connection_created)
+def connection_query_recorder(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+# ========== SQLITE ==========
+# synchronous=NORMAL безопасен только в WAL; режим журнала читается без записи в файл
+@receiver(connection_created)
+def sqlite_synchronous(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        wal = cursor.fetchone()[0] == 'wal'
+        cursor.execute(f"PRAGMA synchronous={'NORMAL' if wal else 'FULL'}")
+
+
+# ========== АУТЕНТИФИКАЦИЯ ==========
+# Изменённый профиль (is_active, пароль) не живёт в кэше JWT этого процесса до конца TTL
+@receiver(post_save, sender=UserProfile)
+def user_auth_cache_evict(sender, instance, **kwargs):
+    user_cache.discard(instance.pk)
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from functools import partial
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+# Хранилище по хэшу содержимого: одинаковые файлы лежат на диске один раз,
+# число ссылок на них ведёт таблица Blob (models.py)
+BLOBS_DIR = 'blobs'
+
+
+def content_storage():
+    return storages['content']
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется хэшем в _save, пересечений имён не бывает
+        return name
+
+    def blob_name(self, digest, extension):
+        return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+    def _stage(self, content):
+        # Уже лежащий на диске файл (загрузка частями, TemporaryUploadedFile) переносится
+        # без копирования; остальное пишем во временный файл, считая sha256 за один проход
+        if hasattr(content, 'temporary_file_path'):
+            path = content.temporary_file_path()
+            digest = getattr(content, 'sha256', None)
+            if digest is None:
+                with open(path, 'rb') as source:
+                    digest = hashlib.file_digest(source, 'sha256').hexdigest()
+            return path, digest, os.path.getsize(path)
+
+        tmp_dir = self.path(f'{BLOBS_DIR}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        tmp_path, digest, size = self._stage(content)
+        try:
+            blob = Blob.objects.filter(digest=digest).first()
+            if blob is not None and self.exists(blob.name):
+                return blob.name
+
+            final_name = blob.name if blob is not None else self.blob_name(digest, os.path.splitext(name)[1])
+            final_path = self.path(final_name)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            file_move_safe(tmp_path, final_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(final_path, self.file_permissions_mode)
+            tmp_path = None
+
+            blob, created = Blob.objects.get_or_create(digest=digest, defaults={'name': final_name, 'size': size})
+            if blob.name != final_name:
+                # Параллельная загрузка того же содержимого с другим расширением успела раньше
+                os.remove(final_path)
+            return blob.name
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def retain(self, name):
+        from .models import Blob
+
+        if not Blob.objects.filter(name=name).update(refcount=F('refcount') + 1) and self.exists(name):
+            # Строку успели удалить вместе с последней ссылкой, а файл ещё на месте
+            Blob.objects.get_or_create(name=name, defaults={
+                'digest': os.path.splitext(os.path.basename(name))[0],
+                'size': self.size(name),
+                'refcount': 1,
+            })
+
+    def release(self, name):
+        from .models import Blob
+
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # Файл загружен до появления хранилища блобов, им никто не владеет
+                return
+            if blob.refcount > 1:
+                Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            blob.delete()
+            transaction.on_commit(partial(self._delete_orphan, name))
+
+    def _delete_orphan(self, name):
+        from .models import Blob
+
+        if not Blob.objects.filter(name=name).exists():
+            self.delete(name)
+
+
+def is_content_addressed(storage):
+    return isinstance(storage, ContentAddressedStorage)
+
+
+def retain(storage, name):
+    if name and is_content_addressed(storage):
+        storage.retain(name)
+
+
+def release(storage, name):
+    if name and is_content_addressed(storage):
+        storage.release(name)
+
+
+def prune_orphans(hours=24):
+    # Блобы без ссылок старше hours: загрузки, которые так и не попали в базу
+    from .models import Blob
+
+    storage = content_storage()
+    border = timezone.now() - timedelta(hours=hours)
+    removed = 0
+    for blob in Blob.objects.filter(refcount=0, created_date__lt=border).iterator():
+        storage.delete(blob.name)
+        blob.delete()
+        removed += 1
+    return removed
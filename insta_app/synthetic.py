@@ -0,0 +1,243 @@
+import random
+from collections import Counter
+from datetime import timedelta
+from itertools import accumulate, islice
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from .models import (UserProfile, Post, PostContent, PostLike, Comment, CommentLike, Follow,
+                     Hashtag, HashtagTrend, PostTag, TimelineEntry)
+from .counters import recount_users, recount_posts, recount_comments
+from .feed import FOLLOW_BACKFILL_LIMIT
+from .hashtags import current_bucket
+from .search import get_index, update_index
+
+
+# Синтетический социальный граф для нагрузочных тестов: популярность авторов и тегов
+# распределена по Ципфу, число подписок/постов/лайков на объект - тяжёлый хвост (Парето).
+# Всё пишется через bulk_create пачками, сигналы не срабатывают - производные данные
+# (счётчики, ленты, поиск, тренды) досчитываются здесь же одним проходом. Даты постов
+# разбросаны по последним days дням, чтобы ленты, теги и тренды листались по диапазонам дат.
+WORDS = ('sun sea city night coffee friends travel food art music summer winter dog cat '
+         'street photo love weekend mountain book run sky fashion design nature morning').split()
+PARETO_SHAPE = 2.0
+
+
+class SyntheticGraph:
+    def __init__(self, users=1000, follows=30, posts=5, contents=2, likes=10, comments=3,
+                 comment_likes=1, hashtags=200, exponent=1.1, days=30, seed=0, prefix='synth',
+                 password='synthetic', batch_size=5000, log=None):
+        self.users = users
+        self.follows = follows
+        self.posts = posts
+        self.contents = contents
+        self.likes = likes
+        self.comments = comments
+        self.comment_likes = comment_likes
+        self.hashtags = hashtags
+        self.exponent = exponent
+        self.days = max(days, 1)
+        self.prefix = prefix
+        self.password = password
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.created = Counter()
+
+    # ---------- распределения ----------
+    def heavy_tail(self, mean, cap):
+        # Парето с формой 2 и средним mean: большинство объектов получают мало, единицы - очень много
+        if mean <= 0:
+            return 0
+        return min(int(mean / 2 * self.rng.paretovariate(PARETO_SHAPE)), cap)
+
+    def zipf_weights(self, size):
+        # Накопленные веса для rng.choices: k-й по популярности выбирается с весом 1/k^s
+        return list(accumulate(1 / rank ** self.exponent for rank in range(1, size + 1)))
+
+    def pick_distinct(self, population, cum_weights, count, exclude=None):
+        count = min(count, len(population) - (exclude is not None))
+        picked = set()
+        while len(picked) < count:
+            for value in self.rng.choices(population, cum_weights=cum_weights, k=count - len(picked)):
+                if value != exclude:
+                    picked.add(value)
+        return picked
+
+    # ---------- запись ----------
+    def bulk(self, model, objects, **kwargs):
+        objects = iter(objects)
+        created = []
+        while batch := list(islice(objects, self.batch_size)):
+            created.extend(model.objects.bulk_create(batch, **kwargs))
+            self.created[model.__name__] += len(batch)
+        return created
+
+    def generate(self):
+        self.seed_users()
+        self.seed_follows()
+        self.seed_hashtags()
+        self.seed_posts()
+        self.seed_timelines()
+        self.seed_trends()
+        self.recount()
+        return self.created
+
+    def seed_users(self):
+        password = make_password(self.password)
+        start = UserProfile.objects.filter(username__startswith=f'{self.prefix}_').count()
+        users = (UserProfile(username=f'{self.prefix}_{start + i}', password=password,
+                             bio=' '.join(self.rng.sample(WORDS, 4)),
+                             is_official=self.rng.random() < 0.001)
+                 for i in range(self.users))
+        with transaction.atomic():
+            self.user_objects = self.bulk(UserProfile, users)
+            update_index(get_index(UserProfile), self.user_objects)
+        self.user_ids = [user.pk for user in self.user_objects]
+        self.users_by_id = {user.pk: user for user in self.user_objects}
+        # Популярность не совпадает с порядком регистрации
+        self.by_popularity = self.user_ids[:]
+        self.rng.shuffle(self.by_popularity)
+        self.popularity_weights = self.zipf_weights(len(self.by_popularity))
+        self.log(f'Пользователи: {len(self.user_ids)}')
+
+    def seed_follows(self):
+        # follower подписан на following; цели выбираются по популярности -
+        # у входящей степени получается степенной хвост
+        self.followers_of = {user_id: [] for user_id in self.user_ids}
+
+        def follows():
+            for follower_id in self.user_ids:
+                count = self.heavy_tail(self.follows, len(self.user_ids) - 1)
+                for following_id in self.pick_distinct(self.by_popularity, self.popularity_weights,
+                                                       count, exclude=follower_id):
+                    self.followers_of[following_id].append(follower_id)
+                    yield Follow(follower_id=follower_id, following_id=following_id)
+
+        with transaction.atomic():
+            self.bulk(Follow, follows())
+        self.log(f"Подписки: {self.created['Follow']}")
+
+    def seed_hashtags(self):
+        tags = [Hashtag(name=f'{word}{i}' if i else word)
+                for i in range(self.hashtags // len(WORDS) + 1) for word in WORDS][:self.hashtags]
+        with transaction.atomic():
+            self.bulk(Hashtag, tags, ignore_conflicts=True)
+        self.tags = list(Hashtag.objects.filter(name__in=[tag.name for tag in tags]))
+        self.rng.shuffle(self.tags)
+        self.tag_weights = self.zipf_weights(len(self.tags))
+        self.tag_usage = Counter()
+
+    def seed_posts(self):
+        # Посты идут пачками: у каждой пачки сразу появляются медиа, теги, лайки и комментарии
+        self.posts_of = {user_id: [] for user_id in self.user_ids}
+        self.post_dates = {}
+        self.comment_ids = []
+        authors = (user_id for user_id in self.user_ids
+                   for _ in range(self.heavy_tail(self.posts, 1000)))
+        while batch := list(islice(authors, self.batch_size)):
+            with transaction.atomic():
+                posts = self.bulk(Post, (self.make_post(author_id) for author_id in batch))
+                self.spread_dates(posts)
+                update_index(get_index(Post), posts)
+                for post in posts:
+                    self.posts_of[post.user_id].append(post.pk)
+                    self.post_dates[post.pk] = post.created_date
+                self.seed_post_children(posts)
+            self.log(f"Посты: {self.created['Post']}")
+
+    def make_post(self, author_id):
+        tags = self.pick_distinct(self.tags, self.tag_weights, self.rng.randint(0, 3)) if self.tags else set()
+        words = self.rng.choices(WORDS, k=self.rng.randint(3, 12))
+        post = Post(user=self.users_by_id[author_id],
+                    description=' '.join(words + [f'#{tag.name}' for tag in tags]),
+                    hashtag=next(iter(tags)).name if tags else None)
+        post.synthetic_tags = tags
+        return post
+
+    def spread_dates(self, posts):
+        # auto_now_add ставит всем сегодняшнюю дату - переписываем одним bulk_update на пачку.
+        # Час публикации задаёт и корзину тренда
+        now = current_bucket()
+        for post in posts:
+            published = now - timedelta(hours=self.rng.randrange(self.days * 24))
+            post.created_date = timezone.localdate(published)
+            self.tag_usage.update((tag, published) for tag in post.synthetic_tags)
+        Post.objects.bulk_update(posts, ['created_date'], batch_size=self.batch_size)
+
+    def seed_post_children(self, posts):
+        self.bulk(PostTag, (PostTag(post_id=post.pk, hashtag_id=tag.pk, created_date=post.created_date)
+                            for post in posts for tag in post.synthetic_tags), ignore_conflicts=True)
+        self.bulk(PostContent, (PostContent(post=post, content=f'synthetic/{post.pk}_{i}.jpg')
+                                for post in posts
+                                for i in range(1 + self.heavy_tail(self.contents - 1, 9))))
+        # Лайки и комментарии получают чаще посты популярных авторов
+        self.bulk(PostLike, (PostLike(post=post, user_id=user_id, like=self.rng.random() < 0.95)
+                             for post in posts
+                             for user_id in self.rng.sample(self.user_ids, self.heavy_tail(
+                                 self.likes * self.author_boost(post.user_id), len(self.user_ids)))))
+        self.seed_comments(posts)
+
+    def author_boost(self, user_id):
+        return min(len(self.followers_of[user_id]) / max(self.follows, 1), 20) + 0.1
+
+    def seed_comments(self, posts):
+        # Ветки строятся уровнями: ответы второго уровня ссылаются на уже созданные комментарии
+        level = self.bulk(Comment, (Comment(post=post, user_id=self.rng.choice(self.user_ids),
+                                            text=' '.join(self.rng.choices(WORDS, k=5)))
+                                    for post in posts
+                                    for _ in range(self.heavy_tail(self.comments * self.author_boost(post.user_id),
+                                                                   500))))
+        comments = list(level)
+        for _ in range(3):
+            level = self.bulk(Comment, (Comment(post_id=parent.post_id, parent=parent,
+                                                user_id=self.rng.choice(self.user_ids),
+                                                text=' '.join(self.rng.choices(WORDS, k=5)))
+                                        for parent in level if self.rng.random() < 0.3))
+            comments.extend(level)
+        self.comment_ids.extend(comment.pk for comment in comments)
+        self.bulk(CommentLike, (CommentLike(comment=comment, user_id=user_id, like=True)
+                                for comment in comments
+                                for user_id in self.rng.sample(self.user_ids, self.heavy_tail(
+                                    self.comment_likes, len(self.user_ids)))))
+
+    def seed_timelines(self):
+        # То же, что fan_out_post + backfill_timeline: свои посты и последние посты подписок
+        def entries():
+            for author_id, post_ids in self.posts_of.items():
+                recent = post_ids[-FOLLOW_BACKFILL_LIMIT:]
+                owners = [author_id]
+                if not self.users_by_id[author_id].is_official:
+                    owners += self.followers_of[author_id]
+                for owner_id in owners:
+                    for post_id in (post_ids if owner_id == author_id else recent):
+                        yield TimelineEntry(owner_id=owner_id, post_id=post_id,
+                                            created_date=self.post_dates[post_id])
+
+        with transaction.atomic():
+            self.bulk(TimelineEntry, entries(), ignore_conflicts=True)
+        self.log(f"Записи лент: {self.created['TimelineEntry']}")
+
+    def seed_trends(self):
+        # Почасовые корзины по датам постов; к уже существующим (повторный запуск) счёт добавляется
+        if not self.tag_usage:
+            return
+        with transaction.atomic():
+            existing = dict(((hashtag_id, bucket), count) for hashtag_id, bucket, count in
+                            HashtagTrend.objects.filter(bucket__gte=min(bucket for _, bucket in self.tag_usage))
+                            .values_list('hashtag_id', 'bucket', 'count'))
+            self.bulk(HashtagTrend, (HashtagTrend(hashtag=tag, bucket=bucket,
+                                                  count=existing.get((tag.pk, bucket), 0) + count)
+                                     for (tag, bucket), count in self.tag_usage.items()),
+                      update_conflicts=True, unique_fields=['hashtag', 'bucket'], update_fields=['count'])
+
+    def recount(self):
+        # Счётчики только для созданных строк, пачками по первичному ключу
+        post_ids = sorted(pk for ids in self.posts_of.values() for pk in ids)
+        for model, recount, pks in ((UserProfile, recount_users, self.user_ids),
+                                    (Post, recount_posts, post_ids),
+                                    (Comment, recount_comments, sorted(self.comment_ids))):
+            for start in range(0, len(pks), self.batch_size):
+                chunk = pks[start:start + self.batch_size]
+                recount(model.objects.filter(pk__in=chunk))
+        self.log('Счётчики пересчитаны')
@@ -0,0 +1,256 @@
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Post, Follow, Task
+from .feed import fan_out_post, backfill_timeline
+from .media import process_post_content, process_user_image
+from .hashtags import prune_trends
+from .storage import prune_orphans
+from .notifications import prune_notifications
+
+
+# Очередь задач в базе, без внешнего брокера: задача пишется в той же транзакции,
+# что и изменение модели, а выполняют её воркеры run_workers. Выборка пачки -
+# SELECT ... FOR UPDATE SKIP LOCKED, в SQLite - обычный SELECT в пишущей транзакции
+# (запись в SQLite одна на всю базу) и условный UPDATE по статусу.
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+TASKS = {}
+PERIODIC = {}
+
+
+class TaskSpec:
+    def __init__(self, func, name, priority, max_attempts):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+def task(name, priority=PRIORITY_NORMAL, max_attempts=5, every=None):
+    # every - период в секундах: run_workers сам ставит такую задачу раз в период
+    def register(func):
+        TASKS[name] = TaskSpec(func, name, priority, max_attempts)
+        if every is not None:
+            PERIODIC[name] = every
+        return func
+    return register
+
+
+def is_eager():
+    # TASKS_EAGER = True - задача выполняется сразу при постановке (тесты, разработка без воркеров);
+    # None - по DEBUG
+    eager = getattr(settings, 'TASKS_EAGER', None)
+    return settings.DEBUG if eager is None else eager
+
+
+def get_batch_size():
+    return getattr(settings, 'TASKS_BATCH_SIZE', 10)
+
+
+def get_lock_timeout():
+    return getattr(settings, 'TASKS_LOCK_TIMEOUT', 600)
+
+
+def backoff(attempts):
+    # 2, 4, 8 ... секунд (не больше TASKS_MAX_BACKOFF) и случайная добавка против одновременных повторов
+    base = getattr(settings, 'TASKS_RETRY_DELAY', 2)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'TASKS_MAX_BACKOFF', 3600))
+    return timedelta(seconds=delay * random.uniform(1, 1.25))
+
+
+def _make_task(name, kwargs, priority=None, dedupe_key=None, delay=0):
+    spec = TASKS[name]
+    return Task(name=name, kwargs=kwargs, priority=spec.priority if priority is None else priority,
+                dedupe_key=dedupe_key, max_attempts=spec.max_attempts,
+                run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def enqueue(name, priority=None, dedupe_key=None, delay=0, **kwargs):
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача {name}')
+    if is_eager():
+        TASKS[name].func(**kwargs)
+        return
+    # С тем же ключом в очереди уже есть задача - новая не нужна
+    Task.objects.bulk_create([_make_task(name, kwargs, priority, dedupe_key, delay)], ignore_conflicts=True)
+
+
+def enqueue_many(name, kwargs_list, priority=None, dedupe_key=None):
+    # dedupe_key - функция от kwargs
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача {name}')
+    if is_eager():
+        for kwargs in kwargs_list:
+            TASKS[name].func(**kwargs)
+        return
+    Task.objects.bulk_create([_make_task(name, kwargs, priority, dedupe_key(kwargs) if dedupe_key else None)
+                              for kwargs in kwargs_list], ignore_conflicts=True)
+
+
+# ========== ВЫПОЛНЕНИЕ ==========
+def claim(worker_id, limit):
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = (Task.objects.filter(status=Task.STATUS_QUEUED, run_at__lte=now)
+                    .order_by('-priority', 'run_at', 'id'))
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ids = list(queryset.values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        # Условие по статусу: строку, которую успел забрать другой воркер, не трогаем
+        Task.objects.filter(id__in=ids, status=Task.STATUS_QUEUED).update(
+            status=Task.STATUS_RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+        return list(Task.objects.filter(id__in=ids, status=Task.STATUS_RUNNING, locked_by=worker_id)
+                    .order_by('-priority', 'run_at', 'id'))
+
+
+def execute(task_obj):
+    spec = TASKS.get(task_obj.name)
+    try:
+        if spec is None:
+            raise KeyError(f'Неизвестная задача {task_obj.name}')
+        spec.func(**task_obj.kwargs)
+    except Exception:
+        fail(task_obj, traceback.format_exc(), retry=spec is not None)
+        return False
+    Task.objects.filter(pk=task_obj.pk).delete()
+    return True
+
+
+def fail(task_obj, error, retry=True):
+    logger.warning('Задача %s (%s) завершилась ошибкой, попытка %s', task_obj.name, task_obj.pk, task_obj.attempts)
+    error = error[-10000:]
+    if retry and task_obj.attempts < task_obj.max_attempts:
+        _requeue(task_obj.pk, task_obj.dedupe_key, task_obj.attempts,
+                 run_at=timezone.now() + backoff(task_obj.attempts), last_error=error)
+    else:
+        Task.objects.filter(pk=task_obj.pk).update(status=Task.STATUS_FAILED, locked_by='', locked_at=None,
+                                                   last_error=error)
+
+
+def requeue_stale():
+    # Воркер упал посреди задачи: через TASKS_LOCK_TIMEOUT она снова в очереди
+    border = timezone.now() - timedelta(seconds=get_lock_timeout())
+    stale = list(Task.objects.filter(status=Task.STATUS_RUNNING, locked_at__lt=border)
+                 .values_list('pk', 'dedupe_key', 'attempts'))
+    for pk, dedupe_key, attempts in stale:
+        _requeue(pk, dedupe_key, attempts)
+    return len(stale)
+
+
+def _requeue(pk, dedupe_key, attempts, **changes):
+    # Пока задача выполнялась, с тем же ключом могли поставить новую (периодические задачи,
+    # повторное сохранение медиа). Тогда работу сделает уже ждущая задача: ей переходят
+    # попытки и ошибка, а эта строка удаляется
+    try:
+        with transaction.atomic():
+            Task.objects.filter(pk=pk).update(status=Task.STATUS_QUEUED, locked_by='', locked_at=None, **changes)
+            return
+    except IntegrityError:
+        pass
+    merged = {'attempts': Greatest('attempts', attempts)}
+    if 'last_error' in changes:
+        merged['last_error'] = changes['last_error']
+    with transaction.atomic():
+        Task.objects.filter(dedupe_key=dedupe_key, status=Task.STATUS_QUEUED).update(**merged)
+        Task.objects.filter(pk=pk).delete()
+
+
+def schedule_periodic():
+    for name, every in PERIODIC.items():
+        enqueue(name, dedupe_key=f'periodic:{name}', delay=every)
+
+
+def run_pending(worker_id=None, limit=None):
+    # Одна пачка: -> число выполненных задач (успешно или нет)
+    tasks = claim(worker_id or default_worker_id(), limit or get_batch_size())
+    for task_obj in tasks:
+        execute(task_obj)
+    return len(tasks)
+
+
+def drain(worker_id=None):
+    # Выполнить всё, что уже пора выполнять (тесты, run_workers --once)
+    total = 0
+    while done := run_pending(worker_id):
+        total += done
+    return total
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def work(worker_id, stop, poll_interval=1.0, batch_size=None):
+    # Цикл воркера: stop - threading.Event или multiprocessing.Event
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            done = run_pending(worker_id, batch_size)
+        except Exception:
+            logger.exception('Воркер %s: ошибка выборки задач', worker_id)
+            done = 0
+        if not done:
+            stop.wait(poll_interval)
+    close_old_connections()
+
+
+# ========== ЗАДАЧИ ==========
+@task('feed.fan_out', priority=PRIORITY_HIGH)
+def fan_out_task(post_id):
+    post = Post.objects.select_related('user').filter(pk=post_id).first()
+    if post is not None:
+        fan_out_post(post)
+
+
+def backfill_dedupe_key(follower_id, following_id):
+    return f'backfill:{follower_id}:{following_id}'
+
+
+@task('feed.backfill')
+def backfill_task(follower_id, following_id):
+    with transaction.atomic():
+        # Блокировка подписки: отписка дождётся конца и уберёт уже добавленное
+        follow = (Follow.objects.select_for_update().select_related('following')
+                  .filter(follower_id=follower_id, following_id=following_id).first())
+        if follow is not None:
+            backfill_timeline(follow)
+
+
+@task('media.post_content')
+def post_content_media_task(pk):
+    process_post_content(pk)
+
+
+@task('media.user_image')
+def user_image_media_task(pk):
+    process_user_image(pk)
+
+
+@task('maintenance.prune_trends', priority=PRIORITY_LOW, every=3600)
+def prune_trends_task():
+    prune_trends()
+
+
+@task('maintenance.prune_blobs', priority=PRIORITY_LOW, every=24 * 3600)
+def prune_blobs_task():
+    prune_orphans()
+
+
+@task('maintenance.prune_notifications', priority=PRIORITY_LOW, every=24 * 3600)
+def prune_notifications_task():
+    prune_notifications()
@@ -1,3 +1,1448 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F, Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .response_cache import get_cache
+from .db_router import ReadReplicaRouter, read_from_replica, read_from_primary
+from .benchmark import Benchmark, format_report, percentile
+from .renderers import FastJSONRenderer
+from .serializers import PostDetailSerializer
+from .views import walk_comment_data
+from .counters import recount_users, recount_posts, recount_comments
+from .bulk import CREATE, PostLikeBulkWriter
+from . import authentication, follow_graph, metrics, tasks
+from .models import (UserProfile, Post, PostContent, PostLike, Comment, CommentLike, Follow, Blob,
+                     PostTag, HashtagTrend, TimelineEntry, Task, Notification)
 
-# Create your tests here.
+
+class PostListQueriesTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [UserProfile.objects.create_user(f'user{i}', password='pass') for i in range(3)]
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(user=self.users[i % 3], description=f'post {i}')
+            PostContent.objects.create(post=post, content=f'posts/{i}.png')
+            PostContent.objects.create(post=post, content=f'posts/{i}_2.png')
+            PostLike.objects.create(post=post, user=self.users[0], like=True)
+            PostLike.objects.create(post=post, user=self.users[1], like=False)
+            Comment.objects.create(post=post, user=self.users[2], text='comment')
+
+    def count_list_queries(self, page_size):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post_list'), {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_posts(12)
+        small, _ = self.count_list_queries(2)
+        large, data = self.count_list_queries(12)
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(data), 12)
+        post = data[0]
+        self.assertEqual(post['likes_count'], 1)
+        self.assertEqual(post['comments_count'], 1)
+        first = PostContent.objects.filter(post_id=post['id']).order_by('id').first()
+        self.assertEqual(post['first_content']['id'], first.id)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = UserProfile.objects.create_user('author', password='pass')
+        # Все посты с одной датой: порядок держится на id
+        self.ids = [Post.objects.create(user=user, description=f'post {i}').id for i in range(7)]
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(item['id'] for item in data['results'])
+            url = data[key]
+        return ids, data
+
+    def test_walk_forward_and_back(self):
+        with translation.override('en'):
+            url = reverse('post_list') + '?page_size=3'
+        forward, last_page = self.walk(url, 'next')
+        self.assertEqual(forward, sorted(self.ids, reverse=True))
+
+        backward, _ = self.walk(last_page['previous'], 'previous')
+        self.assertEqual(sorted(backward), sorted(self.ids[1:]))
+
+    def test_ordering_param_and_invalid_cursor(self):
+        with translation.override('en'):
+            url = reverse('post_list')
+        ids, _ = self.walk(url + '?ordering=created_date&page_size=2', 'next')
+        self.assertEqual(ids, sorted(self.ids))
+        self.assertEqual(self.client.get(url, {'cursor': 'broken'}).status_code, 404)
+
+
+@override_settings(TASKS_EAGER=True)
+class FeedTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.reader = UserProfile.objects.create_user('reader', password='pass')
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        self.official = UserProfile.objects.create_user('official', password='pass', is_official=True)
+        stranger = UserProfile.objects.create_user('stranger', password='pass')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Follow.objects.create(follower=self.reader, following=self.official)
+        self.ids = []
+        for i in range(4):
+            for user in (self.author, self.official, stranger):
+                post = Post.objects.create(user=user, description=f'post {i}')
+                if user != stranger:
+                    self.ids.append(post.id)
+        # Посты прошлых дней: дата в ленте - копия даты поста
+        old = Post.objects.filter(pk__in=self.ids[:2])
+        old.update(created_date=timezone.now().date() - timedelta(days=1))
+        TimelineEntry.objects.filter(post__in=old).update(created_date=timezone.now().date() - timedelta(days=1))
+        self.client.force_login(self.reader)
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(item['id'] for item in data['results'])
+            url = data[key]
+        return ids, data
+
+    def test_timeline_and_official_posts_merged(self):
+        with translation.override('en'):
+            url = reverse('feed') + '?page_size=3'
+        expected = self.ids[2:][::-1] + self.ids[:2][::-1]
+        forward, last_page = self.walk(url, 'next')
+        self.assertEqual(forward, expected)
+
+        backward, _ = self.walk(last_page['previous'], 'previous')
+        self.assertEqual(sorted(backward), sorted(expected[:-2]))
+
+    def test_unfollow_removes_posts(self):
+        Follow.objects.filter(follower=self.reader, following=self.author).delete()
+        with translation.override('en'):
+            data = self.client.get(reverse('feed')).json()
+        authors = {item['user']['id'] for item in data['results']}
+        self.assertEqual(authors, {self.official.pk})
+
+    def test_official_posts_in_one_query(self):
+        # Посты официальных аккаунтов - один запрос на страницу, сколько бы их ни было
+        for i in range(3):
+            official = UserProfile.objects.create_user(f'official{i}', password='pass', is_official=True)
+            Follow.objects.create(follower=self.reader, following=official)
+            self.ids.append(Post.objects.create(user=official, description=f'official {i}').id)
+        with translation.override('en'):
+            url = reverse('feed') + '?page_size=4'
+        with CaptureQueriesContext(connection) as queries:
+            ids, _ = self.walk(url, 'next')
+        self.assertEqual(sorted(ids), sorted(self.ids))
+        pages = sum('insta_app_timelineentry' in query['sql'] for query in queries.captured_queries)
+        official = [query['sql'] for query in queries.captured_queries if 'UNION ALL' in query['sql']]
+        self.assertEqual(len(official), pages)
+
+    def test_timeline_read_from_index(self):
+        TimelineEntry.objects.filter(owner=self.reader).delete()
+        TimelineEntry.objects.bulk_create([TimelineEntry(owner=self.reader, post=post, created_date=post.created_date)
+                                           for post in Post.objects.filter(user=self.author)])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('feed'), {'page_size': 2})
+        timeline = next(query['sql'] for query in queries.captured_queries
+                        if 'insta_app_timelineentry' in query['sql'])
+        self.assertIn('LIMIT 3', timeline)
+        self.assertNotIn('insta_app_post', timeline)
+
+
+class CommentTreeTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserProfile.objects.create_user('author', password='pass')
+        self.post = Post.objects.create(user=self.user, description='post')
+
+    def create_thread(self, depth):
+        parent = None
+        for i in range(depth):
+            parent = Comment.objects.create(post=self.post, user=self.user, text=f'level {i}', parent=parent)
+
+    def get_detail(self, **params):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post_detail', args=[self.post.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['comments']
+
+    def test_query_count_does_not_depend_on_thread_depth(self):
+        self.create_thread(2)
+        shallow, _ = self.get_detail()
+        self.create_thread(8)
+        deep, comments = self.get_detail()
+
+        self.assertEqual(shallow, deep)
+        self.assertEqual(len(comments), 2)
+        node, depth = comments[0], 1
+        while node['subcomments']:
+            node, depth = node['subcomments'][0], depth + 1
+        self.assertEqual(depth, 8)
+
+    def test_max_depth_and_replies_limit(self):
+        root = Comment.objects.create(post=self.post, user=self.user, text='root')
+        for i in range(3):
+            reply = Comment.objects.create(post=self.post, user=self.user, text=f'reply {i}', parent=root)
+            Comment.objects.create(post=self.post, user=self.user, text='nested', parent=reply)
+
+        _, comments = self.get_detail(max_depth=1, replies_limit=2)
+        replies = comments[0]['subcomments']
+        self.assertEqual(len(replies), 2)
+        self.assertEqual(replies[0]['subcomments'], [])
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        self.reader = UserProfile.objects.create_user('reader', password='pass')
+        self.post = Post.objects.create(user=self.author, description='post')
+
+    def test_like_toggle_and_delete(self):
+        like = PostLike.objects.create(post=self.post, user=self.reader, like=False)
+        like.like = True
+        like.save()
+        like.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+        like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_comment_cascade_and_follow(self):
+        root = Comment.objects.create(post=self.post, user=self.reader, text='root')
+        Comment.objects.create(post=self.post, user=self.author, text='reply', parent=root)
+        Follow.objects.create(follower=self.reader, following=self.author)
+        self.post.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+        self.assertEqual((self.author.following_count, self.author.posts_count), (1, 1))
+
+        root.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_recount_repairs_drift(self):
+        PostLike.objects.create(post=self.post, user=self.reader, like=True)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=42)
+        UserProfile.objects.filter(pk=self.author.pk).update(posts_count=0)
+
+        call_command('recount_counters', batch_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.author.posts_count, 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class QueryPlanTest(TestCase):
+    # Каждый запрос, который выполняют представления и сериализаторы, должен идти по индексу
+    full_scan = re.compile(r'^SCAN (insta_app_\w+)$')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [UserProfile.objects.create_user(f'user{i}', password='pass') for i in range(4)]
+        cls.users[3].is_official = True
+        cls.users[3].save()
+        for follower in cls.users[:3]:
+            for following in cls.users:
+                if follower != following:
+                    Follow.objects.create(follower=follower, following=following)
+        for i, user in enumerate(cls.users):
+            post = Post.objects.create(user=user, description=f'post {i}', hashtag='tag')
+            PostContent.objects.create(post=post, content=f'posts/{i}.png')
+            PostLike.objects.create(post=post, user=cls.users[0], like=True)
+            comment = Comment.objects.create(post=post, user=cls.users[1], text='comment')
+            reply = Comment.objects.create(post=post, user=cls.users[2], text='reply', parent=comment)
+            CommentLike.objects.create(comment=reply, user=cls.users[0], like=True)
+        cls.post = post
+        cls.comment = comment
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, sql, allow_sort=False):
+        # Полный обход таблицы, а для страниц (LIMIT) ещё и сортировка всей выборки во временном
+        # B-дереве: и то и другое растёт с размером таблицы, а не страницы
+        plan = self.explain(sql)
+        problems = [line for line in plan if self.full_scan.match(line)]
+        if ' LIMIT ' in sql and not allow_sort:
+            problems += [line for line in plan if 'USE TEMP B-TREE FOR ORDER BY' in line]
+        return problems
+
+    def assert_indexed(self, name, *args, allow_sort=False, **params):
+        self.client.force_login(self.users[0])
+        with translation.override('en'):
+            url = reverse(name, args=args)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if sql.startswith('SELECT') and 'insta_app_' in sql:
+                self.assertEqual(self.full_scans(sql, allow_sort), [], f'{url} {params}: {sql}')
+
+    def test_users(self):
+        self.assert_indexed('user_list')
+        self.assert_indexed('user_list', ordering='date_registered')
+        # Ранжированный поиск сортирует только найденные строки: порядок релевантности индексом не задать
+        self.assert_indexed('user_list', search='user', allow_sort=True)
+        self.assert_indexed('user_detail', self.users[0].pk)
+
+    def test_posts(self):
+        self.assert_indexed('post_list')
+        self.assert_indexed('post_list', user=self.users[1].pk)
+        self.assert_indexed('post_list', hashtag='tag')
+        self.assert_indexed('post_list', ordering='created_date')
+        self.assert_indexed('post_list', search='post tag', allow_sort=True)
+        self.assert_indexed('post_detail', self.post.pk)
+        self.assert_indexed('feed')
+        self.assert_indexed('hashtag_posts', 'tag')
+        # Топ тегов - сумма по корзинам окна, отсортировать её можно только после группировки
+        self.assert_indexed('trending', allow_sort=True)
+
+    def test_viewsets(self):
+        self.assert_indexed('follow-list', follower=self.users[0].pk)
+        self.assert_indexed('follow-list', following=self.users[0].pk)
+        self.assert_indexed('postcontent-list', post=self.post.pk)
+        self.assert_indexed('postlike-list', post=self.post.pk)
+        self.assert_indexed('postlike-list', user=self.users[0].pk)
+        self.assert_indexed('comment-list', post=self.post.pk)
+        self.assert_indexed('comment-detail', self.comment.pk)
+        self.assert_indexed('commentlike-list', comment=self.comment.pk)
+
+
+class HashtagTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserProfile.objects.create_user('author', password='pass')
+
+    def get(self, name, *args, **params):
+        with translation.override('en'):
+            response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tags_are_parsed_and_listed(self):
+        post = Post.objects.create(user=self.user, description='Вечер #Bishkek #горы', hashtag='travel')
+        Post.objects.create(user=self.user, description='ещё #горы')
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['bishkek', 'travel', 'горы'])
+
+        results = self.get('hashtag_posts', 'Горы')['results']
+        self.assertEqual(len(results), 2)
+
+        post.description = 'без тегов'
+        post.save()
+        self.assertEqual(list(post.tags.values_list('name', flat=True)), ['travel'])
+
+    def test_tag_pages_follow_post_dates(self):
+        ids = [Post.objects.create(user=self.user, description=f'#walk {i}').id for i in range(5)]
+        Post.objects.filter(pk=ids[-1]).update(created_date=timezone.now().date() - timedelta(days=1))
+        PostTag.objects.filter(post_id=ids[-1]).update(created_date=timezone.now().date() - timedelta(days=1))
+        walked, data = [], self.get('hashtag_posts', 'walk', page_size=2)
+        while True:
+            walked.extend(post['id'] for post in data['results'])
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).json()
+        self.assertEqual(walked, ids[-2::-1] + ids[-1:])
+
+    def test_trending_counts_window(self):
+        for i in range(3):
+            Post.objects.create(user=self.user, description=f'#popular {i}')
+        Post.objects.create(user=self.user, description='#rare')
+
+        trends = self.get('trending')
+        self.assertEqual(trends[0], {'name': 'popular', 'posts_count': 3})
+        self.assertEqual(trends[1], {'name': 'rare', 'posts_count': 1})
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Нет полнотекстового индекса')
+class FullTextSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = UserProfile.objects.create_user('mountaineer', password='pass', bio='Горы и походы')
+        UserProfile.objects.create_user('reader', password='pass', bio='книги')
+
+    def search(self, name, term, **params):
+        with translation.override('en'):
+            response = self.client.get(reverse(name), {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_posts_are_ranked_and_paginated(self):
+        weak = Post.objects.create(user=self.author, description='Озеро и горы')
+        strong = Post.objects.create(user=self.author, description='Горы, горы, горы', hashtag='горы')
+        Post.objects.create(user=self.author, description='Город')
+
+        data = self.search('post_list', 'горы')
+        self.assertEqual([post['id'] for post in data['results']], [strong.id, weak.id])
+
+        first = self.search('post_list', 'горы', page_size=1)
+        second = self.client.get(first['next']).json()
+        self.assertEqual([post['id'] for post in second['results']], [weak.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(user=self.author, description='старое описание')
+        post.description = 'новое описание'
+        post.save()
+        self.assertEqual(self.search('post_list', 'старое')['results'], [])
+        self.assertEqual(len(self.search('post_list', 'нов')['results']), 1)
+        self.assertEqual(len(self.search('post_list', 'mountain')['results']), 1)
+
+        self.author.username = 'climber'
+        self.author.save()
+        self.assertEqual(len(self.search('post_list', 'climber')['results']), 1)
+        self.assertEqual(self.search('user_list', 'походы')['results'][0]['username'], 'climber')
+
+        post.delete()
+        self.assertEqual(self.search('post_list', 'описание')['results'], [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        Post.objects.create(user=self.author, description='AND OR NOT')
+        self.assertEqual(len(self.search('post_list', '"AND* (OR')['results']), 1)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        self.reader = UserProfile.objects.create_user('reader', password='pass')
+        self.post = Post.objects.create(user=self.author, description='post')
+
+    def get(self, name, pk):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, args=[pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_post_detail_is_cached_and_invalidated(self):
+        self.get('post_detail', self.post.pk)
+        queries, _ = self.get('post_detail', self.post.pk)
+        self.assertEqual(queries, 0)
+
+        Comment.objects.create(post=self.post, user=self.reader, text='new')
+        PostLike.objects.create(post=self.post, user=self.reader, like=True)
+        _, data = self.get('post_detail', self.post.pk)
+        self.assertEqual(len(data['comments']), 1)
+        self.assertEqual(data['likes_count'], 1)
+
+        self.author.username = 'renamed'
+        self.author.save()
+        _, data = self.get('post_detail', self.post.pk)
+        self.assertEqual(data['user']['username'], 'renamed')
+
+    def test_comment_author_change_invalidates_post(self):
+        commenter = UserProfile.objects.create_user('commenter', password='pass')
+        root = Comment.objects.create(post=self.post, user=self.reader, text='root')
+        Comment.objects.create(post=self.post, user=commenter, text='reply', parent=root)
+        self.get('post_detail', self.post.pk)
+        for user in (self.reader, commenter):
+            user.username = f'{user.username}-renamed'
+            user.save()
+            _, data = self.get('post_detail', self.post.pk)
+            names = {comment['user_username'] for comment in walk_comment_data(data['comments'])}
+            self.assertIn(user.username, names)
+
+    def test_is_liked_is_per_user(self):
+        PostLike.objects.create(post=self.post, user=self.reader, like=True)
+        self.client.force_authenticate(self.reader)
+        _, data = self.get('post_detail', self.post.pk)
+        self.assertTrue(data['is_liked'])
+
+        self.client.force_authenticate(self.author)
+        queries, data = self.get('post_detail', self.post.pk)
+        self.assertFalse(data['is_liked'])
+        self.assertEqual(queries, 1)
+
+    def test_profile_counters_invalidate(self):
+        _, data = self.get('user_detail', self.author.pk)
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Post.objects.create(user=self.author, description='second')
+        _, data = self.get('user_detail', self.author.pk)
+        self.assertEqual((data['following_count'], data['posts_count']), (1, 2))
+
+
+class ViewerStateTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.viewer = UserProfile.objects.create_user('viewer', password='pass')
+        self.authors = [UserProfile.objects.create_user(f'author{i}', password='pass') for i in range(4)]
+        Follow.objects.create(follower=self.viewer, following=self.authors[0])
+        self.posts = [Post.objects.create(user=author, description='post') for author in self.authors]
+        PostLike.objects.create(post=self.posts[0], user=self.viewer, like=True)
+        PostLike.objects.create(post=self.posts[1], user=self.viewer, like=False)
+        self.client.force_authenticate(self.viewer)
+
+    def get(self, name, *args, **params):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_post_list_flags_in_constant_queries(self):
+        small, _ = self.get('post_list', page_size=1)
+        large, data = self.get('post_list', page_size=4)
+        self.assertEqual(small, large)
+
+        flags = {post['id']: (post['is_liked'], post['is_following']) for post in data['results']}
+        self.assertEqual(flags[self.posts[0].id], (True, True))
+        self.assertEqual(flags[self.posts[1].id], (False, False))
+
+    def test_comment_and_user_flags(self):
+        root = Comment.objects.create(post=self.posts[1], user=self.authors[0], text='root')
+        reply = Comment.objects.create(post=self.posts[1], user=self.authors[1], text='reply', parent=root)
+        CommentLike.objects.create(comment=reply, user=self.viewer, like=True)
+
+        _, data = self.get('comment-list', post=self.posts[1].pk)
+        comment = next(item for item in data['results'] if item['id'] == root.id)
+        self.assertEqual((comment['is_liked'], comment['is_following']), (False, True))
+        nested = comment['subcomments'][0]
+        self.assertEqual((nested['is_liked'], nested['is_following']), (True, False))
+
+        _, data = self.get('post_detail', self.posts[1].pk)
+        self.assertFalse(data['is_liked'])
+        self.assertTrue(data['comments'][0]['subcomments'][0]['is_liked'])
+
+        _, data = self.get('user_list')
+        following = {user['username']: user['is_following'] for user in data['results']}
+        self.assertTrue(following['author0'])
+        self.assertFalse(following['author1'])
+
+
+class RenditionsTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root, TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        self.post = Post.objects.create(user=self.author, description='post')
+
+    def upload(self, name, size):
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 40, 40)).save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_renditions_are_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            content = PostContent.objects.create(post=self.post, content=self.upload('photo.png', (2000, 1000)))
+        content.refresh_from_db()
+
+        renditions = content.renditions
+        self.assertEqual((renditions['width'], renditions['height']), (2000, 1000))
+        self.assertEqual(len(renditions['blurhash']), 28)
+        self.assertEqual(renditions['sizes']['thumb']['width'], 320)
+        self.assertEqual(renditions['sizes']['medium']['height'], 540)
+        storage = content.content.storage
+        self.assertTrue(storage.exists(renditions['sizes']['thumb']['webp']))
+
+        with translation.override('en'):
+            data = self.client.get(reverse('post_detail', args=[self.post.pk])).json()
+        srcset = data['contents'][0]['renditions']['srcset']
+        self.assertEqual(set(srcset), {'thumb', 'medium'})
+        self.assertTrue(srcset['thumb']['jpeg'].endswith('.jpeg'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            content.delete()
+        self.assertFalse(storage.exists(renditions['sizes']['thumb']['webp']))
+
+    def test_same_content_is_stored_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = PostContent.objects.create(post=self.post, content=self.upload('a.png', (600, 400)))
+        with self.captureOnCommitCallbacks(execute=True):
+            second = PostContent.objects.create(post=self.post, content=self.upload('b.png', (600, 400)))
+        first.refresh_from_db()
+        second.refresh_from_db()
+
+        self.assertEqual(first.content.name, second.content.name)
+        self.assertEqual(first.renditions, second.renditions)
+        self.assertEqual(Blob.objects.get(name=first.content.name).refcount, 2)
+        thumb = first.renditions['sizes']['thumb']['webp']
+        self.assertEqual(Blob.objects.get(name=thumb).refcount, 2)
+
+        storage = first.content.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(second.content.name))
+        self.assertTrue(storage.exists(thumb))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(second.content.name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_non_image_content_is_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            content = PostContent.objects.create(
+                post=self.post, content=SimpleUploadedFile('clip.mp4', b'not an image'))
+        content.refresh_from_db()
+        self.assertEqual(content.renditions, {'source': content.content.name})
+
+
+class ChunkedUploadTest(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=os.path.join(root, 'media'), TASKS_EAGER=True,
+                                     CHUNKED_UPLOAD_DIR=os.path.join(root, 'uploads'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.user = UserProfile.objects.create_user('author', password='pass')
+        self.post = Post.objects.create(user=self.user, description='video')
+        self.client.force_authenticate(self.user)
+
+    def url(self, *args, action='detail'):
+        with translation.override('en'):
+            return reverse(f'upload-{action}', args=args)
+
+    def append(self, session_id, offset, data):
+        return self.client.patch(self.url(session_id), data, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload_in_chunks_and_resume(self):
+        data = os.urandom(200 * 1024)
+        response = self.client.post(self.url(action='list'),
+                                    {'post': self.post.pk, 'filename': 'clip.mp4', 'size': len(data)})
+        self.assertEqual(response.status_code, 201)
+        session_id = response.json()['id']
+
+        self.assertEqual(self.append(session_id, 0, data[:70000]).json()['offset'], 70000)
+        self.assertEqual(self.append(session_id, 0, data[:70000]).status_code, 409)
+        self.assertEqual(self.client.get(self.url(session_id)).json()['offset'], 70000)
+        self.assertEqual(self.append(session_id, 70000, data[70000:]).json()['offset'], len(data))
+
+        response = self.client.post(self.url(session_id, action='finalize'), {'checksum': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url(session_id)).json()['offset'], 0)
+
+        self.append(session_id, 0, data)
+        response = self.client.post(self.url(session_id, action='finalize'),
+                                    {'checksum': hashlib.sha256(data).hexdigest()})
+        self.assertEqual(response.status_code, 200)
+        content = PostContent.objects.get(pk=response.json()['content'])
+        self.assertEqual(content.post, self.post)
+        with content.content.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_chunk_past_declared_size_is_rejected(self):
+        response = self.client.post(self.url(action='list'),
+                                    {'post': self.post.pk, 'filename': 'clip.mp4', 'size': 10})
+        self.assertEqual(self.append(response.json()['id'], 0, b'x' * 11).status_code, 400)
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root, TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.data = bytes(range(256)) * 40
+        self.name = default_storage.save('posts/clip.mp4', ContentFile(self.data))
+
+    def get(self, path, **headers):
+        response = self.client.get(f'/media/{path}', headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_and_range_responses(self):
+        response, body = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response, body = self.get(self.name, Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+
+        response, body = self.get(self.name, Range='bytes=-10')
+        self.assertEqual(body, self.data[-10:])
+
+        response, _ = self.get(self.name, Range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_conditional_and_immutable_headers(self):
+        response, _ = self.get(self.name)
+        response, _ = self.get(self.name, If_None_Match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        post = Post.objects.create(description='post')
+        content = PostContent.objects.create(post=post, content=SimpleUploadedFile('a.mp4', self.data))
+        response, _ = self.get(content.content.name)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.data).hexdigest()}"')
+
+    def test_accel_redirect_mode(self):
+        with override_settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            response, body = self.get(self.name)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(body, b'')
+
+    def test_path_outside_media_root(self):
+        response, _ = self.get('../manage.py')
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkWriteTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [UserProfile.objects.create_user(f'user{i}', password='pass') for i in range(3)]
+        self.posts = [Post.objects.create(user=self.users[0], description=f'post {i}') for i in range(3)]
+        self.client.force_authenticate(self.users[1])
+
+    def bulk(self, name, items):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse(name), items, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), [(item['index'], item['status']) for item in response.json()['results']]
+
+    def test_likes_create_toggle_delete(self):
+        PostLike.objects.create(post=self.posts[0], user=self.users[1], like=False)
+        items = [{'post': post.pk, 'user': self.users[1].pk} for post in self.posts]
+        _, results = self.bulk('postlike-bulk-create', items + [{'post': 999, 'user': self.users[1].pk}, {}])
+        self.assertEqual(results, [(0, 'updated'), (1, 'created'), (2, 'created'), (3, 'invalid'), (4, 'invalid')])
+        self.assertEqual(PostLike.objects.filter(like=True).count(), 3)
+        self.assertEqual(list(Post.objects.order_by('id').values_list('likes_count', flat=True)), [1, 1, 1])
+
+        _, results = self.bulk('postlike-bulk-toggle', items[:1] + items[:1])
+        self.assertEqual(results, [(0, 'updated'), (1, 'updated')])
+        self.assertTrue(PostLike.objects.get(post=self.posts[0], user=self.users[1]).like)
+
+        _, results = self.bulk('postlike-bulk-delete', items[1:])
+        self.assertEqual(results, [(0, 'deleted'), (1, 'deleted')])
+        self.assertEqual(list(Post.objects.order_by('id').values_list('likes_count', flat=True)), [1, 0, 0])
+
+    def test_only_caller_can_act(self):
+        self.client.force_authenticate(None)
+        with translation.override('en'):
+            response = self.client.post(reverse('postlike-bulk-create'), [{'post': self.posts[0].pk}], format='json')
+        self.assertIn(response.status_code, (401, 403))
+
+        self.client.force_authenticate(self.users[1])
+        _, results = self.bulk('postlike-bulk-create', [{'post': self.posts[0].pk, 'user': self.users[2].pk},
+                                                        {'post': self.posts[1].pk}])
+        self.assertEqual(results, [(0, 'invalid'), (1, 'created')])
+        self.assertEqual(list(PostLike.objects.values_list('post', 'user')), [(self.posts[1].pk, self.users[1].pk)])
+        _, results = self.bulk('follow-bulk-create', [{'follower': self.users[2].pk, 'following': self.users[0].pk}])
+        self.assertEqual(results, [(0, 'invalid')])
+        self.assertFalse(Follow.objects.exists())
+
+    def test_state_read_by_exact_pairs(self):
+        # Чужие лайки тех же постов не читаются: условие - пары (post, user), а не post IN и user IN
+        PostLike.objects.bulk_create([PostLike(post=post, user=user) for post in self.posts
+                                      for user in (self.users[0], self.users[2])])
+        with CaptureQueriesContext(connection) as queries:
+            writer = PostLikeBulkWriter(CREATE, self.users[1].pk)
+            state = writer.load_state({(post.pk, self.users[1].pk) for post in self.posts})
+        self.assertEqual(state, {})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(' IN (', queries.captured_queries[0]['sql'])
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        small, _ = self.bulk('postlike-bulk-create', [{'post': self.posts[0].pk}])
+        large, results = self.bulk('postlike-bulk-toggle', [{'post': post.pk} for post in self.posts])
+        self.assertEqual(small, large)
+        self.assertEqual(len(results), 3)
+
+    def test_counters_change_by_delta(self):
+        # Счётчик не пересчитывается заново: параллельные F()-изменения других запросов сохраняются
+        Post.objects.filter(pk=self.posts[0].pk).update(likes_count=10)
+        items = [{'post': self.posts[0].pk}]
+        self.bulk('postlike-bulk-create', items)
+        self.bulk('postlike-bulk-toggle', items)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).likes_count, 10)
+        self.bulk('postlike-bulk-toggle', items)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).likes_count, 11)
+        with CaptureQueriesContext(connection) as queries:
+            self.bulk('postlike-bulk-delete', items)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).likes_count, 10)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_follows(self):
+        items = [{'following': self.users[0].pk}, {'following': self.users[2].pk}]
+        _, results = self.bulk('follow-bulk-create', items)
+        self.assertEqual(results, [(0, 'created'), (1, 'created')])
+        # Поля счётчиков - как у сигналов follow_counters_*
+        self.assertEqual(UserProfile.objects.get(pk=self.users[0].pk).following_count, 1)
+        self.assertEqual(UserProfile.objects.get(pk=self.users[1].pk).followers_count, 2)
+        # Посты в ленту добавляет воркер очереди
+        self.assertEqual(self.users[1].timeline.count(), 0)
+        tasks.drain()
+        self.assertEqual(self.users[1].timeline.count(), 3)
+
+        _, results = self.bulk('follow-bulk-toggle', items[:1])
+        self.assertEqual(results, [(0, 'deleted')])
+        self.assertEqual(UserProfile.objects.get(pk=self.users[1].pk).followers_count, 1)
+        self.assertEqual(self.users[1].timeline.count(), 0)
+
+
+class LikeToggleTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserProfile.objects.create_user('reader', password='pass')
+        self.post = Post.objects.create(description='post')
+        self.comment = Comment.objects.create(post=self.post, user=self.user, text='comment')
+        self.client.force_authenticate(self.user)
+
+    def call(self, method, name, pk):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(reverse(name, args=[pk]))
+        return response, len(queries)
+
+    def test_post_like_is_idempotent(self):
+        response, _ = self.call('post', 'post_like', self.post.pk)
+        self.assertEqual(response.json(), {'liked': True, 'likes_count': 1})
+        response, _ = self.call('post', 'post_like', self.post.pk)
+        self.assertEqual(response.json()['likes_count'], 1)
+        self.assertEqual(PostLike.objects.filter(post=self.post).count(), 1)
+
+        response, _ = self.call('delete', 'post_like', self.post.pk)
+        self.assertEqual(response.json(), {'liked': False, 'likes_count': 0})
+        response, _ = self.call('delete', 'post_like', self.post.pk)
+        self.assertEqual(response.json()['likes_count'], 0)
+        self.assertFalse(PostLike.objects.exists())
+
+    def test_tap_is_one_upsert_and_one_counter_update(self):
+        with translation.override('en'), CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('post_like', args=[self.post.pk]))
+        statements = [query['sql'].split()[0] for query in queries.captured_queries
+                      if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(statements, ['INSERT', 'UPDATE'])
+
+    def test_comment_like_and_missing_target(self):
+        response, _ = self.call('post', 'comment-like', self.comment.pk)
+        self.assertEqual(response.json(), {'liked': True, 'likes_count': 1})
+        self.assertEqual(Comment.objects.get(pk=self.comment.pk).likes_count, 1)
+
+        response, _ = self.call('post', 'comment-like', 999)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CommentLike.objects.count(), 1)
+
+
+@override_settings(ASYNC_PARALLEL_QUERIES=False)
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.viewer = UserProfile.objects.create_user('viewer', password='pass')
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        self.posts = [Post.objects.create(user=self.author, description=f'post {i}') for i in range(3)]
+        PostContent.objects.create(post=self.posts[0], content='posts/0.png')
+        root = Comment.objects.create(post=self.posts[0], user=self.author, text='root')
+        reply = Comment.objects.create(post=self.posts[0], user=self.viewer, text='reply', parent=root)
+        CommentLike.objects.create(comment=reply, user=self.viewer, like=True)
+        PostLike.objects.create(post=self.posts[0], user=self.viewer, like=True)
+        # Раскладка постов по лентам идёт через очередь задач
+        tasks.drain()
+        self.client.force_login(self.viewer)
+
+    def get(self, name, *args, **params):
+        get_cache().clear()
+        with translation.override('en'):
+            response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_async_views_match_sync_views(self):
+        pairs = [
+            ('post_list', 'async_post_list', (), {'page_size': 2}),
+            ('feed', 'async_feed', (), {}),
+            ('post_detail', 'async_post_detail', (self.posts[0].pk,), {'max_depth': 1}),
+            ('user_detail', 'async_user_detail', (self.author.pk,), {}),
+        ]
+        for sync_name, async_name, args, params in pairs:
+            with self.subTest(sync_name):
+                async_data, sync_data = self.get(async_name, *args, **params), self.get(sync_name, *args, **params)
+                if 'results' in sync_data:
+                    # Ссылки на страницы ведут каждая на свой адрес
+                    async_data, sync_data = async_data['results'], sync_data['results']
+                    self.assertTrue(sync_data)
+                self.assertEqual(async_data, sync_data)
+
+    def test_jwt_authentication(self):
+        client = APIClient()
+        with translation.override('en'):
+            access = client.post(reverse('login'), {'username': 'viewer', 'password': 'pass'}).data['access']
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+            for sync_name, async_name in [('feed', 'async_feed'), ('post_detail', 'async_post_detail')]:
+                args = [self.posts[0].pk] if sync_name == 'post_detail' else []
+                get_cache().clear()
+                sync_response = client.get(reverse(sync_name, args=args))
+                async_response = client.get(reverse(async_name, args=args))
+                self.assertEqual((async_response.status_code, sync_response.status_code), (200, 200))
+            self.assertTrue(async_response.json()['is_liked'])
+            client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+            self.assertEqual(client.get(reverse('async_feed')).status_code, 401)
+
+    def test_errors(self):
+        with translation.override('en'):
+            self.assertEqual(self.client.get(reverse('async_post_detail', args=[999])).status_code, 404)
+            self.client.logout()
+            self.assertIn(self.client.get(reverse('async_feed')).status_code, (401, 403))
+
+
+class AsyncParallelQueriesTest(TransactionTestCase):
+    def test_post_detail_with_parallel_queries(self):
+        author = UserProfile.objects.create_user('author', password='pass')
+        post = Post.objects.create(user=author, description='post')
+        Comment.objects.create(post=post, user=author, text='comment')
+        with translation.override('en'):
+            response = self.client.get(reverse('async_post_detail', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['comments'][0]['text'], 'comment')
+
+
+class DatabaseProfileTest(TestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'PRAGMA есть только в SQLite')
+    def test_sqlite_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            wal = cursor.fetchone()[0] == 'wal'
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1 if wal else 2)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    @skipUnless(connection.vendor == 'sqlite', 'PRAGMA есть только в SQLite')
+    def test_wal_switched_by_migration_not_on_connect(self):
+        # Подключение не меняет режим журнала файла базы и без WAL держит synchronous=FULL;
+        # WAL включает миграция, после неё соединения получают NORMAL
+        path = os.path.join(tempfile.mkdtemp(), 'wal.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        db = connections['default'].__class__({**connection.settings_dict, 'NAME': path}, alias='wal_check')
+        self.addCleanup(db.close)
+
+        def pragmas():
+            with db.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                mode = cursor.fetchone()[0]
+                cursor.execute('PRAGMA synchronous')
+                return mode, cursor.fetchone()[0]
+
+        self.assertEqual(pragmas(), ('delete', 2))
+        migration = importlib.import_module('insta_app.migrations.0016_sqlite_wal')
+        migration.enable_wal(None, SimpleNamespace(connection=db))
+        db.close()
+        self.assertEqual(pragmas(), ('wal', 1))
+
+    @override_settings(DATABASE_REPLICAS=['replica_1'])
+    def test_replica_used_only_for_reads_in_get_views(self):
+        router = ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Post))
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Post), 'replica_1')
+            self.assertEqual(router.db_for_write(Post), 'default')
+            with read_from_primary():
+                self.assertIsNone(router.db_for_read(Post))
+        self.assertFalse(router.allow_migrate('replica_1', 'insta_app'))
+        self.assertTrue(router.allow_migrate('default', 'insta_app'))
+
+    def test_get_views_read_without_replicas(self):
+        user = UserProfile.objects.create_user('reader', password='pass')
+        post = Post.objects.create(user=user, description='post')
+        with translation.override('en'):
+            self.assertEqual(self.client.get(reverse('post_list')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('post_detail', args=[post.pk])).status_code, 200)
+
+
+class SyntheticBenchmarkTest(TestCase):
+    def test_seed_synthetic_builds_consistent_graph(self):
+        out = StringIO()
+        call_command('seed_synthetic', users=40, follows=5, posts=3, likes=4, comments=2,
+                     hashtags=10, batch_size=50, stdout=out)
+        self.assertEqual(UserProfile.objects.filter(username__startswith='synth_').count(), 40)
+        self.assertTrue(Post.objects.exists())
+        self.assertTrue(PostContent.objects.exists())
+        self.assertTrue(Comment.objects.exists())
+        self.assertTrue(self.client.login(username='synth_0', password='synthetic'))
+        # Счётчики и ленты досчитаны так же, как это делают сигналы
+        self.assertEqual(recount_users(UserProfile.objects.all()), 0)
+        self.assertEqual(recount_posts(Post.objects.all()), 0)
+        self.assertEqual(recount_comments(Comment.objects.all()), 0)
+        follow = Follow.objects.filter(following__posts_count__gt=0, following__is_official=False).first()
+        self.assertTrue(TimelineEntry.objects.filter(owner=follow.follower,
+                                                     post__user=follow.following).exists())
+        # Даты постов разбросаны по окну, копии дат в лентах и тегах совпадают с постами
+        today = timezone.localdate()
+        dates = set(Post.objects.values_list('created_date', flat=True))
+        self.assertGreater(len(dates), 1)
+        self.assertGreaterEqual(min(dates), today - timedelta(days=30))
+        self.assertFalse(TimelineEntry.objects.exclude(created_date=F('post__created_date')).exists())
+        self.assertFalse(PostTag.objects.exclude(created_date=F('post__created_date')).exists())
+        self.assertEqual(HashtagTrend.objects.aggregate(total=Sum('count'))['total'], PostTag.objects.count())
+
+    @override_settings(ASYNC_PARALLEL_QUERIES=False)
+    def test_benchmark_reports_percentiles_and_queries(self):
+        call_command('seed_synthetic', users=20, follows=3, posts=2, stdout=StringIO())
+        report = Benchmark(requests=60, warmup=5, viewers=3).run()
+        self.assertIn('post_list', report)
+        for row in report.values():
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+            self.assertGreater(row['queries'], 0)
+            self.assertEqual(row['errors'], 0)
+        self.assertIn('p50', format_report(report, report))
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_SERVER_TIMING=True, METRICS_TOKEN='')
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        user = UserProfile.objects.create_user('author', password='pass')
+        for i in range(3):
+            Post.objects.create(user=user, description=f'post {i}')
+
+    def test_server_timing_and_prometheus_histograms(self):
+        with translation.override('en'):
+            response = self.client.get(reverse('post_list'))
+        header = response['Server-Timing']
+        self.assertIn('app;dur=', header)
+        self.assertIn('serializer;dur=', header)
+        queries = int(re.search(r'"(\d+) queries, 0 repeated"', header).group(1))
+        self.assertGreater(queries, 0)
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{route="post_list",method="GET",status="200"} 1', text)
+        self.assertIn('http_request_queries_bucket{route="post_list",method="GET",le="+Inf"} 1', text)
+        self.assertIn(f'http_request_queries_sum{{route="post_list",method="GET"}} {queries}', text)
+        self.assertNotIn('route="metrics"', text)
+
+    def test_repeated_sql_counted_as_duplicates(self):
+        stats = metrics.RequestStats()
+        for pk in range(3):
+            stats.record_query('SELECT * FROM post WHERE id = %s', 0.001)
+        stats.record_query('SELECT * FROM user', 0.001)
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.duplicates, 2)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        with translation.override('en'):
+            response = self.client.get(reverse('post_list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('route="post_list"', self.client.get('/metrics').content.decode())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_requires_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+FLAKY_CALLS = []
+
+
+@tasks.task('tests.flaky', max_attempts=2)
+def flaky_task(value):
+    FLAKY_CALLS.append(value)
+    raise RuntimeError('сбой')
+
+
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        self.author = UserProfile.objects.create_user('author', password='pass')
+        self.reader = UserProfile.objects.create_user('reader', password='pass')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        tasks.drain()
+
+    def test_post_fan_out_runs_in_worker(self):
+        post = Post.objects.create(user=self.author, description='post')
+        post.description = 'edited'
+        post.save()
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['feed.fan_out'])
+        self.assertFalse(self.reader.timeline.exists())
+
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertIn('Выполнено задач: 1', out.getvalue())
+        self.assertTrue(self.reader.timeline.filter(post=post).exists())
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_EAGER=None, DEBUG=True)
+    def test_eager_by_default_in_debug(self):
+        # Без воркеров в разработке пост сразу попадает в ленту подписчика
+        post = Post.objects.create(user=self.author, description='post')
+        self.assertFalse(Task.objects.exists())
+        self.assertTrue(self.reader.timeline.filter(post=post).exists())
+        with self.settings(DEBUG=False):
+            self.assertFalse(tasks.is_eager())
+
+    def test_dedupe_key_only_while_queued(self):
+        for _ in range(2):
+            tasks.enqueue('maintenance.prune_trends', dedupe_key='prune')
+        self.assertEqual(Task.objects.count(), 1)
+        tasks.claim('worker', 10)
+        tasks.enqueue('maintenance.prune_trends', dedupe_key='prune')
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_priority_order(self):
+        tasks.enqueue('maintenance.prune_trends')
+        tasks.enqueue('feed.fan_out', post_id=0)
+        claimed = tasks.claim('worker', 1)
+        self.assertEqual([task.name for task in claimed], ['feed.fan_out'])
+        self.assertEqual(claimed[0].status, Task.STATUS_RUNNING)
+        self.assertEqual(claimed[0].attempts, 1)
+
+    def test_retry_with_backoff_then_fail(self):
+        FLAKY_CALLS.clear()
+        tasks.enqueue('tests.flaky', value=1)
+        with self.assertLogs('insta_app.tasks', 'WARNING'):
+            self.assertEqual(tasks.drain(), 1)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.STATUS_QUEUED, 1))
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('сбой', task.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('insta_app.tasks', 'WARNING'):
+            tasks.drain()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.STATUS_FAILED, 2))
+        self.assertEqual(FLAKY_CALLS, [1, 1])
+
+    def test_stale_running_task_requeued(self):
+        tasks.enqueue('maintenance.prune_trends')
+        tasks.claim('dead-worker', 1)
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(tasks.requeue_stale(), 1)
+        self.assertEqual(Task.objects.get().status, Task.STATUS_QUEUED)
+
+    def test_requeue_merges_into_queued_duplicate(self):
+        # Пока задача выполнялась, такую же поставили снова: возврат в очередь не нарушает уникальность
+        tasks.enqueue('maintenance.prune_trends', dedupe_key='prune')
+        tasks.claim('dead-worker', 1)
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        tasks.enqueue('maintenance.prune_trends', dedupe_key='prune')
+        self.assertEqual(tasks.requeue_stale(), 1)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.STATUS_QUEUED, 1))
+
+        FLAKY_CALLS.clear()
+        tasks.enqueue('tests.flaky', dedupe_key='flaky', value=1)
+        claimed = tasks.claim('worker', 10)
+        tasks.enqueue('tests.flaky', dedupe_key='flaky', value=2)
+        with self.assertLogs('insta_app.tasks', 'WARNING'):
+            for task_obj in claimed:
+                tasks.execute(task_obj)
+        task = Task.objects.get(name='tests.flaky')
+        self.assertEqual((task.status, task.attempts, task.kwargs), (Task.STATUS_QUEUED, 1, {'value': 2}))
+        self.assertIn('сбой', task.last_error)
+        self.assertFalse(Task.objects.filter(status=Task.STATUS_RUNNING).exists())
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        authentication.user_cache.clear()
+        authentication.blacklist.reset()
+        self.user = UserProfile.objects.create_user('jwtuser', password='pass')
+        self.client = APIClient()
+        with translation.override('en'):
+            response = self.client.post(reverse('login'), {'username': 'jwtuser', 'password': 'pass'})
+        self.tokens = response.data
+        self.request = Request(RequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}"))
+
+    def test_user_cached(self):
+        backend = authentication.CachedJWTAuthentication()
+        user, _ = backend.authenticate(self.request)
+        self.assertEqual(user.pk, self.user.pk)
+        # Без сигнала кэш не знает о смене флага - пользователь берётся из памяти
+        UserProfile.objects.filter(pk=self.user.pk).update(is_active=False)
+        user, _ = backend.authenticate(self.request)
+        self.assertEqual(user.pk, self.user.pk)
+        authentication.user_cache.discard(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(self.request)
+
+    def test_password_change_revokes(self):
+        backend = authentication.CachedJWTAuthentication()
+        backend.authenticate(self.request)
+        self.user.set_password('other')
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(self.request)
+
+    def test_logout_revokes_access_token(self):
+        backend = authentication.CachedJWTAuthentication()
+        backend.authenticate(self.request)
+        with translation.override('en'):
+            response = self.client.post(reverse('logout'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 205)
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(self.request)
+        # Другой процесс узнаёт об отзыве из таблицы при пересборке фильтра
+        authentication.blacklist.reset()
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(self.request)
+
+    def test_tokens_issued_before_revoke_claims_accepted(self):
+        # Токен, выданный до включения версии пароля и sid, действует до истечения срока
+        token = AccessToken.for_user(self.user)
+        del token[api_settings.REVOKE_TOKEN_CLAIM]
+        request = Request(RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+        backend = authentication.CachedJWTAuthentication()
+        user, _ = backend.authenticate(request)
+        self.assertEqual(user.pk, self.user.pk)
+        UserProfile.objects.filter(pk=self.user.pk).update(is_active=False)
+        authentication.user_cache.discard(self.user.pk)
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(request)
+
+    def test_bloom_filter(self):
+        bloom = authentication.BloomFilter(1000)
+        for number in range(1000):
+            bloom.add(f'jti-{number}')
+        self.assertTrue(all(f'jti-{number}' in bloom for number in range(1000)))
+        false_positives = sum(f'other-{number}' in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class NotificationTest(TestCase):
+    def setUp(self):
+        self.owner = UserProfile.objects.create_user('owner', password='pass')
+        self.users = [UserProfile.objects.create_user(f'fan{i}', password='pass') for i in range(3)]
+        self.post = Post.objects.create(user=self.owner, description='post')
+        self.client = APIClient()
+
+    def request(self, user, method, name, *args, **kwargs):
+        self.client.force_authenticate(user=user)
+        with translation.override('en'):
+            return getattr(self.client, method)(reverse(name, args=args), format='json', **kwargs)
+
+    def test_likes_coalesced(self):
+        for user in self.users:
+            self.request(user, 'post', 'post_like', self.post.pk)
+        # Повторный лайк того же человека и свой лайк группу не увеличивают
+        self.request(self.users[0], 'delete', 'post_like', self.post.pk)
+        self.request(self.users[0], 'post', 'post_like', self.post.pk)
+        self.request(self.owner, 'post', 'post_like', self.post.pk)
+
+        response = self.request(self.owner, 'get', 'notification-list')
+        self.assertEqual(len(response.data['results']), 1)
+        item = response.data['results'][0]
+        self.assertEqual(item['kind'], Notification.KIND_POST_LIKE)
+        self.assertEqual(item['actors_count'], 3)
+        self.assertEqual(item['others_count'], 2)
+        self.assertEqual(item['actor']['id'], self.users[0].pk)
+
+    def test_comments_follows_and_bulk(self):
+        comment = Comment.objects.create(post=self.post, user=self.users[0], text='hi')
+        Comment.objects.create(post=self.post, user=self.users[1], text='reply', parent=comment)
+        CommentLike.objects.create(comment=comment, user=self.users[1], like=True)
+        Follow.objects.create(follower=self.users[0], following=self.owner)
+        for user in self.users[1:3]:
+            self.request(user, 'post', 'follow-bulk-create', data=[{'following': self.owner.pk}])
+        self.request(self.users[2], 'post', 'postlike-bulk-create',
+                     data=[{'post': self.post.pk, 'user': self.users[2].pk}])
+
+        inbox = {n.kind: n for n in Notification.objects.filter(recipient=self.owner)}
+        self.assertEqual(inbox[Notification.KIND_COMMENT].actors_count, 2)
+        self.assertEqual(inbox[Notification.KIND_FOLLOW].actors_count, 3)
+        self.assertEqual(inbox[Notification.KIND_POST_LIKE].actors_count, 1)
+        fan_inbox = {n.kind: n for n in Notification.objects.filter(recipient=self.users[0])}
+        self.assertEqual(fan_inbox[Notification.KIND_REPLY].comment_id, comment.pk)
+        self.assertEqual(fan_inbox[Notification.KIND_COMMENT_LIKE].actors_count, 1)
+
+    def test_unread_and_read(self):
+        self.request(self.users[0], 'post', 'post_like', self.post.pk)
+        Follow.objects.create(follower=self.users[0], following=self.owner)
+        response = self.request(self.owner, 'get', 'notification-unread-count')
+        self.assertEqual(response.data, {'unread_count': 2})
+
+        response = self.request(self.owner, 'post', 'notification-read')
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(self.request(self.owner, 'get', 'notification-unread-count').data['unread_count'], 0)
+        # После прочтения новая активность - новая группа
+        self.request(self.users[1], 'post', 'post_like', self.post.pk)
+        self.assertEqual(Notification.objects.filter(recipient=self.owner, kind=Notification.KIND_POST_LIKE).count(), 2)
+        self.assertEqual(self.request(self.owner, 'post', 'notification-read', data={'ids': 'x'}).status_code, 400)
+
+    def test_cursor(self):
+        for user in self.users:
+            Follow.objects.create(follower=user, following=self.owner)
+            Notification.objects.create(recipient=self.owner, kind=Notification.KIND_POST_LIKE,
+                                        group_key=f'post_like:{user.pk}', actors_count=1,
+                                        updated_date=timezone.now())
+        self.client.force_authenticate(user=self.owner)
+        with translation.override('en'):
+            response = self.client.get(reverse('notification-list'), {'page_size': 3})
+            seen = [item['id'] for item in response.data['results']]
+            response = self.client.get(response.data['next'])
+        seen += [item['id'] for item in response.data['results']]
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+        self.assertIsNone(response.data['next'])
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        follow_graph.graph.reset()
+        self.client = APIClient()
+        self.me, self.b, self.c, self.d, self.x, self.y = [
+            UserProfile.objects.create_user(name, password='pass') for name in ('me', 'b', 'c', 'd', 'x', 'y')]
+        for follower, following in ((self.me, self.b), (self.me, self.c), (self.me, self.d),
+                                    (self.b, self.x), (self.c, self.x), (self.b, self.y), (self.y, self.c)):
+            Follow.objects.create(follower=follower, following=following)
+        follow_graph.graph.load()
+        self.addCleanup(follow_graph.graph.reset)
+
+    def get(self, name, pk):
+        with translation.override('en'):
+            return self.client.get(reverse(name, args=[pk]))
+
+    def test_mutuals(self):
+        self.client.force_authenticate(user=self.me)
+        response = self.get('user_mutuals', self.x.pk)
+        self.assertEqual(response.data['count'], 2)
+        # c популярнее (два подписчика) - первым
+        self.assertEqual([item['id'] for item in response.data['results']], [self.c.pk, self.b.pk])
+        self.assertEqual(self.get('user_mutuals', 999).status_code, 404)
+
+    def test_suggestions(self):
+        response = self.get('user_suggestions', self.me.pk)
+        self.assertEqual([(item['id'], item['mutual_count']) for item in response.data['results']],
+                         [(self.x.pk, 2), (self.y.pk, 1)])
+
+    def test_cold_start_answers_from_database(self):
+        # Пока граф строится в фоне, ответы те же, но из базы
+        follow_graph.graph.reset()
+        with mock.patch('insta_app.follow_graph.threading.Thread') as thread:
+            self.test_mutuals()
+            self.test_suggestions()
+        thread.return_value.start.assert_called_once()
+        self.assertFalse(follow_graph.graph.loaded)
+
+    def test_incremental_updates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.d, following=self.y)
+            Follow.objects.filter(follower=self.b, following=self.x).delete()
+        self.client.force_authenticate(user=self.d)
+        with self.captureOnCommitCallbacks(execute=True), translation.override('en'):
+            self.client.post(reverse('follow-bulk-create'), [{'follower': self.d.pk, 'following': self.x.pk}],
+                             format='json')
+        self.assertEqual(follow_graph.graph.suggestions(self.me.pk), [(self.x.pk, 2), (self.y.pk, 2)])
+        # Граф после изменений совпадает с загруженным заново
+        follow_graph.graph.load()
+        self.assertEqual(follow_graph.graph.suggestions(self.me.pk), [(self.x.pk, 2), (self.y.pk, 2)])
+
+    def test_adjacency(self):
+        adjacency = follow_graph.Adjacency.build([(1, 2), (1, 5), (3, 1)], 4)
+        self.assertEqual(list(adjacency.row(1)), [2, 5])
+        adjacency.add(1, 3)
+        adjacency.remove(1, 5)
+        adjacency.add(7, 1)
+        self.assertEqual(list(adjacency.row(1)), [2, 3])
+        self.assertEqual(list(adjacency.row(7)), [1])
+        self.assertEqual(adjacency.degree(3), 1)
+        self.assertFalse(adjacency.has(1, 5))
+
+
+@override_settings(ASYNC_PARALLEL_QUERIES=False)
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserProfile.objects.create_user('author', password='pass')
+        self.fan = UserProfile.objects.create_user('fan', password='pass')
+        self.post = Post.objects.create(user=self.user, description='post')
+        Comment.objects.create(post=self.post, user=self.fan, text='comment')
+        Follow.objects.create(follower=self.fan, following=self.user)
+        self.client.force_authenticate(user=self.fan)
+
+    def get(self, name, *args, **params):
+        with translation.override('en'):
+            response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_fields_skip_viewer_state(self):
+        with mock.patch('insta_app.viewer.liked_post_ids') as liked, \
+                mock.patch('insta_app.viewer.following_ids') as following:
+            data = self.get('post_list', fields='id,likes_count,user.username')
+        self.assertEqual(data['results'], [{'id': self.post.pk, 'likes_count': 0, 'user': {'username': 'author'}}])
+        liked.assert_not_called()
+        following.assert_not_called()
+
+    def test_detail_skips_method_fields(self):
+        with mock.patch.object(PostDetailSerializer, 'get_comments') as comments, \
+                mock.patch.object(PostDetailSerializer, 'get_contents') as contents:
+            data = self.get('post_detail', self.post.pk, fields='id,comments_count,likes_count,is_liked')
+        comments.assert_not_called()
+        contents.assert_not_called()
+        self.assertEqual(data, {'id': self.post.pk, 'likes_count': 0, 'is_liked': False})
+        # Полный ответ кэшируется отдельно от урезанного
+        data = self.get('post_detail', self.post.pk)
+        self.assertEqual(len(data['comments']), 1)
+        data = self.get('async_post_detail', self.post.pk, fields='likes_count')
+        self.assertEqual(data, {'likes_count': 0})
+
+    def test_nested_comment_fields(self):
+        comment = Comment.objects.get()
+        Comment.objects.create(post=self.post, user=self.user, text='reply', parent=comment)
+        CommentLike.objects.create(comment=comment, user=self.fan, like=True)
+        for name in ('post_detail', 'async_post_detail'):
+            with self.subTest(name):
+                get_cache().clear()
+                data = self.get(name, self.post.pk, fields='id,comments.text,comments.subcomments.text')
+                self.assertEqual(data, {'id': self.post.pk,
+                                        'comments': [{'text': 'comment', 'subcomments': [{'text': 'reply'}]}]})
+                # Флаг досчитывается поверх кэша, для этого в ответе остаётся id
+                data = self.get(name, self.post.pk, fields='comments.is_liked')
+                self.assertEqual(data, {'comments': [{'id': comment.pk, 'is_liked': True}]})
+
+        data = self.get('comment-detail', comment.pk, fields='id,text,subcomments.text')
+        self.assertEqual(data, {'id': comment.pk, 'text': 'comment', 'subcomments': [{'text': 'reply'}]})
+
+    def test_expand(self):
+        data = self.get('follow-list')
+        self.assertEqual(data['results'][0]['follower'], self.fan.pk)
+        data = self.get('follow-list', expand='follower', fields='follower.username,following')
+        self.assertEqual(data['results'][0], {'follower': {'username': 'fan'}, 'following': self.user.pk})
+
+    def test_renderer_matches_drf(self):
+        data = {'id': 1, 'date': timezone.now(), 'price': Decimal('1.50'), 'uuid': uuid.uuid4(),
+                'text': 'строка\u2028', 'nested': [{'a': None}]}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertIn(b'\\u2028', FastJSONRenderer().render(data))
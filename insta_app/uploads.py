@@ -0,0 +1,126 @@
+import hashlib
+import os
+from django.conf import settings
+from django.core.files import File, locks
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from .models import PostContent, UploadSession
+
+
+# Загрузка больших файлов частями: каждая часть - отдельный короткий запрос,
+# байты сразу пишутся в CHUNKED_UPLOAD_DIR/<id>.part, в памяти держится один буфер
+READ_SIZE = 64 * 1024
+
+
+class OffsetConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Смещение не совпадает с уже загруженным объёмом'
+    default_code = 'offset_conflict'
+
+
+class PartFile(File):
+    # Готовый файл на диске: хранилище переносит его, а не копирует
+    def __init__(self, path, sha256):
+        super().__init__(open(path, 'rb'), name=path)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_upload_dir():
+    return getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'uploads'))
+
+
+def get_max_size():
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+
+
+def part_path(session):
+    return os.path.join(get_upload_dir(), f'{session.pk}.part')
+
+
+def uploaded_size(session):
+    # Источник правды - размер файла на диске: оборванная часть продолжается с него
+    try:
+        return os.path.getsize(part_path(session))
+    except FileNotFoundError:
+        return 0
+
+
+def append_chunk(session, stream, offset, length=None):
+    if session.status != UploadSession.STATUS_ACTIVE:
+        raise ValidationError('Загрузка уже завершена')
+    if length is not None and offset + length > session.size:
+        raise ValidationError('Часть выходит за объявленный размер файла')
+
+    os.makedirs(get_upload_dir(), exist_ok=True)
+    with open(part_path(session), 'ab') as part:
+        locks.lock(part, locks.LOCK_EX)
+        try:
+            part.seek(0, os.SEEK_END)
+            if part.tell() != offset:
+                raise OffsetConflict()
+            remaining = session.size - offset
+            while True:
+                chunk = stream.read(min(READ_SIZE, remaining + 1))
+                if not chunk:
+                    break
+                if len(chunk) > remaining:
+                    part.write(chunk[:remaining])
+                    part.flush()
+                    raise ValidationError('Часть выходит за объявленный размер файла')
+                part.write(chunk)
+                remaining -= len(chunk)
+            part.flush()
+            return part.tell()
+        finally:
+            locks.unlock(part)
+
+
+def file_digest(path):
+    with open(path, 'rb') as source:
+        return hashlib.file_digest(source, 'sha256').hexdigest()
+
+
+def finalize(session, checksum=None):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == UploadSession.STATUS_COMPLETE:
+            return session
+
+        expected = (checksum or session.checksum or '').lower()
+        if not expected:
+            raise ValidationError({'checksum': 'Нужна контрольная сумма sha256'})
+        if uploaded_size(session) != session.size:
+            raise ValidationError('Файл загружен не полностью')
+
+        path = part_path(session)
+        digest = file_digest(path)
+        if digest != expected:
+            # Испорченные данные не докачать - начинаем заново с нулевого смещения
+            os.remove(path)
+            raise ValidationError({'checksum': 'Контрольная сумма не совпадает'})
+
+        content = PostContent(post=session.post)
+        part = PartFile(path, digest)
+        try:
+            content.content.save(session.filename, part, save=False)
+        finally:
+            part.close()
+        content.save()
+        session.status = UploadSession.STATUS_COMPLETE
+        session.content = content
+        session.checksum = digest
+        session.save(update_fields=['status', 'content', 'checksum'])
+    if os.path.exists(path):
+        os.remove(path)
+    return session
+
+
+def discard(session):
+    path = part_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
@@ -3,25 +3,36 @@ from rest_framework.routers import SimpleRouter
 from .views import (
     UserProfileListAPIView,
     UserProfileDetailAPIView,
+    UserMutualsAPIView,
+    UserSuggestionsAPIView,
     PostListAPIView,
     PostDetailAPIView,
+    PostLikeAPIView,
+    FeedAPIView,
+    HashtagPostListAPIView,
+    TrendingAPIView,
     CommentViewSet,
     RegisterView,
     CustomLoginView,
     LogoutView,
     FollowViewSet,
     PostContentViewSet,
+    UploadSessionViewSet,
     PostLikeViewSet,
     CommentLikeViewSet,
+    NotificationViewSet,
 )
+from . import async_views
 
 router = SimpleRouter()
 
 router.register(r'follow', FollowViewSet)
 router.register(r'post_content', PostContentViewSet)
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
 router.register(r'post_likes', PostLikeViewSet)
 router.register(r'comments', CommentViewSet)
 router.register(r'comment_likes', CommentLikeViewSet)
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -33,7 +44,21 @@ urlpatterns = [
 
     path('user/', UserProfileListAPIView.as_view(), name='user_list'),
     path('user/<int:pk>/', UserProfileDetailAPIView.as_view(), name='user_detail'),
+    path('user/<int:pk>/mutuals/', UserMutualsAPIView.as_view(), name='user_mutuals'),
+    path('user/<int:pk>/suggestions/', UserSuggestionsAPIView.as_view(), name='user_suggestions'),
 
     path('post/', PostListAPIView.as_view(), name='post_list'),
     path('post/<int:pk>/', PostDetailAPIView.as_view(), name='post_detail'),
+    path('post/<int:pk>/like/', PostLikeAPIView.as_view(), name='post_like'),
+
+    path('feed/', FeedAPIView.as_view(), name='feed'),
+
+    # Те же ответы для ASGI: асинхронный ORM, независимые запросы одновременно
+    path('async/post/', async_views.post_list, name='async_post_list'),
+    path('async/post/<int:pk>/', async_views.post_detail, name='async_post_detail'),
+    path('async/user/<int:pk>/', async_views.user_detail, name='async_user_detail'),
+    path('async/feed/', async_views.feed, name='async_feed'),
+
+    path('hashtag/<str:name>/', HashtagPostListAPIView.as_view(), name='hashtag_posts'),
+    path('trending/', TrendingAPIView.as_view(), name='trending'),
 ]
\ No newline at end of file
@@ -0,0 +1,61 @@
+from .models import Follow, PostLike, CommentLike
+
+
+# Состояние текущего пользователя для целой страницы: один IN (...) запрос на поле
+def liked_post_ids(user, post_ids):
+    if not user.is_authenticated or not post_ids:
+        return set()
+    return set(PostLike.objects.filter(user=user, post_id__in=post_ids, like=True)
+               .values_list('post_id', flat=True))
+
+
+def liked_comment_ids(user, comment_ids):
+    if not user.is_authenticated or not comment_ids:
+        return set()
+    return set(CommentLike.objects.filter(user=user, comment_id__in=comment_ids, like=True)
+               .values_list('comment_id', flat=True))
+
+
+def following_ids(user, user_ids):
+    if not user.is_authenticated or not user_ids:
+        return set()
+    return set(Follow.objects.filter(follower=user, following_id__in=user_ids)
+               .values_list('following_id', flat=True))
+
+
+def walk_comments(comments):
+    # Все узлы уже собранных деревьев комментариев
+    stack = list(comments)
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(getattr(comment, 'tree_subcomments', []))
+
+
+# fields - поля сериализатора в ответе: для отброшенных через ?fields= запросов нет
+VIEWER_FIELDS = ('is_liked', 'is_following')
+
+
+def post_viewer_state(user, posts, fields=VIEWER_FIELDS):
+    state = {}
+    if 'is_liked' in fields:
+        state['liked_post_ids'] = liked_post_ids(user, {post.id for post in posts})
+    if 'is_following' in fields:
+        state['following_ids'] = following_ids(user, {post.user_id for post in posts if post.user_id})
+    return state
+
+
+def comment_viewer_state(user, comments, fields=VIEWER_FIELDS):
+    comments = list(walk_comments(comments))
+    state = {}
+    if 'is_liked' in fields:
+        state['liked_comment_ids'] = liked_comment_ids(user, {comment.id for comment in comments})
+    if 'is_following' in fields:
+        state['following_ids'] = following_ids(user, {comment.user_id for comment in comments})
+    return state
+
+
+def user_viewer_state(user, users, fields=VIEWER_FIELDS):
+    if 'is_following' not in fields:
+        return {}
+    return {'following_ids': following_ids(user, {obj.id for obj in users})}
@@ -1,15 +1,35 @@
 from .models import (UserProfile, Post, Comment, Follow, PostContent,
-                     PostLike, CommentLike)
-from .serializers import (UserProfileListSerializer, UserProfileDetailSerializer,
-                          PostListSerializer, PostDetailSerializer, CommentSerializer,
-                          UserSerializer, LoginSerializer, FollowSerializer,
-                          PostContentSerializer, PostLikeSerializer, CommentLikeSerializer)
-from rest_framework import viewsets, generics, status
+                     PostLike, CommentLike, UploadSession, Notification)
+from .serializers import (UserProfileListSerializer, UserProfileListViewerSerializer,
+                          UserProfileDetailSerializer, PostListSerializer, PostDetailSerializer,
+                          CommentSerializer, UserSerializer, LoginSerializer, FollowSerializer,
+                          PostContentSerializer, PostLikeSerializer, CommentLikeSerializer,
+                          TrendingHashtagSerializer, UploadSessionSerializer, NotificationSerializer,
+                          sparse_variant, wants_field)
+from rest_framework import viewsets, generics, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
+from .feed import feed_queryset, feed_page
+from .comment_tree import attach_comment_tree, load_post_comments, parse_tree_options, tree_user_ids
+from .search import FullTextSearchFilter
+from .viewer import (post_viewer_state, comment_viewer_state, user_viewer_state,
+                     liked_post_ids, liked_comment_ids, following_ids)
+from .response_cache import cached_representation, get_stamps
+from .hashtags import trending, hashtag_page, TRENDING_WINDOW_HOURS, TRENDING_LIMIT
+from .pagination import PostIndexPagination
+from .uploads import append_chunk, finalize, discard
+from .likes import set_like, POST_LIKES, COMMENT_LIKES
+from .db_router import read_from_replica, read_from_primary
+from .authentication import revoke
+from .notifications import unread_count, mark_read
+from .follow_graph import graph
+from .bulk import (CREATE, TOGGLE, DELETE, PostLikeBulkWriter,
+                   CommentLikeBulkWriter, FollowBulkWriter)
 
 
 class RegisterView(generics.CreateAPIView):
@@ -39,47 +59,306 @@ class CustomLoginView(TokenObtainPairView):
 class LogoutView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         try:
-            refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
-            token.blacklist()
+            revoke(request.data["refresh"])
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileListAPIView(generics.ListAPIView):
+def walk_comment_data(comments):
+    stack = list(comments)
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(comment.get('subcomments', []))
+
+
+def set_comment_viewer_fields(comments, liked, following):
+    # Флаги ставятся только тем комментариям, у которых они выбраны (?fields=)
+    for comment in comments:
+        if 'is_liked' in comment:
+            comment['is_liked'] = comment['id'] in liked
+        if 'is_following' in comment:
+            comment['is_following'] = comment['user'] in following
+
+
+def post_cache_dependencies(post):
+    # Кэш поста зависит от полей автора поста и авторов комментариев (имя, аватар)
+    user_ids = tree_user_ids(getattr(post, 'loaded_comments', None) or [])
+    user_ids.add(post.user_id)
+    return [('author', user_id) for user_id in user_ids if user_id is not None]
+
+
+def comment_viewer_keys(comments):
+    # -> (id для is_liked, авторы для is_following)
+    return ({comment['id'] for comment in comments if 'is_liked' in comment},
+            {comment['user'] for comment in comments if 'is_following' in comment})
+
+
+class ReplicaReadMixin:
+    # GET/HEAD читают с реплики (если она настроена); свежесть в пределах отставания репликации
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ViewerStateMixin:
+    # is_liked / is_following для всей страницы передаются в контексте сериализатора
+    def get_viewer_state(self, objects, fields):
+        return {}
+
+    def get_serializer(self, instance=None, *args, **kwargs):
+        if instance is None:
+            return super().get_serializer(instance, *args, **kwargs)
+        many = kwargs.get('many')
+        objects = list(instance) if many else [instance]
+        context = kwargs['context'] = self.get_serializer_context()
+        serializer = super().get_serializer(objects if many else instance, *args, **kwargs)
+        # Считаем только то, что попало в ответ (?fields=); контекст у сериализатора тот же объект
+        fields = (serializer.child if many else serializer).fields
+        context.update(self.get_viewer_state(objects, fields))
+        return serializer
+
+
+class PostViewerStateMixin(ViewerStateMixin):
+    def get_viewer_state(self, objects, fields):
+        return post_viewer_state(self.request.user, objects, fields)
+
+    def filter_queryset(self, queryset):
+        # Автора и первый контент (with_list_data) не загружаем, если их нет в ?fields=
+        queryset = super().filter_queryset(queryset)
+        if not wants_field(self.request, 'first_content'):
+            queryset = queryset.prefetch_related(None)
+        if not wants_field(self.request, 'user'):
+            queryset = queryset.select_related(None)
+        return queryset
+
+
+class CachedRetrieveMixin:
+    # Общая для всех часть ответа берётся из response_cache,
+    # поля конкретного пользователя досчитываются поверх в add_viewer_fields
+    cache_kind = None
+
+    def get_cache_variant(self):
+        return self.request.build_absolute_uri('/') + sparse_variant(self.request)
+
+    def get_cache_dependencies(self, instance):
+        return []
+
+    def build_representation(self):
+        with read_from_primary():
+            instance = self.get_object()
+            dep_stamps = get_stamps(self.get_cache_dependencies(instance))
+            return self.get_serializer(instance).data, dep_stamps
+
+    def add_viewer_fields(self, data):
+        return data
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        data = cached_representation(self.cache_kind, pk, self.get_cache_variant(),
+                                     self.build_representation)
+        return Response(self.add_viewer_fields(dict(data)))
+
+
+class UserProfileListAPIView(ReplicaReadMixin, ViewerStateMixin, generics.ListAPIView):
     queryset = UserProfile.objects.all()
-    serializer_class = UserProfileListSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    serializer_class = UserProfileListViewerSerializer
+    filter_backends = [FullTextSearchFilter, OrderingFilter]
     search_fields = ['username', 'bio']
     ordering_fields = ['date_registered']
+    ordering = ['-date_registered', '-id']
+
+    def get_viewer_state(self, objects, fields):
+        return user_viewer_state(self.request.user, objects, fields)
 
 
-class UserProfileDetailAPIView(generics.RetrieveAPIView):
+class UserProfileDetailAPIView(ReplicaReadMixin, CachedRetrieveMixin, generics.RetrieveAPIView):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileDetailSerializer
+    cache_kind = 'user'
+
+
+class FollowGraphAPIView(ReplicaReadMixin, generics.GenericAPIView):
+    # Ответ считается по графу подписок в памяти (follow_graph.py), из базы - только профили;
+    # пока граф загружается после старта процесса - ограниченными запросами к базе
+    serializer_class = UserProfileListSerializer
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self):
+        try:
+            value = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            return self.default_limit
+        return min(max(value, 1), self.max_limit)
+
+    def check_user(self, pk):
+        if not UserProfile.objects.filter(pk=pk).exists():
+            raise NotFound('Пользователь не найден')
+
+    def get_users(self, ids):
+        users = UserProfile.objects.in_bulk(ids)
+        return [users[pk] for pk in ids if pk in users]
+
 
+class UserMutualsAPIView(FollowGraphAPIView):
+    # Кто из тех, на кого я подписан, подписан на пользователя <pk>
+    permission_classes = [IsAuthenticated]
 
-class PostListAPIView(generics.ListAPIView):
+    def get(self, request, pk):
+        self.check_user(pk)
+        ids = graph.mutuals(request.user.pk, pk)
+        users = self.get_users(ids[:self.get_limit()])
+        return Response({'count': len(ids), 'results': self.get_serializer(users, many=True).data})
+
+
+class UserSuggestionsAPIView(FollowGraphAPIView):
+    # Возможно, вы знакомы: друзья друзей по числу общих связей
+    def get(self, request, pk):
+        self.check_user(pk)
+        ranked = graph.suggestions(pk, self.get_limit())
+        mutual_counts = dict(ranked)
+        data = self.get_serializer(self.get_users([user_id for user_id, _ in ranked]), many=True).data
+        for item in data:
+            item['mutual_count'] = mutual_counts[item['id']]
+        return Response({'results': data})
+
+
+class PostListAPIView(ReplicaReadMixin, PostViewerStateMixin, generics.ListAPIView):
     queryset = Post.objects.all()
     serializer_class = PostListSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['user', 'hashtag']
     search_fields = ['user__username', 'description', 'hashtag']
     ordering_fields = ['created_date']
+    ordering = ['-created_date', '-id']
 
+    def get_queryset(self):
+        return Post.objects.with_list_data()
 
-class PostDetailAPIView(generics.RetrieveAPIView):
-    queryset = Post.objects.all()
+
+class PostDetailAPIView(ReplicaReadMixin, CachedRetrieveMixin, generics.RetrieveAPIView):
+    queryset = Post.objects.select_related('user')
     serializer_class = PostDetailSerializer
+    cache_kind = 'post'
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['comment_tree'] = parse_tree_options(self.request.query_params)
+        return context
+
+    def get_cache_variant(self):
+        options = parse_tree_options(self.request.query_params)
+        return f'{super().get_cache_variant()}|{sorted(options.items())}'
+
+    def get_object(self):
+        post = super().get_object()
+        if wants_field(self.request, 'comments'):
+            # Дерево нужно до чтения версий кэша: авторы комментариев - его зависимости
+            post.loaded_comments = load_post_comments(post, **parse_tree_options(self.request.query_params))
+        return post
+
+    def get_cache_dependencies(self, instance):
+        return post_cache_dependencies(instance)
+
+    def add_viewer_fields(self, data):
+        user = self.request.user
+        if 'is_liked' in data:
+            # id может не быть в ответе (?fields=)
+            pk = self.kwargs['pk']
+            data['is_liked'] = pk in liked_post_ids(user, [pk])
+        comments = list(walk_comment_data(data.get('comments', [])))
+        comment_ids, author_ids = comment_viewer_keys(comments)
+        set_comment_viewer_fields(comments, liked_comment_ids(user, comment_ids), following_ids(user, author_ids))
+        return data
+
+
+class PostLikeAPIView(generics.GenericAPIView):
+    # POST - поставить лайк, DELETE - снять; повторный запрос ничего не меняет
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        return Response(set_like(POST_LIKES, pk, request.user, True))
+
+    def delete(self, request, pk):
+        return Response(set_like(POST_LIKES, pk, request.user, False))
+
+
+class FeedAPIView(ReplicaReadMixin, PostViewerStateMixin, generics.ListAPIView):
+    serializer_class = PostListSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = PostIndexPagination
+
+    def get_queryset(self):
+        return feed_queryset(self.request.user)
+
+    def get_page_keys(self, ordering, position, limit):
+        return feed_page(self.request.user, ordering, position, limit)
+
+
+class HashtagPostListAPIView(ReplicaReadMixin, PostViewerStateMixin, generics.ListAPIView):
+    serializer_class = PostListSerializer
+    pagination_class = PostIndexPagination
+
+    def get_queryset(self):
+        return Post.objects.with_list_data()
+
+    def get_page_keys(self, ordering, position, limit):
+        return hashtag_page(self.kwargs['name'].lower(), ordering, position, limit)
+
+
+class TrendingAPIView(ReplicaReadMixin, generics.GenericAPIView):
+    serializer_class = TrendingHashtagSerializer
+    max_hours = 7 * 24
+
+    def get(self, request, *args, **kwargs):
+        hours = self._int_param('hours', TRENDING_WINDOW_HOURS, self.max_hours)
+        limit = self._int_param('limit', TRENDING_LIMIT, 50)
+        serializer = self.get_serializer(trending(hours, limit), many=True)
+        return Response(serializer.data)
+
+    def _int_param(self, name, default, maximum):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            return default
+        return min(max(value, 1), maximum)
+
+
+class BulkWriteMixin:
+    # POST bulk_create/, bulk_toggle/, bulk_delete/ со списком объектов в теле;
+    # в ответе статус для каждого элемента по порядку. Автор действия (user, follower) -
+    # текущий пользователь: его можно не передавать, чужой id - ошибка элемента
+    bulk_writer_class = None
+
+    def bulk_write(self, request, action):
+        results = self.bulk_writer_class(action, request.user.pk).apply(request.data)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_create(self, request):
+        return self.bulk_write(request, CREATE)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_toggle(self, request):
+        return self.bulk_write(request, TOGGLE)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_delete(self, request):
+        return self.bulk_write(request, DELETE)
 
 
 # Новые ViewSet'ы
-class FollowViewSet(viewsets.ModelViewSet):
-    queryset = Follow.objects.all()
+class FollowViewSet(BulkWriteMixin, viewsets.ModelViewSet):
+    queryset = Follow.objects.select_related('follower', 'following')
     serializer_class = FollowSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['follower', 'following']
+    ordering = ['-create_date', '-id']
+    bulk_writer_class = FollowBulkWriter
 
 
 class PostContentViewSet(viewsets.ModelViewSet):
@@ -87,25 +366,119 @@ class PostContentViewSet(viewsets.ModelViewSet):
     serializer_class = PostContentSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['post']
+    ordering = ['id']
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                          mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    # POST - новая загрузка, PATCH - часть с заголовком Upload-Offset,
+    # GET - сколько уже загружено, POST finalize/ - проверка sha256 и PostContent
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def partial_update(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            offset = -1
+        if offset < 0:
+            raise ValidationError({'Upload-Offset': 'Ожидается неотрицательное целое число'})
+        try:
+            length = int(request.headers.get('Content-Length') or 0) or None
+        except ValueError:
+            length = None
+        # Тело читается из потока кусками, request.data не трогаем
+        if request.stream is not None:
+            append_chunk(session, request.stream, offset, length)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = finalize(self.get_object(), request.data.get('checksum'))
+        return Response(self.get_serializer(session).data)
 
+    def perform_destroy(self, instance):
+        discard(instance)
 
-class PostLikeViewSet(viewsets.ModelViewSet):
-    queryset = PostLike.objects.all()
+
+class PostLikeViewSet(BulkWriteMixin, viewsets.ModelViewSet):
+    queryset = PostLike.objects.select_related('user')
     serializer_class = PostLikeSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['post', 'user']
+    ordering = ['-id']
+    bulk_writer_class = PostLikeBulkWriter
 
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all()
+class CommentViewSet(ViewerStateMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.select_related('user')
     serializer_class = CommentSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['post', 'user', 'parent']
     ordering_fields = ['created_date']
+    ordering = ['-created_date', '-id']
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['comment_tree'] = parse_tree_options(self.request.query_params)
+        return context
+
+    def get_serializer(self, instance=None, *args, **kwargs):
+        # Ответы для всей страницы загружаются одним запросом (если subcomments в ответе)
+        if instance is not None and wants_field(self.request, 'subcomments'):
+            options = parse_tree_options(self.request.query_params)
+            if kwargs.get('many'):
+                instance = attach_comment_tree(instance, **options)
+            else:
+                attach_comment_tree([instance], **options)
+        return super().get_serializer(instance, *args, **kwargs)
+
+    def get_viewer_state(self, objects, fields):
+        return comment_viewer_state(self.request.user, objects, fields)
+
+    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk=None):
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise NotFound('Объект не найден')
+        return Response(set_like(COMMENT_LIKES, pk, request.user, request.method == 'POST'))
 
 
-class CommentLikeViewSet(viewsets.ModelViewSet):
-    queryset = CommentLike.objects.all()
+class CommentLikeViewSet(BulkWriteMixin, viewsets.ModelViewSet):
+    queryset = CommentLike.objects.select_related('user')
     serializer_class = CommentLikeSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['comment', 'user']
\ No newline at end of file
+    filterset_fields = ['comment', 'user']
+    ordering = ['-id']
+    bulk_writer_class = CommentLikeBulkWriter
+
+
+class NotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    # Список - по курсору от новых к старым; группа, в которую пришло событие, поднимается наверх
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    ordering = ['-updated_date', '-id']
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).select_related('last_actor')
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread_count': unread_count(request.user)})
+
+    @action(detail=False, methods=['post'])
+    def read(self, request):
+        # Без ids - отметить прочитанными все
+        ids = request.data.get('ids')
+        if ids is not None and (not isinstance(ids, list)
+                                or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids)):
+            raise ValidationError({'ids': 'Ожидается список целых чисел'})
+        return Response({'updated': mark_read(request.user, ids)})
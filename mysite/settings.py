@@ -31,6 +31,7 @@ INSTALLED_APPS = [
     'insta_app',
     'django_filters',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'allauth',
     'allauth.account',
     'allauth.socialaccount',
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'insta_app.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +76,54 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# Профиль задаётся через DB_PROFILE:
+#   sqlite   - один узел; WAL (читатели не ждут писателя), busy_timeout вместо мгновенного
+#              "database is locked", synchronous=NORMAL и mmap для чтения. IMMEDIATE берёт
+#              блокировку записи в начале транзакции, чтобы не ловить отказ при её повышении.
+#              WAL хранится в самом файле базы и включается один раз миграцией 0016, а не
+#              при каждом подключении (иначе любая команда manage.py переписывает файл базы).
+#              synchronous=NORMAL ставится только после проверки, что база в WAL: в режиме
+#              DELETE он небезопасен при отключении питания, там остаётся FULL (signals.py)
+#   postgres - постоянные соединения и реплики на чтение из POSTGRES_REPLICA_HOSTS
+#              (через запятую); GET списков и карточек уходят на реплики (insta_app/db_router.py)
+DB_PROFILE = os.getenv('DB_PROFILE', 'sqlite')
+
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
 }
 
+if DB_PROFILE == 'postgres':
+    _postgres = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'insta'),
+        'USER': os.getenv('POSTGRES_USER', 'insta'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+    DATABASES = {'default': _postgres}
+    for _number, _host in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica_{_number}'] = {**_postgres, 'HOST': _host.strip(), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DATABASE_ROUTERS = ['insta_app.db_router.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -127,6 +170,83 @@ STATIC_URL = 'static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# content - картинки постов и аватары, хранятся один раз по sha256 (insta_app/storage.py)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'content': {'BACKEND': 'insta_app.storage.ContentAddressedStorage'},
+}
+# Раздача медиа (insta_app/serve.py): sendfile - сам Django через FileResponse,
+# x-accel-redirect / x-sendfile - отдаёт веб-сервер (nginx internal location / mod_xsendfile)
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'sendfile')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 3600
+# Загрузка частями (insta_app/uploads.py): недокачанные файлы и предельный размер
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+# Очередь задач в базе (insta_app/tasks.py), выполняет `manage.py run_workers`:
+# раскладка постов по лентам (/feed/), рендишены, уведомления. При DEBUG=False нужен
+# хотя бы один процесс run_workers, иначе новые посты и подписки не дойдут до ленты.
+# TASKS_EAGER - выполнять задачи сразу при постановке, без воркеров; не задан - как DEBUG
+# (runserver в разработке обходится без воркеров)
+TASKS_EAGER = os.getenv('TASKS_EAGER', '').lower() in ('1', 'true', 'yes') if os.getenv('TASKS_EAGER') else None
+TASKS_BATCH_SIZE = 10
+TASKS_RETRY_DELAY = 2
+TASKS_MAX_BACKOFF = 3600
+TASKS_LOCK_TIMEOUT = 600
+# Граф подписок в памяти (insta_app/follow_graph.py): догрузка новых подписок других
+# процессов, полная пересборка и порог накопленных изменений до пересборки
+FOLLOW_GRAPH_REFRESH = 30
+FOLLOW_GRAPH_REBUILD = 3600
+FOLLOW_GRAPH_MAX_DELTA = 100000
 
 AUTH_USER_MODEL = 'insta_app.UserProfile'
 
+# Кэш сериализованных профилей и постов (insta_app/response_cache.py).
+# По умолчанию локальная память процесса, любой другой бэкенд задаётся через окружение.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'insta'),
+    }
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Асинхронные представления (insta_app/async_views.py) выполняют независимые запросы
+# одновременно, каждый в своём потоке и соединении; False - по очереди
+ASYNC_PARALLEL_QUERIES = True
+
+# Замеры запросов (insta_app/metrics.py): доля запросов в выборке (0 - выключено),
+# заголовок Server-Timing и токен для /metrics (пустой - без проверки)
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 1.0))
+METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', str(DEBUG)).lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'insta_app.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+    # orjson - необязательная зависимость: без него FastJSONRenderer работает как JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'insta_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'insta_app.authentication.CachedJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+# JWT (insta_app/authentication.py): в токене хэш пароля - после смены пароля старые
+# токены недействительны. Пользователь по токену кэшируется в процессе на JWT_USER_CACHE_TTL
+# секунд, отозванные сеансы - фильтр Блума, догружается раз в JWT_BLACKLIST_REFRESH секунд
+SIMPLE_JWT = {
+    'CHECK_REVOKE_TOKEN': True,
+}
+JWT_USER_CACHE_TTL = 30
+JWT_USER_CACHE_SIZE = 10000
+JWT_BLACKLIST_REFRESH = 30
+JWT_BLACKLIST_REBUILD = 3600
+
@@ -1,10 +1,16 @@
+import re
 from django.conf.urls.i18n import i18n_patterns
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from insta_app.serve import serve_media
+from insta_app.metrics import metrics_view
 
 urlpatterns =i18n_patterns(
     path('admin/', admin.site.urls),
     path('', include('insta_app.urls')),
-)+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+)+ [
+    path('metrics', metrics_view, name='metrics'),
+    # Медиа отдаются и без DEBUG: Range, ETag, кэш-заголовки, X-Accel-Redirect/X-Sendfile
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]